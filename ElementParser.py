@@ -28,6 +28,7 @@ rules = [
     WordRule("UNIT", "ppt", ignore_case=True),
     WordRule("UNIT", "ppm", ignore_case=True),
     WordRule("UNIT", "g/t", ignore_case=True),
+    WordRule("UNIT", "oz/t", ignore_case=True),
     CharacterRule("UNIT", "%"),
     ElementNameRule()
     #AlphaNumericRule()
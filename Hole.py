@@ -1,14 +1,22 @@
 from dataclasses import dataclass
-from enum import Enum
-from typing import List, Tuple
-import hashlib
-
-class AssayUnit(Enum):
-    PPM = 1,
-    PPB = 2,
-    PPT = 3,
-    Percent = 4
-    GPT = 5
+from typing import Dict, List, Optional, Tuple
+
+from intervals import IntervalIndex, check_depth_window, length_weighted_grades
+from units import AssayUnit, convert, unit_text
+
+# Every (element, base unit) pair is given a small id, counting up from 0, the first time an
+# AssayType is made for it. Ids are only meaningful within one process.
+_assay_ids = {}
+assay_keys: List[Tuple[str, AssayUnit]] = []
+
+def assay_id(element: str, base_unit: AssayUnit) -> int:
+    """ Returns the id of an (element, base unit) pair, registering the pair if it is new """
+    key = (element, base_unit)
+    unique_id = _assay_ids.get(key)
+    if unique_id is None:
+        unique_id = _assay_ids[key] = len(assay_keys)
+        assay_keys.append(key)
+    return unique_id
  
 @dataclass
 class AssayType:
@@ -16,10 +24,20 @@ class AssayType:
     base_unit: AssayUnit
     reported_unit: AssayUnit = None
 
+    def __post_init__(self):
+        self._id = assay_id(self.element, self.base_unit)
+
     def __hash__(self) -> int:
+        return self._id
+
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not AssayType:
+            return NotImplemented
+        return self._id == other._id and self.reported_unit == other.reported_unit
 
-        sha256_hash = hashlib.sha256((self.element + self.base_unit.name).encode('utf-8')).hexdigest()  # Calculate the SHA-256 hash
-        return hash(self.element + self.base_unit.name)
+    def __reduce__(self):
+        # Another process may have given the pair a different id, so it is registered again there
+        return (AssayType, (self.element, self.base_unit, self.reported_unit))
     
     def __repr__(self) -> str:
         return f"<AssayType: {self.element} in {self.base_unit.name}>"
@@ -27,42 +45,16 @@ class AssayType:
     def __str__(self) -> str:
         return f"{self.element} in {self.base_unit.name}"
     
-    def get_unique_id(self):
-        return self.__hash__()
+    def get_unique_id(self) -> int:
+        """ The id of this assay's element and base unit, which can index a list directly """
+        return self._id
     
     def convert_to_reported_unit(self, value):
-        # Define conversion factors
-        conversion_factors = {
-            AssayUnit.PPM: 1,
-            AssayUnit.PPB: 1000,
-            AssayUnit.Percent: 10000,
-            AssayUnit.GPT: 1
-        }
-
-        # Check if units are valid
-        if self.base_unit not in conversion_factors or self.reported_unit not in conversion_factors:
-            raise ValueError("Invalid units")
-        
-        if self.base_unit == self.reported_unit:
-            return value
-
-        # Convert to PPM
-        ppm_value = value * conversion_factors[self.base_unit]
-
-        # Convert from PPM to the desired unit
-        result = ppm_value / conversion_factors[self.reported_unit]
-
-        return result
+        """ Converts a value, or a NumPy array of values, from the base unit to the reported unit """
+        return convert(value, self.base_unit, self.reported_unit)
     
     def reported_unit_text(self):
-        text = {
-            AssayUnit.PPM: 'ppm',
-            AssayUnit.PPB: 'ppb',
-            AssayUnit.Percent: '%',
-            AssayUnit.GPT: 'g/t'
-        }
-
-        return text[self.reported_unit]
+        return unit_text(self.reported_unit)
     
 @dataclass
 class Intercept:
@@ -101,10 +93,7 @@ class IntervalData:
     
     def get_assay(self, assay_type: AssayType):
         #print(f"Assay Type Requested: {type}")
-        if assay_type.get_unique_id() in self.assay_data:
-            return self.assay_data[assay_type.get_unique_id()]
-        
-        return None
+        return self.assay_data.get(assay_type._id)
 
     def __repr__(self) -> str:
         try:
@@ -113,25 +102,66 @@ class IntervalData:
             return f"<Interval ({self.span} @ NaN)>"
     
     def calculate_concentration_metres(self, assay: AssayType):
-        return self.assay_data[assay.get_unique_id()] * self.get_length()
+        return self.assay_data[assay._id] * self.get_length()
 
 @dataclass
 class HoleData:
     holeID: str
     intervals: List[IntervalData] = None
 
+    def __post_init__(self):
+        # A copy of `intervals` sorted by From, made the first time it is asked for and only made
+        # again once an interval is added out of order. `intervals` keeps the order they were added in
+        self._sorted_intervals = None
+        self._index = None
+
     def add(self, interval: IntervalData):
 
         if not self.intervals:
             self.intervals = []
 
         self.intervals.append(interval)
+        self._index = None
+
+        # The sort is stable, so an interval that starts at or after the last one sorts to the end
+        if self._sorted_intervals is not None:
+            if self._sorted_intervals and interval.start() < self._sorted_intervals[-1].start():
+                self._sorted_intervals = None
+            else:
+                self._sorted_intervals.append(interval)
 
     def get_intervals(self):
         if not self.intervals:
             self.intervals = []
 
-        return sorted(self.intervals, key = lambda x: x.start())
+        if self._sorted_intervals is None:
+            self._sorted_intervals = sorted(self.intervals, key = lambda x: x.start())
+
+        return list(self._sorted_intervals)
+
+    def interval_index(self) -> IntervalIndex:
+        """ An IntervalIndex over get_intervals() """
+        if self._index is None:
+            intervals = self.get_intervals()
+            self._index = IntervalIndex([i.start() for i in intervals], [i.end() for i in intervals])
+        return self._index
+
+    def query_depth(self, depth_from: float, depth_to: float, analytes: List[AssayType] = None) -> Dict[AssayType, Optional[float]]:
+        """
+        The length weighted grade of each of `analytes` between `depth_from` and `depth_to`, where
+        an interval only partly inside the window counts for the part inside it. With `analytes`
+        set to None, every analyte recorded in the hole is included.
+        """
+        check_depth_window(depth_from, depth_to)
+        intervals = self.get_intervals()
+        if analytes is None:
+            ids = sorted({unique_id for interval in intervals for unique_id in interval.assay_data})
+            analytes = [AssayType(*assay_keys[unique_id]) for unique_id in ids]
+
+        index = self.interval_index()
+        positions = index.overlapping(depth_from, depth_to)
+        columns = [[intervals[p].get_assay(analyte) for p in positions] for analyte in analytes]
+        return length_weighted_grades(analytes, columns, index.overlap_lengths(positions, depth_from, depth_to))
     
     def group_contiguous_intervals(self) -> List[List[IntervalData]]:
         groups = []
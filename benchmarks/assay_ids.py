@@ -0,0 +1,96 @@
+# Times the python intercept engine with interned assay ids against the SHA-256 based hashing
+# AssayType used before, on both the dict of HoleData and the HoleStore, and checks both give
+# the same intercepts. The old hashing and lookups are patched back in for the comparison.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.assay_ids [path/to/export.csv]
+import hashlib
+import sys
+import time
+import timeit
+from contextlib import contextmanager
+
+from columnar import HoleStore
+from config import config
+from Hole import AssayType, AssayUnit, IntervalData
+from library import calculate_intercepts_from_group, load_assay_list
+from refactor import build_interval_data_table, ingest_export
+
+
+def legacy_hash(self):
+    hashlib.sha256((self.element + self.base_unit.name).encode('utf-8')).hexdigest()
+    return hash(self.element + self.base_unit.name)
+
+def legacy_get_assay(self, assay_type):
+    if assay_type.get_unique_id() in self.assay_data:
+        return self.assay_data[assay_type.get_unique_id()]
+    return None
+
+def legacy_concentration_metres(self, assay):
+    return self.assay_data[assay.get_unique_id()] * self.get_length()
+
+def legacy_column_of(self, assay):
+    # The HoleStore used to look analytes up by their element and base unit (see main)
+    return self._legacy_index.get((assay.element, assay.base_unit))
+
+@contextmanager
+def legacy_ids():
+    patches = [
+        (AssayType, '__hash__', legacy_hash),
+        (AssayType, 'get_unique_id', legacy_hash),
+        (IntervalData, 'get_assay', legacy_get_assay),
+        (IntervalData, 'calculate_concentration_metres', legacy_concentration_metres),
+        (HoleStore, 'column_of', legacy_column_of),
+    ]
+    originals = [(cls, name, cls.__dict__[name]) for cls, name, _ in patches]
+    for cls, name, function in patches:
+        setattr(cls, name, function)
+    try:
+        yield
+    finally:
+        for cls, name, function in originals:
+            setattr(cls, name, function)
+
+def run_queries(groups, assay_list):
+    began = time.perf_counter()
+    intercepts = [
+        [(i.concentration, i.distance, i.span, list(i.co_analytes.values())) for i in calculate_intercepts_from_group(group, assay, cutoff, coans)]
+        for group in groups for assay, cutoffs, coans in assay_list for cutoff in cutoffs
+    ]
+    return intercepts, time.perf_counter() - began
+
+def compare(label, build_groups, assay_list):
+    with legacy_ids():
+        expected, legacy_time = run_queries(build_groups(), assay_list)
+    found, interned_time = run_queries(build_groups(), assay_list)
+
+    print(f"{label}: SHA-256 hashing {legacy_time:.2f} s, interned ids {interned_time:.2f} s "
+          f"({legacy_time / interned_time:.2f}x)  {'identical' if expected == found else 'MISMATCH'}")
+    return expected == found
+
+def main():
+    file_name = sys.argv[1] if len(sys.argv) > 1 else config.settings.exported_data_path
+    assay_list = load_assay_list('queries.toml')
+
+    assay = AssayType('Cu', AssayUnit.PPM)
+    with legacy_ids():
+        legacy = timeit.timeit(assay.get_unique_id, number=200000)
+    interned = timeit.timeit(assay.get_unique_id, number=200000)
+    print(f"get_unique_id: SHA-256 hashing {legacy / 0.2:.2f} us, interned ids {interned / 0.2:.2f} us per call")
+
+    # The dict of HoleData is keyed by assay ids, so it is built again under each scheme
+    def interval_groups():
+        table = build_interval_data_table(file_name, 0)
+        return [group for hole in table.values() for group in hole.group_contiguous_intervals()]
+    identical = compare("dict[str, HoleData]", interval_groups, assay_list)
+
+    store, _ = ingest_export(file_name)
+    store._legacy_index = {(a.element, a.base_unit): k for k, a in enumerate(store.analytes)}
+    identical &= compare("HoleStore", lambda: [group for hole in store for group in store[hole].group_contiguous_intervals()], assay_list)
+
+    if not identical:
+        sys.exit("Interned assay ids give different intercepts")
+
+
+if __name__ == '__main__':
+    main()
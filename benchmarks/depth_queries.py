@@ -0,0 +1,92 @@
+# Times depth window queries through the interval index against scanning every interval of the
+# hole, on both the dict of HoleData and the HoleStore, and checks the grades agree. Also times
+# asking a HoleData for its intervals repeatedly, now that they are only sorted once.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.depth_queries [path/to/export.csv] [windows per hole]
+import math
+import random
+import sys
+import time
+
+from config import config
+from library import query_depth
+from refactor import build_interval_data_table, ingest_export
+
+TOLERANCE = 1e-9
+
+
+def scan_depth(hole, depth_from, depth_to, analytes):
+    """ query_depth by looking at every interval of the hole """
+    totals = {analyte: [0.0, 0.0] for analyte in analytes}
+    for interval in hole.get_intervals():
+        length = min(interval.end(), depth_to) - max(interval.start(), depth_from)
+        if length <= 0:
+            continue
+        for analyte in analytes:
+            value = interval.get_assay(analyte)
+            if value is not None:
+                totals[analyte][0] += value * length
+                totals[analyte][1] += length
+    return {analyte: metres / length if length > 0 else None for analyte, (metres, length) in totals.items()}
+
+def agree(expected, found):
+    return all((a is None and b is None) or (a is not None and b is not None and math.isclose(a, b, rel_tol=TOLERANCE, abs_tol=TOLERANCE))
+               for a, b in zip(expected.values(), found.values()))
+
+def run(label, data_table, windows, analytes):
+    began = time.perf_counter()
+    expected = [scan_depth(data_table[hole], a, b, analytes) for hole, a, b in windows]
+    scan_time = time.perf_counter() - began
+
+    began = time.perf_counter()
+    found = [query_depth(data_table, hole, a, b, analytes) for hole, a, b in windows]
+    index_time = time.perf_counter() - began
+
+    identical = all(agree(e, f) for e, f in zip(expected, found))
+    print(f"{label}: {len(windows)} windows, scanning {scan_time:.2f} s, interval index {index_time:.2f} s "
+          f"({scan_time / index_time:.2f}x)  {'agree' if identical else 'MISMATCH'}")
+    return identical
+
+def main():
+    file_name = sys.argv[1] if len(sys.argv) > 1 else config.settings.exported_data_path
+    windows_per_hole = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    store, _ = ingest_export(file_name)
+    table = build_interval_data_table(file_name, 0)
+    analytes = store.analytes[:5]
+
+    generator = random.Random(0)
+    windows = []
+    for hole in store:
+        intervals = store[hole].get_intervals()
+        if not intervals:
+            continue
+        top, bottom = intervals[0].start(), intervals[-1].end()
+        for _ in range(windows_per_hole):
+            depth_from = generator.uniform(top, bottom)
+            windows.append((hole, depth_from, depth_from + generator.uniform(1, 25)))
+
+    identical = run("HoleStore", store, windows, analytes)
+    identical &= run("dict[str, HoleData]", table, windows, analytes)
+
+    began = time.perf_counter()
+    for _ in range(20):
+        for hole in table.values():
+            sorted(hole.intervals or [], key=lambda x: x.start())
+    sorting_time = time.perf_counter() - began
+
+    began = time.perf_counter()
+    for _ in range(20):
+        for hole in table.values():
+            hole.get_intervals()
+    sorted_once_time = time.perf_counter() - began
+    print(f"get_intervals x 20: sorting every call {sorting_time:.2f} s, sorted once {sorted_once_time:.2f} s "
+          f"({sorting_time / sorted_once_time:.2f}x)")
+
+    if not identical:
+        sys.exit("The interval index gives different grades")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Runs every hole of an export through both intercept engines and checks that they write
+# identical rows, then reports how long each engine took.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.engine_parity [path/to/export.csv] [queries.toml]
+import csv
+import io
+import sys
+import time
+
+from config import config
+from library import load_assay_list
+from refactor import analyse_hole, build_data_table
+
+
+def run_engine(engine, data_table, assay_list):
+    config.settings.intercept_engine = engine
+    output = io.StringIO(newline='')
+    writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC, escapechar='\\')
+
+    began = time.perf_counter()
+    for hole in data_table.keys():
+        analyse_hole(hole, writer, data_table, assay_list)
+
+    return output.getvalue().splitlines(), time.perf_counter() - began
+
+
+def main():
+    file_name = sys.argv[1] if len(sys.argv) > 1 else config.settings.exported_data_path
+    queries_path = sys.argv[2] if len(sys.argv) > 2 else 'queries.toml'
+
+    # Both engines have to calculate every intercept, rather than read back remembered rows
+    config.settings.result_cache = False
+
+    data_table = build_data_table(file_name, 0)
+    assay_list = load_assay_list(queries_path)
+
+    python_rows, python_time = run_engine("python", data_table, assay_list)
+    numpy_rows, numpy_time = run_engine("numpy", data_table, assay_list)
+
+    print(f"python engine: {len(python_rows)} rows in {python_time:.2f} s")
+    print(f"numpy engine:  {len(numpy_rows)} rows in {numpy_time:.2f} s")
+
+    mismatches = [(a, b) for a, b in zip(python_rows, numpy_rows) if a != b]
+    if len(python_rows) != len(numpy_rows) or mismatches:
+        for expected, found in mismatches[:10]:
+            print(f"  expected: {expected}\n  found:    {found}")
+        sys.exit("The engines disagree")
+
+    print("The engines produced identical intercepts")
+
+
+if __name__ == '__main__':
+    main()
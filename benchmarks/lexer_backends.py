@@ -0,0 +1,105 @@
+# Times parsall's DefaultLexer against the CompiledLexer, and checks that both give the same
+# tokens. Two workloads are lexed: generated C++ like source of the requested size, lexed with
+# rules that all compile to one scanner, and every header of an export, lexed with the rules of
+# ElementParser, where the separator and element rules still fall back to `match`.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.lexer_backends [path/to/export.csv] [source size in bytes]
+import csv
+import io
+import random
+import sys
+import time
+
+import ElementParser
+from config import config
+from library import open_export
+from parsall.core.rule import CharacterSet, CommentRule, IdentifierRule, NumberRule, StringRule, WordSet
+from parsall.lexing import CompiledLexer, DefaultLexer
+from parsall.semantics import cpp
+
+MULTI_CHARACTER_OPERATORS = [op for op in cpp.comparison_operators + cpp.bitwise_operators + cpp.assignment_operators if len(op) > 1]
+SINGLE_CHARACTER_OPERATORS = "".join(op for op in cpp.math_operators + cpp.bitwise_operators + cpp.assignment_operators + cpp.special_characters if len(op) == 1)
+
+SOURCE_RULES = [
+    CommentRule("//", "\n"),
+    StringRule(),
+    WordSet("keyword", cpp.keywords),
+    IdentifierRule(),
+    NumberRule(),
+    WordSet("operator", MULTI_CHARACTER_OPERATORS),
+    CharacterSet("operator", SINGLE_CHARACTER_OPERATORS),
+    CharacterSet("scope", "".join(cpp.scope_modifiers + cpp.index_operators)),
+    CharacterSet("terminal", "".join(cpp.terminals)),
+]
+
+
+def generate_source(size: int) -> str:
+    """ Random lines of keywords, identifiers, numbers, strings, operators and comments """
+    generator = random.Random(0)
+    words = cpp.keywords + ["value", "index", "count", "_buffer", "Hole", "assay_total", "x1", "y2"]
+    operators = MULTI_CHARACTER_OPERATORS + list(SINGLE_CHARACTER_OPERATORS)
+    lines, written = [], 0
+    while written < size:
+        parts = []
+        for _ in range(generator.randint(3, 12)):
+            kind = generator.random()
+            if kind < 0.45:
+                parts.append(generator.choice(words))
+            elif kind < 0.6:
+                parts.append(str(generator.randint(0, 100000)))
+            elif kind < 0.65:
+                parts.append('"text \\"quoted\\" here"')
+            else:
+                parts.append(generator.choice(operators + ["(", ")", "[", "]", "{", "}"]))
+        line = " ".join(parts) + ";"
+        if generator.random() < 0.1:
+            line += " // a comment"
+        lines.append(line)
+        written += len(line) + 1
+
+    # DefaultLexer cannot end on an ignored character
+    return "\n".join(lines)
+
+def export_headers(file_name: str):
+    with io.TextIOWrapper(open_export(file_name), newline='') as file:
+        return next(csv.reader(file))
+
+def outcome(lexer, text):
+    try:
+        return lexer.tokenise(text)
+    except Exception as err:
+        return type(err).__name__
+
+def run(label, rules, texts, repeats=1):
+    default, compiled = DefaultLexer(rules), CompiledLexer(rules)
+
+    began = time.perf_counter()
+    for _ in range(repeats):
+        expected = [outcome(default, text) for text in texts]
+    default_time = time.perf_counter() - began
+
+    began = time.perf_counter()
+    for _ in range(repeats):
+        found = [outcome(compiled, text) for text in texts]
+    compiled_time = time.perf_counter() - began
+
+    tokens = sum(len(result) for result in expected if not isinstance(result, str))
+    print(f"{label}: {tokens} tokens, default {default_time:.2f} s, compiled {compiled_time:.2f} s "
+          f"({default_time / compiled_time:.2f}x)  {'identical' if expected == found else 'MISMATCH'}")
+    return expected == found
+
+def main():
+    file_name = sys.argv[1] if len(sys.argv) > 1 else config.settings.exported_data_path
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 2**20
+
+    identical = run(f"{size} byte source", SOURCE_RULES, [generate_source(size)])
+    headers = export_headers(file_name)
+    identical &= run(f"{len(headers)} headers x 200", ElementParser.rules, headers, repeats=200)
+
+    if not identical:
+        sys.exit("The compiled lexer gives different tokens")
+
+
+if __name__ == '__main__':
+    main()
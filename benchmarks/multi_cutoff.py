@@ -0,0 +1,64 @@
+# Checks that calculating every cutoff of an assay in one sweep gives exactly the intercepts
+# of calculating each cutoff separately, and times both, for each intercept engine. Each query
+# is given a spread of cutoffs like a grade-sensitivity run would use.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.multi_cutoff [path/to/export.csv] [cutoffs per query]
+import sys
+import time
+
+import numpy as np
+
+from config import config
+from engine import calculate_intercepts_for_cutoffs_from_range, calculate_intercepts_from_range
+from library import calculate_intercepts_for_cutoffs, calculate_intercepts_from_group, load_assay_list, required_analytes
+from refactor import ingest_export
+
+
+def intercept_key(intercept):
+    return (intercept.concentration, intercept.distance, intercept.span, sorted(intercept.co_analytes.items()))
+
+def per_cutoff(calculate, group, assay, cutoffs, coans):
+    return [calculate(group, assay, cutoff, coans) for cutoff in cutoffs]
+
+def run(label, groups, assay_list, separate, combined):
+    began = time.perf_counter()
+    expected = [per_cutoff(separate, group, assay, cutoffs, coans) for group in groups for assay, cutoffs, coans in assay_list]
+    separate_time = time.perf_counter() - began
+
+    began = time.perf_counter()
+    found = [combined(group, assay, cutoffs, coans) for group in groups for assay, cutoffs, coans in assay_list]
+    combined_time = time.perf_counter() - began
+
+    identical = ([[[intercept_key(i) for i in c] for c in e] for e in expected]
+                 == [[[intercept_key(i) for i in c] for c in f] for f in found])
+    count = sum(len(c) for e in expected for c in e)
+    print(f"{label}: {count} intercepts, per cutoff {separate_time:.2f} s, one sweep {combined_time:.2f} s "
+          f"({separate_time / combined_time:.2f}x)  {'identical' if identical else 'MISMATCH'}")
+    return identical
+
+def main():
+    file_name = sys.argv[1] if len(sys.argv) > 1 else config.settings.exported_data_path
+    cutoff_count = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+
+    assay_list = [
+        (assay, list(np.geomspace(min(cutoffs) / 4, max(cutoffs) * 4, cutoff_count)), coans)
+        for assay, cutoffs, coans in load_assay_list('queries.toml')
+    ]
+    data_table, _ = ingest_export(file_name, analytes=required_analytes(assay_list))
+    holes = [data_table[hole] for hole in data_table]
+
+    identical = run("python", [g for hole in holes for g in hole.group_contiguous_intervals()], assay_list,
+                    calculate_intercepts_from_group, calculate_intercepts_for_cutoffs)
+
+    ranges = [r for hole in holes for r in hole.contiguous_ranges()]
+    identical &= run("numpy ", ranges, assay_list,
+                     lambda r, *args: calculate_intercepts_from_range(data_table, r, *args),
+                     lambda r, *args: calculate_intercepts_for_cutoffs_from_range(data_table, r, *args))
+
+    if not identical:
+        sys.exit("Single sweep intercepts differ from per cutoff intercepts")
+
+
+if __name__ == '__main__':
+    main()
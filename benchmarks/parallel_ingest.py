@@ -0,0 +1,64 @@
+# Times parsing an export with the serial loader and with 2 to N ingest processes, and checks
+# that every parallel HoleStore is identical to the serial one. The export's records are
+# repeated until it holds the requested number of rows, so a large file can be made from the
+# bundled one.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.parallel_ingest [path/to/export.csv] [rows] [max workers]
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from config import config
+from refactor import ingest_export
+
+
+def repeat_export(file_name: str, rows: int, target: str):
+    with open(file_name, 'rb') as file:
+        header = file.readline()
+        records = file.readlines()
+
+    with open(target, 'wb') as file:
+        file.write(header)
+        for i in range(rows):
+            file.write(records[i % len(records)])
+
+def same_store(a, b) -> bool:
+    return (a.hole_ids == b.hole_ids
+            and [(x.element, x.base_unit) for x in a.analytes] == [(x.element, x.base_unit) for x in b.analytes]
+            and np.array_equal(a.offsets, b.offsets)
+            and np.array_equal(a.from_depth, b.from_depth)
+            and np.array_equal(a.to_depth, b.to_depth)
+            and all(np.array_equal(x, y, equal_nan=True) for x, y in zip(a.values, b.values)))
+
+def main():
+    file_name = sys.argv[1] if len(sys.argv) > 1 else config.settings.exported_data_path
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+    max_workers = int(sys.argv[3]) if len(sys.argv) > 3 else (os.cpu_count() or 1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        export = os.path.join(directory, 'export.csv')
+        repeat_export(file_name, rows, export)
+        print(f"{rows} rows, {os.path.getsize(export) / 2**20:.0f} MiB, {os.cpu_count()} CPUs")
+
+        baseline, baseline_hash, baseline_time = None, None, None
+        for workers in range(1, max(2, max_workers) + 1):
+            config.settings.ingest_workers = workers
+            began = time.perf_counter()
+            store, file_hash = ingest_export(export)
+            elapsed = time.perf_counter() - began
+
+            if baseline is None:
+                baseline, baseline_hash, baseline_time = store, file_hash, elapsed
+                identical = True
+            else:
+                identical = file_hash == baseline_hash and same_store(store, baseline)
+
+            print(f"{workers:>3} workers: {elapsed:8.2f} s  ({baseline_time / elapsed:.2f}x)  {'identical' if identical else 'MISMATCH'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+# Times perform_analysis over every hole of an export with 1 to N worker processes.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.parallel_scaling [path/to/export.csv] [max workers]
+import os
+import sys
+import time
+
+from config import config
+from library import load_assay_list
+from refactor import ingest_analytes, open_data_table, perform_analysis
+
+
+def main():
+    file_name = sys.argv[1] if len(sys.argv) > 1 else config.settings.exported_data_path
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+
+    assay_list = load_assay_list('queries.toml')
+    data_table = open_data_table(file_name, analytes=ingest_analytes(assay_list))
+    holes = list(data_table.keys())
+    print(f"{len(holes)} holes, {data_table.row_count} samples, {os.cpu_count()} CPUs, {config.settings.intercept_engine} engine")
+
+    # Every run has to analyse every hole, rather than reuse the intercepts of the previous run
+    config.settings.recalc = True
+    config.settings.result_cache = False
+
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        config.settings.worker_count = workers
+        began = time.perf_counter()
+        perform_analysis(data_table, assay_list, os.devnull, holes)
+        elapsed = time.perf_counter() - began
+
+        baseline = baseline or elapsed
+        print(f"{workers:>3} workers: {elapsed:8.2f} s  ({baseline / elapsed:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
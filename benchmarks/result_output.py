@@ -0,0 +1,93 @@
+# Times writing a large number of intercepts with a csv.writer, as perform_analysis used to,
+# against formatting the whole ResultTable at once, and against writing it as NPZ (and as Arrow,
+# when pyarrow is installed). Checks the bulk CSV is byte for byte what the csv.writer writes.
+# The intercepts of the export are copied, to other holes and depths, until there are enough of them.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.result_output [path/to/export.csv] [intercept count]
+import csv
+import os
+import sys
+import tempfile
+import time
+
+from config import config
+from library import OUTPUT_HEADER, hole_intercept_rows, load_assay_list
+from refactor import build_data_table
+from results import ResultTable, write_results
+
+
+def timed(label, write, path):
+    began = time.perf_counter()
+    write()
+    elapsed = time.perf_counter() - began
+    print(f"  {label}: {elapsed:.2f} s, {os.path.getsize(path) / 2**20:.0f} MB")
+    return elapsed
+
+def main():
+    file_name = sys.argv[1] if len(sys.argv) > 1 else config.settings.exported_data_path
+    # The intercepts are calculated every time, rather than read back from the result memo
+    config.settings.result_cache = False
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+
+    data_table = build_data_table(file_name, 0)
+    assay_list = load_assay_list('queries.toml')
+    rows = [row for hole in data_table for row in hole_intercept_rows(hole, data_table, assay_list)]
+
+    # Each copy is moved to its own holes and depths, so the values are about as varied as a
+    # real analysis of that size would give rather than repeating every few thousand rows
+    copies = []
+    for k in range(count // len(rows) + 1):
+        for hole, element, cutoff, unit, depth_from, depth_to, length, grade, label, co_string, co_grades in rows:
+            copies.append([f"{hole}-{k}", element, cutoff, unit, depth_from + k, depth_to + k, length, grade,
+                           f"{label} [{k}]", f"{co_string}[{k}]", co_grades])
+    rows = copies[:count]
+
+    table = ResultTable()
+    table.extend(rows)
+    print(f"{len(table)} intercepts")
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_path = os.path.join(directory, 'legacy.csv')
+        def write_legacy():
+            with open(legacy_path, mode='w', newline='') as file:
+                writer = csv.writer(file, quoting=csv.QUOTE_NONNUMERIC, escapechar='\\')
+                writer.writerow(OUTPUT_HEADER)
+                for row in rows:
+                    writer.writerow(row[:len(OUTPUT_HEADER)])
+        legacy_time = timed("csv.writer row by row", write_legacy, legacy_path)
+
+        bulk_path = os.path.join(directory, 'bulk.csv')
+        bulk_time = timed("bulk CSV", lambda: write_results(table, bulk_path, 'csv'), bulk_path)
+
+        npz_path = os.path.join(directory, 'table.npz')
+        npz_time = timed("NPZ", lambda: write_results(table, npz_path, 'npz'), npz_path)
+
+        try:
+            import pyarrow
+        except ImportError:
+            print("  Arrow: skipped, pyarrow is not installed")
+        else:
+            arrow_path = os.path.join(directory, 'table.arrow')
+            timed("Arrow IPC", lambda: write_results(table, arrow_path, 'arrow'), arrow_path)
+
+        # The same amount of data, written with no formatting at all
+        raw_path = os.path.join(directory, 'raw')
+        with open(bulk_path, 'rb') as file:
+            data = file.read()
+        def write_raw():
+            with open(raw_path, 'wb') as file:
+                file.write(data)
+        raw_time = timed("copying the CSV bytes", write_raw, raw_path)
+
+        with open(legacy_path, 'rb') as legacy, open(bulk_path, 'rb') as bulk:
+            identical = legacy.read() == bulk.read()
+
+    print(f"bulk CSV {legacy_time / bulk_time:.2f}x, NPZ {legacy_time / npz_time:.2f}x the csv.writer, "
+          f"copying the bytes alone takes {raw_time:.2f} s  {'identical' if identical else 'MISMATCH'}")
+    if not identical:
+        sys.exit("The bulk CSV differs from the csv.writer")
+
+
+if __name__ == '__main__':
+    main()
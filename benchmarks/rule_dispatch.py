@@ -0,0 +1,89 @@
+# Times DefaultLexer over generated source as its keyword list grows, with rule sets that try
+# every rule in turn (as Ruleset used to) and with the indexed Ruleset and WordSet, and checks
+# that both give the same tokens. Keyword lists overlap on purpose (`do` and `double`, `in`
+# and `int`), so a change in which rule wins would show up as a mismatch.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.rule_dispatch [source size in bytes]
+import random
+import sys
+import time
+
+from parsall.core.rule import CharacterSet, IdentifierRule, NumberRule, StringRule, SyntaxRule, WordRule, WordSet
+from parsall.lexing import DefaultLexer
+from parsall.semantics import cpp, keywords, python
+
+OPERATORS = "+-*/%<>=!&|^~:;,.{}()[]"
+
+
+class LinearRuleset(SyntaxRule):
+    """ Tries its rules one after another, as Ruleset did before it was indexed """
+
+    def __init__(self, rules):
+        self.rules = rules
+
+    def match(self, text):
+        for rule in self.rules:
+            match = rule.match(text)
+            if match:
+                return match
+        return None
+
+def lexer_rules(words, indexed):
+    if indexed:
+        return [StringRule(), WordSet("keyword", words), IdentifierRule(), NumberRule(), CharacterSet("operator", OPERATORS)]
+
+    return [StringRule(), LinearRuleset([WordRule("keyword", word) for word in words]), IdentifierRule(), NumberRule(),
+            LinearRuleset([WordRule("operator", c) for c in OPERATORS])]
+
+def generate_source(words, size: int) -> str:
+    generator = random.Random(0)
+    names = words + ["value", "index", "count", "_buffer", "assay_total"]
+    parts, written = [], 0
+    while written < size:
+        kind = generator.random()
+        if kind < 0.55:
+            part = generator.choice(names)
+        elif kind < 0.7:
+            part = str(generator.randint(0, 10000))
+        elif kind < 0.72:
+            part = "'text'"
+        else:
+            part = generator.choice(OPERATORS)
+        parts.append(part)
+        written += len(part) + 1
+    return " ".join(parts)
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2**18
+
+    keyword_lists = [
+        ("C++", cpp.keywords),
+        ("C++, JavaScript", cpp.keywords + keywords.javascript),
+        ("C++, JavaScript, Python", cpp.keywords + keywords.javascript + python.keywords),
+    ]
+    synthetic = [f"kw{i}" for i in range(1000)]
+    keyword_lists.append(("+1000 more", keyword_lists[-1][1] + synthetic))
+
+    identical = True
+    for label, words in keyword_lists:
+        source = generate_source(words, size)
+
+        began = time.perf_counter()
+        expected = DefaultLexer(lexer_rules(words, False)).tokenise(source)
+        linear_time = time.perf_counter() - began
+
+        began = time.perf_counter()
+        found = DefaultLexer(lexer_rules(words, True)).tokenise(source)
+        indexed_time = time.perf_counter() - began
+
+        identical &= expected == found
+        print(f"{label} ({len(words)} keywords): {len(found)} tokens, linear {linear_time:.2f} s, "
+              f"indexed {indexed_time:.2f} s ({linear_time / indexed_time:.2f}x)  {'identical' if expected == found else 'MISMATCH'}")
+
+    if not identical:
+        sys.exit("The indexed rule sets give different tokens")
+
+
+if __name__ == '__main__':
+    main()
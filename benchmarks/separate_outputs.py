@@ -0,0 +1,61 @@
+# Times writing each query to a file of its own, as `seperate_assay_files` does, with every file
+# written straight after its query is analysed against handing the rows to a ResultSink, whose
+# thread writes the file while the next query is analysed. Checks both write the same files.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.separate_outputs [path/to/export.csv] [repeats]
+import filecmp
+import os
+import sys
+import tempfile
+import time
+
+from config import config
+from library import hole_intercept_rows, load_assay_list
+from refactor import build_data_table
+from results import ResultSink, ResultTable, query_output_paths, write_results
+
+
+def main():
+    file_name = sys.argv[1] if len(sys.argv) > 1 else config.settings.exported_data_path
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    # The intercepts are calculated every time, rather than read back from the result memo
+    config.settings.result_cache = False
+
+    data_table = build_data_table(file_name, 0)
+    assay_list = load_assay_list('queries.toml')
+    # Every hole is analysed a few times over, so there is enough to write for the threads to matter
+    holes = list(data_table) * repeats
+
+    with tempfile.TemporaryDirectory() as directory:
+        serial_paths = query_output_paths(os.path.join(directory, 'serial.csv'), assay_list, 'csv')
+        began = time.perf_counter()
+        for query, path in zip(assay_list, serial_paths):
+            table = ResultTable()
+            for hole in holes:
+                table.extend(hole_intercept_rows(hole, data_table, [query]))
+            write_results(table, path, 'csv')
+        serial_time = time.perf_counter() - began
+
+        sink_paths = query_output_paths(os.path.join(directory, 'sinks.csv'), assay_list, 'csv')
+        began = time.perf_counter()
+        sinks = []
+        for query, path in zip(assay_list, sink_paths):
+            sinks.append(ResultSink(path, 'csv'))
+            for hole in holes:
+                sinks[-1].put(hole_intercept_rows(hole, data_table, [query]))
+            sinks[-1].close()
+        for sink in sinks:
+            sink.join()
+        sink_time = time.perf_counter() - began
+
+        identical = all(filecmp.cmp(a, b, shallow=False) for a, b in zip(serial_paths, sink_paths))
+
+    print(f"{len(assay_list)} queries over {len(holes)} holes: written after each query {serial_time:.2f} s, "
+          f"through writer threads {sink_time:.2f} s ({serial_time / sink_time:.2f}x)  {'identical' if identical else 'MISMATCH'}")
+    if not identical:
+        sys.exit("The writer threads wrote different files")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# Measures with tracemalloc what lexing generated C++ like source allocates and keeps, for
+# each lexer. The tokens are kept as spans of the source; for comparison the same tokens are
+# then copied out into the (type, value) tuples lexers used to return.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.span_tokens [source size in bytes]
+import sys
+import time
+import tracemalloc
+
+from benchmarks.lexer_backends import SOURCE_RULES, generate_source
+from parsall.lexing import CompiledLexer, DefaultLexer
+
+
+def traced(function):
+    """ Runs `function`, returning its result, the bytes and blocks it left allocated, its peak bytes and how long it took """
+    tracemalloc.start()
+    began = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - began
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = sum(statistic.count for statistic in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+    return result, current, blocks, peak, elapsed
+
+def report(label, current, blocks, peak, elapsed):
+    print(f"{label}: {current / 2**20:.1f} MB in {blocks} blocks kept, {peak / 2**20:.1f} MB peak, {elapsed:.2f} s (traced)")
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2**20
+    source = generate_source(size)
+
+    for lexer in (DefaultLexer(SOURCE_RULES), CompiledLexer(SOURCE_RULES)):
+        tokens, *measures = traced(lambda: lexer.tokenise(source))
+        report(f"{type(lexer).__name__}, {len(tokens)} span tokens", *measures)
+
+        copies, *measures = traced(lambda: [tuple(token) for token in tokens])
+        report(f"{type(lexer).__name__}, copied to tuples", *measures)
+
+        if copies != tokens:
+            sys.exit("Span tokens differ from their copies")
+        del tokens, copies
+
+
+if __name__ == '__main__':
+    main()
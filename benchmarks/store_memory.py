@@ -0,0 +1,36 @@
+# Compares the memory held by the columnar HoleStore against the original dict of HoleData objects.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.store_memory [path/to/export.csv]
+import gc
+import sys
+import time
+import tracemalloc
+
+from config import config
+from refactor import build_data_table, build_interval_data_table
+
+
+def measure(build, file_name):
+    gc.collect()
+    tracemalloc.start()
+    began = time.perf_counter()
+    table = build(file_name, 0)
+    elapsed = time.perf_counter() - began
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return table, current, peak, elapsed
+
+
+def main():
+    file_name = sys.argv[1] if len(sys.argv) > 1 else config.settings.exported_data_path
+
+    print(f"{'Data table':<28}{'Retained':>14}{'Peak':>14}{'Build time':>14}")
+    for label, build in [("dict[str, HoleData]", build_interval_data_table), ("HoleStore", build_data_table)]:
+        table, current, peak, elapsed = measure(build, file_name)
+        print(f"{label:<28}{current / 2**20:>11.1f} MB{peak / 2**20:>11.1f} MB{elapsed:>12.2f} s")
+        del table
+
+
+if __name__ == '__main__':
+    main()
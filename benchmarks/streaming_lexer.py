@@ -0,0 +1,90 @@
+# Lexes a generated C++ like source file with CompiledLexer, once by reading it whole and once
+# with tokenise_stream, and compares the peak memory tracemalloc sees and the tokens each gives.
+# The streamed tokens are copied to tuples as they arrive, as a consumer that kept them would,
+# and only a running count is kept. A small input is also streamed with tiny chunks, so that
+# strings, comments and keywords straddle chunk boundaries, and checked against lexing it whole.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.streaming_lexer [source size in bytes] [chunk size]
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.lexer_backends import SOURCE_RULES, generate_source
+from parsall.lexing import CompiledLexer, DefaultLexer
+
+
+def traced(function):
+    """ Runs `function`, returning its result, its peak traced bytes and how long it took """
+    tracemalloc.start()
+    began = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - began
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, peak, elapsed
+
+def lex_whole(lexer, file_name):
+    with open(file_name, 'r', encoding='utf-8', newline='') as file:
+        tokens = lexer.tokenise(file.read())
+    return len(tokens)
+
+def lex_streaming(lexer, file_name, chunk_size):
+    count, digest = 0, []
+    with open(file_name, 'r', encoding='utf-8', newline='') as file:
+        for token in lexer.tokenise_stream(file, chunk_size):
+            count += 1
+            digest.append(hash(tuple(token)))
+            # Hashing in batches keeps the digest from growing with the input
+            if len(digest) == 4096:
+                digest = [hash(tuple(digest))]
+    return count, digest
+
+def check_boundaries():
+    source = generate_source(20000) + ' "a \\"quoted\\" string" // a trailing comment\n xor_eq'
+    identical = True
+    for lexer in (DefaultLexer(SOURCE_RULES), CompiledLexer(SOURCE_RULES)):
+        expected = [(tuple(token), token.line, token.column) for token in lexer.tokenise(source)]
+        for chunk_size in (1, 2, 3, 5, 64):
+            found = [(tuple(token), token.line, token.column) for token in lexer.tokenise_stream(io.StringIO(source), chunk_size)]
+            identical &= found == expected
+    print(f"Chunk boundaries: {'identical' if identical else 'MISMATCH'}")
+    return identical
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 4 * 2**20
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 2**16
+
+    identical = check_boundaries()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "source.cpp")
+        with open(file_name, 'w', encoding='utf-8', newline='') as file:
+            file.write(generate_source(size))
+
+        lexer = CompiledLexer(SOURCE_RULES)
+        count, whole_peak, whole_time = traced(lambda: lex_whole(lexer, file_name))
+        print(f"Whole:     {count} tokens, {whole_peak / 2**20:.1f} MB peak, {whole_time:.2f} s (traced)")
+
+        (count, digest), streaming_peak, streaming_time = traced(lambda: lex_streaming(lexer, file_name, chunk_size))
+        print(f"Streaming: {count} tokens, {streaming_peak / 2**20:.1f} MB peak, {streaming_time:.2f} s (traced)")
+
+        # Check the streamed tokens by digesting the whole tokens the same way
+        with open(file_name, 'r', encoding='utf-8', newline='') as file:
+            expected = []
+            for token in lexer.tokenise(file.read()):
+                expected.append(hash(tuple(token)))
+                if len(expected) == 4096:
+                    expected = [hash(tuple(expected))]
+        identical &= expected == digest
+        print(f"Streamed tokens: {'identical' if expected == digest else 'MISMATCH'}")
+
+    if not identical:
+        sys.exit("Streaming gives different tokens")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# Times each stage of an analysis on synthetic exports of increasing size: parsing the export with
+# build_data_table, splitting holes up with group_contiguous_intervals, finding intercepts with
+# calculate_intercepts_from_group, analyse_hole over every hole, and writing the intercepts in each
+# output format. Every run is added to a history file under the version of the code it timed, and
+# compared with the last run of another version on the same export, so regressions stand out.
+#
+# The exports are written by benchmarks.synthetic_export the first time each size is asked for, and
+# kept under benchmarks/data for later runs. Above a million rows or so, build_data_table holds
+# every assay of every sample, which takes several GB.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.suite [rows ...] [--label NAME] [--history PATH] [--seed N]
+import argparse
+import csv
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+from config import config
+from library import calculate_intercepts_from_group, hole_intercept_rows, load_assay_list
+from refactor import analyse_hole, build_data_table
+from results import ResultTable, write_results
+from benchmarks.synthetic_export import GENERATOR_VERSION, synthetic_export
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DATA_DIRECTORY = os.path.join(BENCHMARK_DIRECTORY, 'data')
+HISTORY_PATH = os.path.join(BENCHMARK_DIRECTORY, 'history.jsonl')
+DEFAULT_ROWS = [10_000, 100_000]
+
+# A stage this much slower than the version it is compared with is reported as a regression
+REGRESSION_RATIO = 1.10
+
+# Runs are only compared when all of these match
+SAME_RUN_KEYS = ['rows', 'seed', 'generator', 'engine']
+
+
+def code_version() -> str:
+    """ The commit being timed, marked dirty if the tree has changes, or 'unknown' outside of git """
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=BENCHMARK_DIRECTORY,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def timed(timings, stage, run):
+    began = time.perf_counter()
+    result = run()
+    timings[stage] = time.perf_counter() - began
+    return result
+
+def run_stages(path, assay_list):
+    timings = {}
+    data_table = timed(timings, 'build_data_table', lambda: build_data_table(path, 0))
+    holes = list(data_table.keys())
+
+    groups = timed(timings, 'group_contiguous_intervals',
+                   lambda: [group for hole in holes for group in data_table[hole].group_contiguous_intervals()])
+
+    intercepts = timed(timings, 'calculate_intercepts_from_group', lambda: sum(
+        len(calculate_intercepts_from_group(group, assay, cutoff, coans))
+        for group in groups for assay, cutoffs, coans in assay_list for cutoff in cutoffs
+    ))
+
+    def analyse_every_hole():
+        with open(os.devnull, mode='w', newline='') as file:
+            writer = csv.writer(file, quoting=csv.QUOTE_NONNUMERIC, escapechar='\\')
+            for hole in holes:
+                analyse_hole(hole, writer, data_table, assay_list)
+    timed(timings, 'analyse_hole', analyse_every_hole)
+
+    table = ResultTable()
+    for hole in holes:
+        table.extend(hole_intercept_rows(hole, data_table, assay_list))
+
+    formats = ['csv', 'npz']
+    try:
+        import pyarrow
+        formats.append('arrow')
+    except ImportError:
+        pass
+    with tempfile.TemporaryDirectory() as directory:
+        for output_format in formats:
+            timed(timings, f'write_{output_format}',
+                  lambda: write_results(table, os.path.join(directory, 'intercepts.csv'), output_format))
+
+    counts = {'samples': data_table.row_count, 'holes': len(holes), 'groups': len(groups), 'intercepts': intercepts, 'output_rows': len(table)}
+    return counts, timings
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def previous_run(history, record):
+    """ The last run of another version over the same export with the same engine, if there is one """
+    for earlier in reversed(history):
+        if earlier['version'] != record['version'] and all(earlier.get(key) == record[key] for key in SAME_RUN_KEYS):
+            return earlier
+    return None
+
+def report(record, earlier):
+    print(f"{record['rows']} rows, {record['holes']} holes, {record['output_rows']} output rows"
+          + (f", against {earlier['version']} from {earlier['date']}" if earlier else ""))
+    regressions = []
+    for stage, seconds in record['timings'].items():
+        line = f"  {stage:<32} {seconds:9.3f} s"
+        if earlier and stage in earlier['timings']:
+            ratio = seconds / earlier['timings'][stage]
+            line += f"  {earlier['timings'][stage]:9.3f} s  {ratio:5.2f}x"
+            if ratio > REGRESSION_RATIO:
+                line += "  SLOWER"
+                regressions.append(stage)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times each stage of an analysis on synthetic exports")
+    parser.add_argument('rows', nargs='*', type=int, default=DEFAULT_ROWS, help="sizes of the exports to time, in rows")
+    parser.add_argument('--label', default=None, help="the version to record the timings under, by default from git")
+    parser.add_argument('--history', default=HISTORY_PATH, help="the file runs are added to and compared with")
+    parser.add_argument('--seed', type=int, default=0, help="the seed of the synthetic exports")
+    args = parser.parse_args()
+
+    # Every stage has to do its work, rather than read back results remembered from an earlier run
+    config.settings.result_cache = False
+    config.settings.recalc = True
+    config.settings.worker_count = 1
+
+    version = args.label or code_version()
+    assay_list = load_assay_list('queries.toml')
+    history = load_history(args.history)
+
+    regressions = []
+    for rows in args.rows:
+        path = synthetic_export(DATA_DIRECTORY, rows, args.seed)
+        counts, timings = run_stages(path, assay_list)
+        record = {
+            'version': version, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'rows': rows, 'seed': args.seed,
+            'generator': GENERATOR_VERSION, 'engine': config.settings.intercept_engine, 'python': platform.python_version(), **counts, 'timings': timings,
+        }
+        regressions += [f"{stage} at {rows} rows" for stage in report(record, previous_run(history, record))]
+
+        history.append(record)
+        with open(args.history, mode='a') as file:
+            file.write(json.dumps(record) + "\n")
+
+    if regressions:
+        print(f"Slower than the previous version: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+# Writes a synthetic drillhole export of any size with the layout of Drilling_Samples_R1: the
+# same 87 columns, rows grouped by hole, control and blank samples with no depths, field
+# duplicates, gaps between intervals, assays left empty, below detection values written as the
+# negative detection limit, and Pd and Pt in ppb. Grades follow the spread of each assay in the
+# real export and run in zones down each hole, so the queries find intercepts at a similar rate.
+# The same row count and seed always give the same file.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.synthetic_export path/to/export.csv [--rows N] [--holes N] [--seed N]
+import argparse
+import os
+from statistics import NormalDist
+
+import numpy as np
+
+METADATA_COLUMNS = [
+    'ProjectArea', 'Prospect', 'Hole number', 'From', 'To', 'Length', 'SampleID', 'SampleMethod',
+    'LegacySampleMethod', 'Sample Type', 'Control Type', 'SampledDate', 'SampledBy', 'Comments', 'Recovery',
+    'WetDry', 'DataSource', 'Sample dispatch number', 'Sample dispatch status', 'Sample dispatch date',
+    'Sample analysis workflow', 'Ranking',
+]
+
+# Each assay column of the real export: the share of holes it was not assayed in, the share of its
+# values below detection, its detection limit, and the median and 99th percentile of its values
+ASSAY_PROFILES = [
+    ('Au_ppm', 0.347, 0.288, 0.01, 0.008, 1.96),
+    ('Ag_ppm', 0.257, 0.404, 0.5, 0.06, 6.74),
+    ('Al_ppm', 0.596, 0.0, 500, 70900, 122000),
+    ('As_ppm', 0.245, 0.035, 50, 10.9, 390),
+    ('B_ppm', 0.985, 0.970, 10, 10, 40),
+    ('Ba_ppm', 0.629, 0.023, 50, 230, 900),
+    ('Be_ppm', 0.636, 0.054, 10, 1.74, 4.91),
+    ('Bi_ppm', 0.452, 0.117, 2, 0.31, 7.4),
+    ('Ca_ppm', 0.582, 0.022, 500, 3000, 79700),
+    ('Cd_ppm', 0.630, 0.243, 0.02, 0.11, 7.52),
+    ('Cu_ppm', 0.162, 0.010, 10, 41.6, 12400),
+    ('Cs_ppm', 0.677, 0.001, 0.05, 2.21, 13.8),
+    ('Cr_ppm', 0.589, 0.002, 50, 69, 6790),
+    ('Co_ppm', 0.424, 0.014, 10, 18.4, 930),
+    ('Ce_ppm', 0.677, 0.0, 0.06, 74.1, 122),
+    ('Dy_ppm', 0.998, 0.0, 2.75, 4.2, 6.1),
+    ('Er_ppm', 0.998, 0.0, 1.45, 2.55, 3.75),
+    ('Eu_ppm', 0.998, 0.0, 0.7, 1.3, 1.85),
+    ('Fe_ppm', 0.440, 0.0, 1200, 48300, 302000),
+    ('Ga_ppm', 0.636, 0.060, 50, 18.45, 33.8),
+    ('Gd_ppm', 0.998, 0.0, 3, 4.4, 5.8),
+    ('Ge_ppm', 0.677, 0.012, 0.05, 0.15, 0.68),
+    ('Hf_ppm', 0.676, 0.003, 0.1, 3, 4.7),
+    ('Hg_ppm', 0.985, 0.826, 1, 1, 1),
+    ('Ho_ppm', 0.998, 0.0, 0.56, 0.9, 1.26),
+    ('In_ppm', 0.677, 0.001, 0.005, 0.071, 1.165),
+    ('K_ppm', 0.629, 0.024, 1000, 9100, 42100),
+    ('La_ppm', 0.636, 0.049, 50, 35.9, 66),
+    ('Li_ppm', 0.677, 0.0, 0.5, 15, 61.4),
+    ('Lu_ppm', 0.998, 0.0, 0.28, 0.4, 0.58),
+    ('Mg_ppm', 0.585, 0.0, 0.03, 15300, 203000),
+    ('Mn_ppm', 0.468, 0.0, 6, 547, 5350),
+    ('Mo_ppm', 0.624, 0.112, 1, 0.76, 11),
+    ('Na_ppm', 0.635, 0.002, 500, 9900, 35400),
+    ('Nb_ppm', 0.676, 0.002, 0.1, 5.7, 25.9),
+    ('Nd_ppm', 0.998, 0.0, 7.35, 13.6, 20.8),
+    ('Ni_ppm', 0.400, 0.016, 50, 40, 10150),
+    ('P_ppm', 0.635, 0.012, 50, 580, 1260),
+    ('Pb_ppm', 0.230, 0.073, 50, 8.2, 129),
+    ('Pd_ppb', 0.790, 0.777, 5, 5, 46),
+    ('Pr_ppm', 0.998, 0.0, 1.4, 2.9, 5.34),
+    ('Pt_ppb', 0.789, 0.801, 5, 5, 65),
+    ('Rb_ppm', 0.677, 0.001, 0.1, 55.9, 246),
+    ('Re_ppm', 0.677, 0.899, 0.002, 0.002, 0.076),
+    ('S_ppm', 0.538, 0.101, 100, 700, 51900),
+    ('Sb_ppm', 0.310, 0.060, 5, 1.18, 25.2),
+    ('Sc_ppm', 0.585, 0.027, 10, 13, 110),
+    ('Se_ppm', 0.673, 0.644, 1, 1, 34),
+    ('Sm_ppm', 0.998, 0.0, 2.3, 3.75, 4.55),
+    ('Sn_ppm', 0.677, 0.003, 0.2, 3, 12.3),
+    ('Sr_ppm', 0.636, 0.006, 10, 49.5, 313),
+    ('Ta_ppm', 0.677, 0.009, 0.05, 0.46, 1.54),
+    ('Tb_ppm', 0.998, 0.0, 0.46, 0.64, 0.94),
+    ('Te_ppm', 0.677, 0.851, 0.05, 0.06, 1.03),
+    ('Th_ppm', 0.651, 0.056, 50, 15, 30.4),
+    ('Ti_ppm', 0.629, 0.037, 100, 2320, 13500),
+    ('Tl_ppm', 0.635, 0.190, 0.02, 0.34, 1.9),
+    ('Tm_ppm', 0.998, 0.0, 0.2, 0.4, 0.5),
+    ('U_ppm', 0.635, 0.132, 10, 2.9, 6.1),
+    ('V_ppm', 0.635, 0.0, 1, 85, 363),
+    ('W_ppm', 0.635, 0.104, 10, 1.5, 10),
+    ('Zr_ppm', 0.677, 0.001, 0.5, 104, 163),
+    ('Zn_ppm', 0.182, 0.0, 20, 95, 1330),
+    ('Yb_ppm', 0.998, 0.0, 1.5, 2.3, 3.45),
+    ('Y_ppm', 0.677, 0.0, 0.1, 12.9, 39.4),
+]
+
+HEADER = METADATA_COLUMNS + [column for column, *_ in ASSAY_PROFILES]
+
+PROJECT_AREAS = ['Canbelego', 'Restdown', 'CZ', 'Collerina', 'Homeville', 'Meryula', 'Rochford', 'Muriel Tank']
+PROSPECTS = ['The Sunrise', 'Canbelego', 'NaN', 'CZ', 'Regional', '', 'Homeville', 'Boundary']
+HOLE_PREFIXES = ['HRRC', 'CBLR', 'CORC', 'CAND', 'TORC', 'QARC', 'BJRC']
+SAMPLE_METHODS = ['CHIP-UNK', 'CHIP-CONE', 'CHIP-SPR', 'CORE-50', 'CHIP-RESPLIT', 'CORE-UNK', 'CHIP-2SPL']
+LEGACY_METHODS = ['', 'SPLIT', 'SPEAR', '4M COMP', 'cone spl', 'unkn', '1/2 HQ']
+SAMPLERS = ['', 'JA', 'Alpha HPA', 'EF', 'JC', 'JH/JC', 'M Stewart', 'AC']
+DATA_SOURCES = ['NSW Drilling Database.mdb - GB_SAMPLE', 'TORC assays.xlsx', '', 'HLX_Logging_Template']
+WORKFLOWS = ['ALS', 'Ultratrace', 'ALS Metadata', '']
+
+# Sample lengths in metres, and how often each was taken
+SAMPLE_LENGTHS = [1.0, 4.0, 2.0, 3.0, 1.4, 1.3, 0.5, 0.7]
+SAMPLE_LENGTH_WEIGHTS = [0.80, 0.14, 0.032, 0.007, 0.006, 0.005, 0.005, 0.005]
+
+# The export has had most of its quality control samples taken out, so controls are inserted at
+# a typical rate instead. Each is a blank or one of the standards, with the grades of the standard
+# a fixed multiple of the median grade of each assay
+CONTROL_RATE = 0.02
+CONTROL_TYPES = ['BLANK-C', 'OREAS 928', 'OREAS 96', 'OREAS 134b']
+CONTROL_GRADES = [0.05, 3.0, 10.0, 30.0]
+FIELD_DUPLICATE_RATE = 0.001
+RESPLIT_RATE = 0.075
+GAP_RATE = 0.006
+
+# Grades follow zones about this many samples long, the grades of a hole are shifted by its own
+# amount, and each assay follows the zones this closely. These give about as many intercepts, of
+# about the same length, as the queries find in the real export
+ZONE_SAMPLES = 15
+HOLE_SPREAD = 1.0
+LATENT_WEIGHT = 0.98
+
+HOLE_SAMPLES_MEDIAN = 40
+CHUNK_ROWS = 100_000
+
+# Bumped whenever the files written change, so timings are only compared on the same data
+GENERATOR_VERSION = 1
+
+NORMAL = NormalDist()
+
+
+def _grade_parameters(below_detection, detection_limit, median, p99):
+    # A lognormal through the median and 99th percentile. Values drawn below the share that is
+    # below detection are written as the negative detection limit, the way labs report them
+    sigma = max(np.log(p99 / median) / NORMAL.inv_cdf(0.99), 0.05)
+    below = NORMAL.inv_cdf(below_detection) if below_detection > 0 else -np.inf
+    return np.log(median), sigma, below, detection_limit
+
+GRADES = [_grade_parameters(*profile[2:]) for profile in ASSAY_PROFILES]
+
+
+def _quoted(values):
+    return np.array([f'"{value}"' for value in values], dtype=object)
+
+def _format_numbers(values: np.ndarray) -> np.ndarray:
+    # NaN is written as an empty quoted cell and numbers as Python writes a float. The values are
+    # rounded to three significant figures, like lab results, so each distinct one is only formatted once
+    text = np.full(len(values), '""', dtype=object)
+    present = ~np.isnan(values)
+    if not present.any():
+        return text
+
+    magnitude = np.abs(values[present])
+    exponent = np.floor(np.log10(magnitude)).astype(np.int64) - 2
+    mantissa = np.round(magnitude / 10.0 ** exponent).astype(np.int64)
+    keys = np.sign(values[present]).astype(np.int64) * (mantissa * 1000 + exponent + 500)
+    unique, inverse = np.unique(keys, return_inverse=True)
+    formatted = np.array([repr(float(np.sign(key)) * float(f"{abs(key) // 1000}e{abs(key) % 1000 - 500}")) for key in unique.tolist()], dtype=object)
+    text[present] = formatted[inverse]
+    return text
+
+def _format_depths(values: np.ndarray) -> np.ndarray:
+    text = np.full(len(values), '""', dtype=object)
+    present = ~np.isnan(values)
+    unique, inverse = np.unique(np.round(values[present], 1), return_inverse=True)
+    text[present] = np.array([repr(value) for value in unique.tolist()], dtype=object)[inverse]
+    return text
+
+
+def _hole_sizes(rng, rows, holes=None):
+    if holes is not None:
+        # The rows are shared out between exactly `holes` holes, at least one each, with the
+        # same spread of sizes as below
+        weights = rng.lognormal(0, 0.7, holes)
+        sizes = 1 + np.floor(weights / weights.sum() * (rows - holes)).astype(np.int64)
+        sizes[:rows - sizes.sum()] += 1
+        return sizes.tolist()
+
+    sizes = []
+    total = 0
+    while total < rows:
+        size = int(np.clip(rng.lognormal(np.log(HOLE_SAMPLES_MEDIAN), 0.7), 5, 600))
+        size = min(size, rows - total)
+        sizes.append(size)
+        total += size
+    return sizes
+
+def _chunk_lines(rng, sizes, first_hole, first_sample):
+    """ The CSV lines of holes with `sizes` samples each, numbered on from `first_hole` """
+    rows = sum(sizes)
+    hole_of_row = np.repeat(np.arange(len(sizes)), sizes)
+    starts = np.cumsum([0] + sizes[:-1])
+    position = np.arange(rows) - starts[hole_of_row]
+
+    kind = rng.random(rows)
+    control = kind < CONTROL_RATE
+    duplicate = (kind >= CONTROL_RATE) & (kind < CONTROL_RATE + FIELD_DUPLICATE_RATE) & (position > 0)
+    duplicate[1:] &= ~control[:-1]
+    resplit = kind > 1 - RESPLIT_RATE
+
+    # Depths run down each hole, with now and then a stretch left unsampled. Controls have no
+    # depth, and a field duplicate repeats the interval before it
+    lengths = rng.choice(SAMPLE_LENGTHS, rows, p=np.array(SAMPLE_LENGTH_WEIGHTS) / sum(SAMPLE_LENGTH_WEIGHTS))
+    lengths[control | duplicate] = 0
+    gaps = np.where(rng.random(rows) < GAP_RATE, rng.integers(1, 20, rows), 0).astype(np.float64)
+    gaps[control | duplicate] = 0
+    advance = lengths + gaps
+    travelled = np.cumsum(advance) - np.repeat(np.cumsum(advance)[starts] - advance[starts], sizes)
+    depth_to = np.round(travelled, 1)
+    depth_from = np.round(travelled - lengths, 1)
+    for k in np.flatnonzero(duplicate):
+        depth_from[k], depth_to[k] = depth_from[k - 1], depth_to[k - 1]
+    depth_from[control] = np.nan
+    depth_to[control] = np.nan
+
+    hole_area = rng.integers(0, len(PROJECT_AREAS), len(sizes))
+    hole_method = rng.integers(0, len(SAMPLE_METHODS), len(sizes))
+    hole_recovery = rng.choice([np.nan, 100.0, 80.0, 90.0, 110.0, 50.0], len(sizes), p=[0.7, 0.14, 0.04, 0.04, 0.04, 0.04])
+    hole_shift = rng.normal(0, HOLE_SPREAD, len(sizes))
+    holes = [f"{HOLE_PREFIXES[(first_hole + k) % len(HOLE_PREFIXES)]}{first_hole + k:06d}" for k in range(len(sizes))]
+
+    def per_hole(choices, picks):
+        return _quoted(choices)[picks[hole_of_row] % len(choices)]
+
+    control_type = rng.integers(0, len(CONTROL_TYPES), rows)
+    columns = [
+        per_hole(PROJECT_AREAS, hole_area),
+        per_hole(PROSPECTS, hole_area),
+        _quoted(holes)[hole_of_row],
+        _format_depths(depth_from),
+        _format_depths(depth_to),
+        _format_depths(depth_to - depth_from),
+        _quoted(range(first_sample, first_sample + rows)),
+        np.where(control, np.where(control_type == 0, '"REF-BLANK"', '"REF-STD"'), per_hole(SAMPLE_METHODS, hole_method)),
+        per_hole(LEGACY_METHODS, hole_method),
+        np.where(control, '"Control"', np.where(duplicate, '"FieldDup"', np.where(resplit, '"Resplit"', '"Original"'))),
+        np.where(control, _quoted(CONTROL_TYPES)[control_type], '""'),
+        per_hole([f"{1 + month * 2:02d}/{month:02d}/{2010 + month}" for month in range(1, 13)], hole_area + hole_method),
+        per_hole(SAMPLERS, hole_method),
+        np.full(rows, '""', dtype=object),
+        _format_numbers(hole_recovery[hole_of_row]),
+        np.where(np.isnan(hole_recovery[hole_of_row]), '""', '"D"'),
+        per_hole(DATA_SOURCES, hole_area),
+        per_hole([f"HSS{1300 + k}" for k in range(50)], hole_area * len(SAMPLE_METHODS) + hole_method),
+        per_hole(['sent', 'sent', 'sent;sent', ''], hole_method),
+        per_hole([f"{day:02d}/08/2022" for day in range(1, 29)], hole_area + hole_method),
+        per_hole(WORKFLOWS, hole_area),
+        np.full(rows, '1', dtype=object),
+    ]
+
+    # Every assay follows the same zones down the hole, smoothed out of white noise
+    zones = np.convolve(rng.standard_normal(rows), np.ones(ZONE_SAMPLES) / np.sqrt(ZONE_SAMPLES), mode='same')
+    latent = (zones + hole_shift[hole_of_row]) / np.sqrt(1 + HOLE_SPREAD ** 2)
+    for (_, unassayed, *_), (mu, sigma, below, detection_limit) in zip(ASSAY_PROFILES, GRADES):
+        draws = LATENT_WEIGHT * latent + np.sqrt(1 - LATENT_WEIGHT ** 2) * rng.standard_normal(rows)
+        values = np.exp(mu + sigma * draws)
+        values[draws < below] = -detection_limit
+        values[control] = np.where(control_type[control] == 0, detection_limit,
+                                   np.exp(mu) * np.take(CONTROL_GRADES, control_type[control]))
+        values[(rng.random(len(sizes)) < unassayed)[hole_of_row]] = np.nan
+        values[rng.random(rows) < 0.01] = np.nan
+        columns.append(_format_numbers(values))
+
+    return map(",".join, zip(*columns))
+
+
+def write_synthetic_export(path: str, rows: int, seed: int = 0, holes: int = None) -> str:
+    """
+    Writes `rows` samples to a synthetic export at `path`, a chunk of holes at a time. The samples
+    are split between `holes` holes if it is given, or into holes of a typical size if not.
+    """
+    rng = np.random.default_rng(seed)
+    sizes = _hole_sizes(rng, rows, holes)
+
+    with open(path, mode='w', newline='') as file:
+        file.write(",".join(f'"{column}"' for column in HEADER) + "\r\n")
+        first_hole = first_sample = 0
+        while first_hole < len(sizes):
+            last_hole, chunk_rows = first_hole, 0
+            while last_hole < len(sizes) and chunk_rows < CHUNK_ROWS:
+                chunk_rows += sizes[last_hole]
+                last_hole += 1
+
+            for line in _chunk_lines(rng, sizes[first_hole:last_hole], first_hole, 1_000_000_000 + first_sample):
+                file.write(line)
+                file.write("\r\n")
+            first_hole, first_sample = last_hole, first_sample + chunk_rows
+
+    return path
+
+def synthetic_export(directory: str, rows: int, seed: int = 0) -> str:
+    """ The synthetic export of `rows` samples kept in `directory`, which is written the first time it is asked for """
+    path = os.path.join(directory, f"synthetic_{rows}_{seed}_v{GENERATOR_VERSION}.csv")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        write_synthetic_export(path + ".partial", rows, seed)
+        os.replace(path + ".partial", path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes a synthetic drillhole export")
+    parser.add_argument('path', help="the CSV file to write")
+    parser.add_argument('--rows', type=int, default=100_000, help="the number of samples to write")
+    parser.add_argument('--holes', type=int, default=None, help="the number of holes to split the samples between, by default as many as holes of a typical size need")
+    parser.add_argument('--seed', type=int, default=0, help="the seed of the export, the same rows and seed always give the same file")
+    args = parser.parse_args()
+    if args.rows < 1:
+        parser.error("--rows must be at least 1")
+    if args.holes is not None and not 1 <= args.holes <= args.rows:
+        parser.error("--holes must be between 1 and --rows")
+
+    write_synthetic_export(args.path, args.rows, args.seed, args.holes)
+    print(f"Wrote {args.rows} samples to {args.path}, {os.path.getsize(args.path) / 2**20:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
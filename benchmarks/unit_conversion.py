@@ -0,0 +1,61 @@
+# Times converting a column of assays one value at a time, the way AssayType used to with a
+# dict of factors built on every call, against converting the whole column in one call. Then
+# checks that a query for an element in a unit the export does not record it in (Pd in ppm, from
+# the export's Pd_ppb) reads the column HoleStore.normalise_units converted at ingest.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.unit_conversion [path/to/export.csv]
+import math
+import sys
+import time
+
+import numpy as np
+
+from config import config
+from Hole import AssayType, AssayUnit
+from refactor import ingest_export
+from units import convert
+
+
+def legacy_convert(value, from_unit, to_unit):
+    conversion_factors = {
+        AssayUnit.PPM: 1,
+        AssayUnit.PPB: 0.001,
+        AssayUnit.Percent: 10000,
+        AssayUnit.GPT: 1
+    }
+    if from_unit not in conversion_factors or to_unit not in conversion_factors:
+        raise ValueError("Invalid units")
+    return value * conversion_factors[from_unit] / conversion_factors[to_unit]
+
+def main():
+    file_name = sys.argv[1] if len(sys.argv) > 1 else config.settings.exported_data_path
+
+    column = np.random.default_rng(0).lognormal(3, 2, 1_000_000)
+    began = time.perf_counter()
+    expected = [legacy_convert(value, AssayUnit.PPM, AssayUnit.Percent) for value in column.tolist()]
+    scalar_time = time.perf_counter() - began
+
+    began = time.perf_counter()
+    found = convert(column, AssayUnit.PPM, AssayUnit.Percent)
+    column_time = time.perf_counter() - began
+
+    identical = np.array_equal(np.array(expected), found)
+    print(f"{len(column)} values ppm -> %: one at a time {scalar_time:.3f} s, whole column {column_time:.4f} s "
+          f"({scalar_time / column_time:.0f}x)  {'identical' if identical else 'MISMATCH'}")
+
+    palladium_ppm = AssayType('Pd', AssayUnit.PPM)
+    store, _ = ingest_export(file_name, analytes=[palladium_ppm])
+    recorded = store.values[store.column_of(AssayType('Pd', AssayUnit.PPB))]
+    store.normalise_units([palladium_ppm])
+    converted = store.values[store.column_of(palladium_ppm)]
+
+    normalised = all(math.isnan(a) and math.isnan(b) or a / 1000 == b for a, b in zip(recorded.tolist(), converted.tolist()))
+    print(f"Pd_ppb read as Pd in ppm: {np.count_nonzero(~np.isnan(converted))} values  {'converted' if normalised else 'MISMATCH'}")
+
+    if not (identical and normalised):
+        sys.exit("Unit conversion gives different values")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+
+# Persists parsed exports under `cache_location`, as hole files, so that a repeat run over
+# an unchanged export can skip parsing the CSV entirely. Only the latest copy of each export is
+# kept (see save_cached_store). The intercepts written for each hole are kept as well, so that
+# a later run only has to analyse the holes that changed.
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import List
+
+import numpy as np
+
+from columnar import HoleStore
+from config import config
+from Hole import AssayType
+from holefile import is_hole_file, open_hole_file, write_hole_file
+
+# Bump this whenever the layout of the cached files changes
+CACHE_VERSION = 5
+
+# The intercept state of a set of queries that has not been used for this many days is deleted
+INTERCEPT_STATE_MAX_AGE_DAYS = 30
+
+# The modules whose code decides the intercept rows written for a hole
+INTERCEPT_MODULES = ['library.py', 'engine.py', 'columnar.py', 'Hole.py', 'units.py', 'intervals.py']
+
+_code_fingerprint = None
+
+
+def code_fingerprint() -> str:
+    """
+    Hashes the source of INTERCEPT_MODULES, so that remembered intercepts are not read back
+    after the code that calculated them has changed.
+    """
+    global _code_fingerprint
+    if _code_fingerprint is None:
+        hasher = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in INTERCEPT_MODULES:
+            with open(os.path.join(directory, name), 'rb') as file:
+                hasher.update(file.read())
+            hasher.update(b'\0')
+        _code_fingerprint = hasher.hexdigest()
+    return _code_fingerprint
+
+def save_json(path: str, data):
+    """
+    Writes `data` as JSON to a file under `cache_location`. It is written to a temporary file and
+    moved into place, so other processes never read half a file. Raises OSError if it cannot be written.
+    """
+    os.makedirs(config.settings.cache_location, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+    os.replace(temporary_path, path)
+
+
+def dataset_cache_key(file_hash: str, analytes: List[AssayType] = None) -> str:
+    """
+    Builds the cache key for a parsed export. The column name settings are part of the key
+    because they change which columns are read out of the same file, and so is the set of
+    analytes that were parsed (None meaning every analyte in the export).
+    """
+    if analytes is None:
+        projection = "*"
+    else:
+        projection = ",".join(sorted(f"{a.element}|{a.base_unit.name}" for a in analytes))
+
+    hasher = hashlib.sha256()
+    for part in [str(CACHE_VERSION), file_hash, projection,
+                 config.settings.hole_id_column_name, config.settings.sample_id_column_name,
+                 config.settings.from_column_name, config.settings.to_column_name]:
+        hasher.update(part.encode('utf-8'))
+        hasher.update(b'\0')
+
+    return hasher.hexdigest()
+
+def _file_hashes_path() -> str:
+    return os.path.join(config.settings.cache_location, "file_hashes.json")
+
+def _fingerprint(file_name: str) -> str:
+    stat = os.stat(file_name)
+    return f"{os.path.abspath(file_name)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+def lookup_file_hash(file_name: str):
+    """
+    Returns the SHA-256 recorded the last time this export was ingested, provided its path,
+    size and modification time are unchanged. This lets a cached export be loaded without
+    reading it just to hash it. Returns None if the export has not been seen in this state.
+    """
+    try:
+        with open(_file_hashes_path(), 'r', encoding='utf-8') as file:
+            return json.load(file).get(_fingerprint(file_name))
+    except (OSError, ValueError):
+        return None
+
+def record_file_hash(file_name: str, file_hash: str):
+    path = _file_hashes_path()
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            hashes = json.load(file)
+    except (OSError, ValueError):
+        hashes = {}
+
+    # Earlier revisions of the same export are forgotten, so the file does not grow with every revision
+    fingerprint = _fingerprint(file_name)
+    source = fingerprint.rsplit('|', 2)[0]
+    hashes = {key: value for key, value in hashes.items() if key.rsplit('|', 2)[0] != source}
+    hashes[fingerprint] = file_hash
+    try:
+        save_json(path, hashes)
+    except OSError as err:
+        logging.warning(f"Could not record the hash of {file_name}: {err}")
+
+def dataset_cache_path(file_hash: str, analytes: List[AssayType] = None) -> str:
+    return os.path.join(config.settings.cache_location, f"dataset-{dataset_cache_key(file_hash, analytes)}.holes")
+
+def load_cached_store(file_hash: str, analytes: List[AssayType] = None):
+    """ Returns the cached HoleStore for an export, or None if it has not been cached yet """
+    path = dataset_cache_path(file_hash, analytes)
+    if not is_hole_file(path):
+        return None
+
+    try:
+        return open_hole_file(path)
+    except (OSError, ValueError, KeyError) as err:
+        logging.warning(f"Ignoring unreadable dataset cache {path}: {err}")
+        return None
+
+def _dataset_sources_path() -> str:
+    return os.path.join(config.settings.cache_location, "dataset_sources.json")
+
+def save_cached_store(store: HoleStore, file_hash: str, analytes: List[AssayType], file_name: str):
+    """
+    Caches the HoleStore parsed from the export at `file_name`. Only one copy is kept for each
+    export, so the copy of an earlier revision, or of other analytes, is deleted.
+    """
+    path = dataset_cache_path(file_hash, analytes)
+    try:
+        os.makedirs(config.settings.cache_location, exist_ok=True)
+        write_hole_file(store, path)
+    except OSError as err:
+        logging.warning(f"Could not write the dataset cache: {err}")
+        return
+
+    try:
+        with open(_dataset_sources_path(), 'r', encoding='utf-8') as file:
+            sources = json.load(file)
+    except (OSError, ValueError):
+        sources = {}
+
+    source = os.path.abspath(file_name)
+    previous = sources.get(source)
+    sources[source] = os.path.basename(path)
+    # Two exports with the same contents share a copy, which is kept while either still uses it
+    if previous is not None and previous not in sources.values():
+        try:
+            shutil.rmtree(os.path.join(config.settings.cache_location, previous))
+        except OSError as err:
+            logging.warning(f"Could not delete the old dataset cache {previous}: {err}")
+
+    try:
+        save_json(_dataset_sources_path(), sources)
+    except OSError as err:
+        logging.warning(f"Could not record the dataset cache of {file_name}: {err}")
+
+def query_fingerprint(assay_list) -> str:
+    """
+    Hashes everything besides a hole's own rows that decides the intercept rows written for it:
+    the queries (with their reported units and cutoffs), the dilution allowance, the engine and
+    the code of the engine.
+    """
+    hasher = hashlib.sha256()
+    parts = [str(CACHE_VERSION), code_fingerprint(), repr(config.settings.internal_dilution_intervals), config.settings.intercept_engine]
+    for assay, cutoffs, co_analytes in assay_list:
+        parts.append(f"{assay.element}|{assay.base_unit.name}|{assay.reported_unit.name}|{[repr(c) for c in cutoffs]}")
+        parts.extend(f"{co.element}|{co.base_unit.name}|{co.reported_unit.name}" for co in co_analytes)
+        parts.append("")
+    for part in parts:
+        hasher.update(part.encode('utf-8'))
+        hasher.update(b'\0')
+
+    return hasher.hexdigest()
+
+def hole_fingerprint(data_table: HoleStore, hole: str, analytes: List[AssayType]) -> str:
+    """
+    Hashes the rows of a hole, as they are stored, for the analytes in `analytes`. The hash does not
+    depend on the order of the columns in the export or on what other analytes were parsed.
+    """
+    stored = data_table[hole]
+    hasher = hashlib.sha256()
+    hasher.update(np.ascontiguousarray(data_table.from_depth[stored.lo:stored.hi], dtype=np.float64).tobytes())
+    hasher.update(np.ascontiguousarray(data_table.to_depth[stored.lo:stored.hi], dtype=np.float64).tobytes())
+
+    for assay in sorted(analytes, key=lambda a: (a.element, a.base_unit.name)):
+        hasher.update(f"{assay.element}|{assay.base_unit.name}".encode('utf-8'))
+        column = data_table.column_of(assay)
+        if column is not None:
+            hasher.update(np.ascontiguousarray(data_table.values[column][stored.lo:stored.hi], dtype=np.float64).tobytes())
+        hasher.update(b'\0')
+
+    return hasher.hexdigest()
+
+def _intercept_state_path(query_hash: str) -> str:
+    # Each set of queries has its own file, so that runs writing each query to a file of its own
+    # do not overwrite each other's state
+    return os.path.join(config.settings.cache_location, f"intercept_state-{query_hash[:16]}.json")
+
+def load_intercept_state(query_hash: str) -> dict:
+    """
+    Returns the intercept rows written for each hole on the last run with these queries and
+    settings, as `{hole: {"hash": hole fingerprint, "rows": [...]}}`, or an empty dict if there
+    has not been one.
+    """
+    path = _intercept_state_path(query_hash)
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+        # The modification time records when the state was last used, see prune_intercept_states
+        os.utime(path)
+    except (OSError, ValueError):
+        return {}
+
+    if state.get('query') != query_hash:
+        return {}
+    return state.get('holes', {})
+
+def save_intercept_state(query_hash: str, holes: dict):
+    path = _intercept_state_path(query_hash)
+    try:
+        save_json(path, {'query': query_hash, 'holes': holes})
+    except OSError as err:
+        logging.warning(f"Could not save the intercept state: {err}")
+
+    prune_intercept_states()
+
+def prune_intercept_states():
+    """ Deletes the intercept state of every set of queries that has not been used for INTERCEPT_STATE_MAX_AGE_DAYS """
+    oldest = time.time() - INTERCEPT_STATE_MAX_AGE_DAYS * 24 * 3600
+    for path in glob.glob(os.path.join(glob.escape(config.settings.cache_location), "intercept_state*.json")):
+        try:
+            if os.path.getmtime(path) < oldest:
+                os.remove(path)
+        except OSError as err:
+            logging.warning(f"Could not delete the old intercept state {path}: {err}")
@@ -0,0 +1,305 @@
+import math
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from Hole import AssayType
+from intervals import IntervalIndex, check_depth_window, length_weighted_grades
+from units import convert
+
+
+class StoredInterval:
+    """
+    A lightweight view over a single row of a HoleStore. It exposes the same
+    interface as IntervalData so it can be handed to the functions in library.py
+    without materialising a dict of assays for every row.
+    """
+    __slots__ = ('store', 'row', 'span')
+
+    def __init__(self, store: "HoleStore", row: int):
+        self.store = store
+        self.row = row
+        self.span = (float(store.from_depth[row]), float(store.to_depth[row]))
+
+    def start(self) -> float:
+        return self.span[0]
+
+    def end(self) -> float:
+        return self.span[1]
+
+    def get_length(self):
+        return self.span[1] - self.span[0]
+
+    def get_assay(self, assay_type: AssayType):
+        column = self.store.column_of(assay_type)
+        if column is None:
+            return None
+
+        value = self.store.values[column][self.row]
+        if value != value:  # NaN marks an assay that was not recorded
+            return None
+
+        return float(value)
+
+    def calculate_concentration_metres(self, assay: AssayType):
+        value = self.get_assay(assay)
+        if value is None:
+            raise KeyError(assay)
+
+        return value * self.get_length()
+
+    def __repr__(self) -> str:
+        return f"<Interval ({self.span}) row {self.row}>"
+
+
+class StoredHole:
+    """ A view of the rows belonging to one hole in a HoleStore. Mirrors the HoleData interface """
+
+    def __init__(self, store: "HoleStore", index: int):
+        self.store = store
+        self.index = index
+        self.holeID = store.hole_ids[index]
+        self.lo = int(store.offsets[index])
+        self.hi = int(store.offsets[index + 1])
+
+    def __len__(self):
+        return self.hi - self.lo
+
+    def get_intervals(self) -> List[StoredInterval]:
+        # Rows are sorted by hole and then by From when the store is built
+        return [StoredInterval(self.store, row) for row in range(self.lo, self.hi)]
+
+    def contiguous_ranges(self) -> List[Tuple[int, int]]:
+        """
+        Returns the [start, end) row ranges of this hole in which each interval
+        ends exactly where the next one begins.
+        """
+        if self.hi == self.lo:
+            return []
+
+        starts = self.store.from_depth[self.lo:self.hi]
+        ends = self.store.to_depth[self.lo:self.hi]
+        breaks = (np.flatnonzero(ends[:-1] != starts[1:]) + 1 + self.lo).tolist()
+
+        bounds = [self.lo] + breaks + [self.hi]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def group_contiguous_intervals(self) -> List[List[StoredInterval]]:
+        return [
+            [StoredInterval(self.store, row) for row in range(lo, hi)]
+            for lo, hi in self.contiguous_ranges()
+        ]
+
+    def interval_index(self) -> IntervalIndex:
+        """ An IntervalIndex over this hole's rows, kept by the store so it is only built once """
+        index = self.store._interval_indexes.get(self.index)
+        if index is None:
+            index = self.store._interval_indexes[self.index] = IntervalIndex(
+                self.store.from_depth[self.lo:self.hi].tolist(), self.store.to_depth[self.lo:self.hi].tolist())
+        return index
+
+    def query_depth(self, depth_from: float, depth_to: float, analytes: List[AssayType] = None) -> Dict[AssayType, Optional[float]]:
+        """ See HoleData.query_depth """
+        check_depth_window(depth_from, depth_to)
+        if analytes is None:
+            analytes = [a for k, a in enumerate(self.store.analytes) if not np.isnan(self.store.values[k][self.lo:self.hi]).all()]
+
+        index = self.interval_index()
+        positions = index.overlapping(depth_from, depth_to)
+        rows = [self.lo + p for p in positions]
+
+        columns = []
+        for analyte in analytes:
+            column = self.store.column_of(analyte)
+            values = self.store.values[column][rows].tolist() if column is not None and rows else [math.nan] * len(rows)
+            columns.append([None if math.isnan(v) else v for v in values])
+
+        return length_weighted_grades(analytes, columns, index.overlap_lengths(positions, depth_from, depth_to))
+
+
+class HoleStore:
+    """
+    Columnar storage for every sample in an export.
+
+    Rows are grouped by hole (in the order the holes first appear in the export) and
+    sorted by From within each hole. The rows of hole `i` are `offsets[i]:offsets[i+1]`.
+    `values[k]` holds the column for `analytes[k]`, with NaN wherever an assay was not recorded.
+
+    A HoleStore behaves like the old `dict[str, HoleData]` data table for lookups by hole ID.
+    """
+
+    def __init__(self, hole_ids: List[str], offsets, from_depth, to_depth, analytes: List[AssayType], values):
+        self.hole_ids = hole_ids
+        self.offsets = offsets
+        self.from_depth = from_depth
+        self.to_depth = to_depth
+        self.analytes = analytes
+        self.values = values
+
+        self.hole_index = {hole: i for i, hole in enumerate(hole_ids)}
+        self._columns_by_id = None
+        self._interval_indexes = {}
+
+    def column_of(self, assay: AssayType):
+        """ Returns the index into `values` for an assay type, or None if the export did not record it """
+        columns = self._columns_by_id
+        if columns is None:
+            # The column of each assay id, or None for ids the export did not record
+            columns = self._columns_by_id = [None] * (max((a.get_unique_id() for a in self.analytes), default=-1) + 1)
+            for k, analyte in enumerate(self.analytes):
+                columns[analyte.get_unique_id()] = k
+
+        unique_id = assay.get_unique_id()
+        return columns[unique_id] if unique_id < len(columns) else None
+
+    def normalise_units(self, analytes: List[AssayType]):
+        """
+        Gives each of `analytes` that the export only recorded in some other unit a column of its
+        own, converted into the analyte's base unit in one go, so a query can ask for an element in
+        whichever unit it likes without anything being converted as its intercepts are calculated.
+        """
+        added, columns = [], []
+        for assay in analytes:
+            converted = AssayType(assay.element, assay.base_unit)
+            if self.column_of(assay) is not None or converted in added:
+                continue
+
+            recorded = next((k for k, a in enumerate(self.analytes) if a.element == assay.element), None)
+            if recorded is not None:
+                added.append(converted)
+                columns.append(convert(np.asarray(self.values[recorded]), self.analytes[recorded].base_unit, assay.base_unit))
+
+        if added:
+            self.analytes = self.analytes + added
+            self.values = np.vstack([self.values, columns]) if isinstance(self.values, np.ndarray) else list(self.values) + columns
+            self._columns_by_id = None
+
+    def __getstate__(self):
+        # Assay ids are only meaningful within one process, so the lookup is rebuilt after unpickling
+        state = dict(self.__dict__)
+        state['_columns_by_id'] = None
+        return state
+
+    def subset(self, holes: List[str], analytes: List[AssayType]) -> "HoleStore":
+        """
+        Copies the rows of `holes`, and only the columns of `analytes`, into a new compact HoleStore.
+        This is what gets shipped to worker processes rather than the whole data table.
+        """
+        bounds = [(int(self.offsets[i]), int(self.offsets[i + 1])) for i in (self.hole_index[hole] for hole in holes)]
+        rows = np.concatenate([np.arange(lo, hi) for lo, hi in bounds]) if bounds else np.empty(0, dtype=np.int64)
+
+        offsets = np.zeros(len(bounds) + 1, dtype=np.int64)
+        np.cumsum([hi - lo for lo, hi in bounds], out=offsets[1:])
+
+        kept = [a for a in analytes if self.column_of(a) is not None]
+        values = np.empty((len(kept), len(rows)), dtype=np.float64)
+        for k, assay in enumerate(kept):
+            values[k] = self.values[self.column_of(assay)][rows]
+
+        return HoleStore(list(holes), offsets, np.asarray(self.from_depth[rows]), np.asarray(self.to_depth[rows]), kept, values)
+
+    def keys(self):
+        return self.hole_index.keys()
+
+    def __contains__(self, hole) -> bool:
+        return hole in self.hole_index
+
+    def __getitem__(self, hole) -> StoredHole:
+        return StoredHole(self, self.hole_index[hole])
+
+    def __iter__(self):
+        return iter(self.hole_ids)
+
+    def __len__(self):
+        return len(self.hole_ids)
+
+    @property
+    def row_count(self) -> int:
+        return len(self.from_depth)
+
+    @property
+    def nbytes(self) -> int:
+        return (self.offsets.nbytes + self.from_depth.nbytes + self.to_depth.nbytes
+                + sum(column.nbytes for column in self.values))
+
+
+class HoleStoreBuilder:
+    """
+    Accumulates rows in file order into compact typed buffers and produces a HoleStore.
+    """
+
+    def __init__(self, analytes: List[AssayType]):
+        self.analytes = list(analytes)
+        self.hole_ids: List[str] = []
+        self.hole_codes: dict[str, int] = {}
+
+        self._codes = array('i')
+        self._from = array('d')
+        self._to = array('d')
+        self._values = array('d')
+
+    def add_hole(self, hole_id: str) -> int:
+        """ Registers a hole, even if none of its rows turn out to be usable """
+        code = self.hole_codes.get(hole_id)
+        if code is None:
+            code = len(self.hole_ids)
+            self.hole_codes[hole_id] = code
+            self.hole_ids.append(hole_id)
+
+        return code
+
+    def add(self, hole_id: str, span: Tuple[float, float], values: List[float]):
+        """ Appends a row. `values` must be ordered like `analytes`, using NaN for missing assays """
+        self._codes.append(self.add_hole(hole_id))
+        self._from.append(span[0])
+        self._to.append(span[1])
+        self._values.extend(values)
+
+    def add_chunk(self, hole_ids: List[str], codes: np.ndarray, starts: np.ndarray, ends: np.ndarray, values: np.ndarray):
+        """
+        Appends a block of rows parsed elsewhere. `codes` index into `hole_ids`, which must list
+        the holes of the block in the order they first appear, and `values` has one row per sample
+        with its columns ordered like `analytes`.
+        """
+        mapping = np.array([self.add_hole(hole_id) for hole_id in hole_ids], dtype=np.intc)
+        if len(codes):
+            self._codes.frombytes(mapping[codes].tobytes())
+        self._from.frombytes(np.ascontiguousarray(starts, dtype=np.float64).tobytes())
+        self._to.frombytes(np.ascontiguousarray(ends, dtype=np.float64).tobytes())
+        self._values.frombytes(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+
+    def chunk(self):
+        """ Returns the rows added so far in the form add_chunk takes, without sorting them """
+        return (
+            self.hole_ids,
+            np.frombuffer(self._codes, dtype=np.intc),
+            np.frombuffer(self._from, dtype=np.float64),
+            np.frombuffer(self._to, dtype=np.float64),
+            np.frombuffer(self._values, dtype=np.float64).reshape(len(self._codes), len(self.analytes)),
+        )
+
+    def build(self) -> HoleStore:
+        codes = np.frombuffer(self._codes, dtype=np.intc)
+        starts = np.frombuffer(self._from, dtype=np.float64)
+        ends = np.frombuffer(self._to, dtype=np.float64)
+        row_count = len(codes)
+        analyte_count = len(self.analytes)
+
+        # lexsort is stable, so rows sharing a From keep their file order just as sorted() did
+        order = np.lexsort((starts, codes))
+
+        counts = np.bincount(codes, minlength=len(self.hole_ids))
+        offsets = np.zeros(len(self.hole_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        matrix = np.frombuffer(self._values, dtype=np.float64).reshape(row_count, analyte_count)
+        values = np.empty((analyte_count, row_count), dtype=np.float64)
+        for k in range(analyte_count):
+            values[k] = matrix[order, k]
+
+        store = HoleStore(self.hole_ids, offsets, starts[order], ends[order], self.analytes, values)
+
+        del matrix, codes, starts, ends
+        self._codes, self._from, self._to, self._values = array('i'), array('d'), array('d'), array('d')
+        return store
@@ -0,0 +1,2 @@
+# The modules of the application sit at the top of the repository and read config.toml from the
+# working directory, so the tests are run from here with `python -m pytest`
@@ -0,0 +1,163 @@
+
+# A NumPy implementation of library.calculate_intercepts_from_group which works on the
+# columns of a HoleStore rather than on lists of IntervalData. It reproduces the behaviour
+# of the original interval by interval loop exactly, including its treatment of missing
+# assays and of the dilution allowance, so the two engines can be used interchangeably.
+import logging
+from typing import List, Tuple
+
+import numpy as np
+
+from columnar import HoleStore
+from config import config
+from Hole import AssayType, Intercept
+
+
+def _sequential_sums(columns: np.ndarray, indexes: np.ndarray) -> List[float]:
+    # The total of each row of `columns` over `indexes`. np.sum uses pairwise summation, which can
+    # differ in the last bit from the running total the python engine keeps, whereas cumsum adds
+    # strictly left to right. Adding 0.0 mirrors the `total = 0` the python engine starts from.
+    return (np.cumsum(columns[:, indexes], axis=1)[:, -1] + 0.0).tolist()
+
+def _intercept_end(gap_lengths: np.ndarray, above: np.ndarray, above_at: np.ndarray, running: np.ndarray, p: int, dilution: float) -> int:
+    """
+    Finds where the intercept starting at the interval above_at[p] ends: the first interval above
+    the cutoff once the dilution collected since the start exceeds the allowance, or the end of the run.
+    `running` holds the dilution collected along the whole run up to each interval in `above_at`.
+    """
+    count = len(gap_lengths)
+    if p + 1 == len(above_at):
+        return count
+
+    # The running totals give the break with a single search. They are sums from the start of
+    # the run though, so the break is checked against the dilution added up from this intercept's
+    # start, as calculate_intercepts_from_group adds it, and looked for further on if it moved
+    q = min(max(int(np.searchsorted(running, running[p] + dilution, side='right')), p + 1), len(above_at) - 1)
+    lo, collected = int(above_at[p]) + 1, 0.0
+    while q < len(above_at):
+        hi = int(above_at[q]) + 1
+        gaps = np.cumsum(np.concatenate(([collected], gap_lengths[lo:hi])))[1:]
+        breaks = above[lo:hi] & (gaps > dilution)
+        if breaks.any():
+            return lo + int(np.argmax(breaks))
+        lo, collected, q = hi, gaps[-1], q + 1
+
+    return count
+
+def find_intercept_members_for_cutoffs(values: np.ndarray, lengths: np.ndarray, cutoffs: List[float], dilution: float) -> List[List[np.ndarray]]:
+    '''
+    Works out which intervals of a contiguous run form each intercept, for several cutoffs at once.
+    The masks for every cutoff are built together as (cutoff, interval) arrays, so the run is only
+    swept once however many cutoffs there are.
+
+    `values` holds the primary assay for each interval with NaN where it was not recorded.
+    Returns a list for each cutoff containing, for each intercept, the indexes of the intervals it is made up of.
+    '''
+    count = len(values)
+    missing = np.isnan(values)
+    value = np.where(missing, -1.0, values)
+    thresholds = np.asarray(cutoffs, dtype=np.float64)[:, None]
+    above = value >= thresholds
+
+    # An interval above the cutoff starts collecting, a missing assay stops it. Collecting
+    # is therefore decided by whichever of those events happened most recently.
+    positions = np.arange(count)
+    last_above = np.maximum.accumulate(np.where(above, positions, -1), axis=1)
+    last_missing = np.maximum.accumulate(np.where(missing, positions, -1))
+    collecting_after = last_above > last_missing
+    collecting = np.zeros_like(above)
+    collecting[:, 1:] = collecting_after[:, :-1]
+
+    diluent = ~above & ~missing & collecting
+    members = above | diluent
+    gap_lengths = np.where(diluent, lengths, 0.0)
+
+    # Mirrors remove_tail_below_threshold, which drops missing, zero and below cutoff values
+    trimmable = missing | (value == 0) | (value < thresholds)
+
+    # The dilution collected up to each interval, for every cutoff
+    running_gaps = np.cumsum(gap_lengths, axis=1)
+
+    intercepts = []
+    for k in range(len(cutoffs)):
+        cutoff_intercepts = []
+        intercepts.append(cutoff_intercepts)
+        above_at = np.flatnonzero(above[k])
+        running = running_gaps[k, above_at]
+
+        p = 0
+        while p < len(above_at):
+            start = int(above_at[p])
+            end = _intercept_end(gap_lengths[k], above[k], above_at, running, p, dilution)
+
+            indexes = np.flatnonzero(members[k, start:end]) + start
+            kept = np.flatnonzero(~trimmable[k, indexes])
+            if len(kept):
+                cutoff_intercepts.append(indexes[:kept[-1] + 1])
+
+            p = int(np.searchsorted(above_at, end))
+
+    return intercepts
+
+def calculate_intercepts_for_cutoffs_from_arrays(starts: np.ndarray, ends: np.ndarray, values: np.ndarray, assay: AssayType, cutoffs: List[float],
+                                                 co_analytes: List[AssayType] = None, co_values: List[np.ndarray] = None) -> List[List[Intercept]]:
+    '''
+    Calculates the intercepts of a single contiguous run of intervals for every cutoff of an assay at once.
+    `co_values` holds a column for each of `co_analytes`, or None for a co-analyte that was not recorded.
+
+    Returns: a list of intercepts for each cutoff
+    '''
+    co_analytes = co_analytes or []
+    co_values = co_values or [None] * len(co_analytes)
+    lengths = ends - starts
+
+    negative = np.count_nonzero(values < 0)
+    if negative:
+        logging.critical(f"WE HAVE NEGATIVE CONCENTRATIONS. {negative} intervals of {assay} from {starts[0]}m")
+
+    # Every column an intercept is totalled over, so each intercept is totalled in one go: the
+    # grade x length of the primary, the lengths, then the grade x length of each recorded co-analyte
+    recorded = [k for k, column in enumerate(co_values) if column is not None]
+    columns = np.vstack([values * lengths, lengths] + [np.where(np.isnan(co_values[k]), 0.0, co_values[k] * lengths) for k in recorded])
+
+    intercepts = []
+    for cutoff_members in find_intercept_members_for_cutoffs(values, lengths, cutoffs, config.settings.internal_dilution_intervals):
+        cutoff_intercepts = []
+        for indexes in cutoff_members:
+            first = int(indexes[0])
+            concentration, distance, *recorded_totals = _sequential_sums(columns, indexes)
+            co_totals = [0] * len(co_analytes)
+            for k, total in zip(recorded, recorded_totals):
+                co_totals[k] = total
+
+            coans = {co.get_unique_id(): total for co, total in zip(co_analytes, co_totals)}
+            span = (float(starts[first]), float(ends[first]))
+            cutoff_intercepts.append(Intercept(assay, concentration / distance, distance, span, coans))
+        intercepts.append(cutoff_intercepts)
+
+    return intercepts
+
+def _range_columns(store: HoleStore, rows: Tuple[int, int], assay: AssayType, co_analytes):
+    lo, hi = rows
+
+    def column(assay_type):
+        index = store.column_of(assay_type)
+        return None if index is None else store.values[index][lo:hi]
+
+    return store.from_depth[lo:hi], store.to_depth[lo:hi], column(assay), [column(co) for co in co_analytes]
+
+def calculate_intercepts_from_range(store: HoleStore, rows: Tuple[int, int], assay: AssayType, cutoff: float, co_analytes = None) -> List[Intercept]:
+    '''
+    The NumPy counterpart of calculate_intercepts_from_group. `rows` is one of the contiguous
+    row ranges returned by StoredHole.contiguous_ranges()
+    '''
+    return calculate_intercepts_for_cutoffs_from_range(store, rows, assay, [cutoff], co_analytes)[0]
+
+def calculate_intercepts_for_cutoffs_from_range(store: HoleStore, rows: Tuple[int, int], assay: AssayType, cutoffs: List[float], co_analytes = None) -> List[List[Intercept]]:
+    ''' The NumPy counterpart of library.calculate_intercepts_for_cutoffs '''
+    co_analytes = co_analytes or []
+    starts, ends, values, co_values = _range_columns(store, rows, assay, co_analytes)
+    if values is None:
+        return [[] for _ in cutoffs]
+
+    return calculate_intercepts_for_cutoffs_from_arrays(starts, ends, values, assay, cutoffs, co_analytes, co_values)
@@ -20,3 +20,9 @@ class MissingHoleDataException(Exception):
         else:
             return f"Missing data for HoleID {self.hole_id}"
 
+
+class UnsortedExportException(Exception):
+    """ Raised when streaming an export whose rows are not grouped by hole """
+    def __init__(self, hole_id):
+        self.hole_id = hole_id
+        super().__init__(f"Rows for HoleID {hole_id} are not together in the export, so it cannot be streamed one hole at a time")
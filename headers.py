@@ -0,0 +1,116 @@
+
+# Recognises which columns of an export hold assays, and in what unit, from its header row.
+#
+# An assay header is an element followed by a unit, optionally separated by spaces, underscores
+# or dashes, e.g. `Cu_ppm`, `Pd_ppb`, `Fe %`, `Au g/t` or `Ag oz/t`. This accepts the same headers as
+# ElementParser.TryParse, which lexes a header character by character, but does it with a
+# single compiled pattern. Unlike the lexer it also allows more than one separator in a row and
+# trailing separators. Units are matched regardless of case, and elements in the periodic
+# table are written the usual way (so `CU_PPM` is read as Cu), while anything else that
+# looks like an element, such as `AuR`, is kept as it is written.
+#
+# The result for a header row is remembered by its hash in memory, and under `cache_location` when
+# `full_dataset_cache` is set, so every export with the same layout is only recognised once.
+import hashlib
+import json
+import logging
+import os
+import re
+from types import MappingProxyType
+from typing import List
+
+from cache import save_json
+from config import config
+from Hole import AssayType, AssayUnit
+from KnownElements import elements
+from units import TEXT_UNITS
+
+# Bump this whenever the rules below change, so that remembered layouts are recognised again
+RECOGNISER_VERSION = 2
+
+# How many layouts are kept under `cache_location`. The oldest is dropped to make room for a new one
+MAX_STORED_LAYOUTS = 32
+
+UNITS = TEXT_UNITS
+
+_CANONICAL_ELEMENTS = {symbol.lower(): symbol for symbol in elements}
+
+_SEPARATOR = r"[ _\-\n\t]"
+_UNIT = "|".join(re.escape(unit) for unit in UNITS)
+
+# The element is matched atomically: like the lexer, `Cuppm` is one word rather than Cu in ppm
+_ASSAY_HEADER = re.compile(
+    rf"{_SEPARATOR}*(?!(?:{_UNIT}))(?P<element>(?>(?:[^\W_]|\()(?:[^\W_]|[()])*)){_SEPARATOR}*(?P<unit>{_UNIT}){_SEPARATOR}*",
+    re.IGNORECASE,
+)
+
+_layouts = {}
+_stored_layouts = None
+
+
+def parse_assay_header(header: str):
+    """ Returns the AssayType a header holds, or None if it is not an assay header """
+    match = _ASSAY_HEADER.fullmatch(header)
+    if match is None:
+        return None
+
+    element = match['element']
+    return AssayType(_CANONICAL_ELEMENTS.get(element.lower(), element), UNITS[match['unit'].lower()])
+
+def header_layout_key(header_row: List[str]) -> str:
+    hasher = hashlib.sha256(str(RECOGNISER_VERSION).encode('utf-8'))
+    for header in header_row:
+        hasher.update(b'\0')
+        hasher.update(header.encode('utf-8'))
+    return hasher.hexdigest()
+
+def _layouts_path() -> str:
+    return os.path.join(config.settings.cache_location, "header_layouts.json")
+
+def _load_stored_layouts() -> dict:
+    global _stored_layouts
+    if not config.settings.full_dataset_cache:
+        return {}
+    if _stored_layouts is None:
+        try:
+            with open(_layouts_path(), 'r', encoding='utf-8') as file:
+                _stored_layouts = json.load(file)
+        except (OSError, ValueError):
+            _stored_layouts = {}
+    return _stored_layouts
+
+def _store_layout(key: str, layout):
+    if not config.settings.full_dataset_cache:
+        return
+
+    stored = _load_stored_layouts()
+    stored[key] = [[index, assay.element, assay.base_unit.name] for index, assay in layout.items()]
+    for oldest in list(stored)[:-MAX_STORED_LAYOUTS]:
+        del stored[oldest]
+
+    path = _layouts_path()
+    try:
+        save_json(path, stored)
+    except OSError as err:
+        logging.warning(f"Could not save the header layout: {err}")
+
+def recognise_assay_columns(header_row: List[str]) -> MappingProxyType:
+    """
+    Returns a read only mapping from the index of every assay column in `header_row` to its AssayType.
+    """
+    key = header_layout_key(header_row)
+    layout = _layouts.get(key)
+    if layout is not None:
+        return layout
+
+    stored = _load_stored_layouts().get(key)
+    if stored is not None:
+        layout = MappingProxyType({index: AssayType(element, AssayUnit[unit]) for index, element, unit in stored})
+    else:
+        layout = MappingProxyType({
+            index: assay for index, header in enumerate(header_row) if (assay := parse_assay_header(header)) is not None
+        })
+        _store_layout(key, layout)
+
+    _layouts[key] = layout
+    return layout
@@ -0,0 +1,205 @@
+
+# An on-disk columnar format for drillhole samples which can be opened with numpy.memmap.
+#
+# A hole file is a directory laid out as follows:
+#
+#     holes.json        version, row count, hole IDs (in export order) and analytes
+#     offsets.npy       int64, rows of hole i are offsets[i]:offsets[i+1]
+#     from.npy          float64 From of each row, sorted by hole and then From
+#     to.npy            float64 To of each row
+#     values/<k>.npy    float64 column for analyte k, NaN where it was not recorded
+#
+# Opening a hole file only reads holes.json. Every other array is memory mapped, so pages
+# are only read from disk for the holes and analytes a query actually touches.
+import json
+import os
+import shutil
+import sys
+from array import array
+from typing import List, Tuple
+
+import numpy as np
+
+from columnar import HoleStore
+from Hole import AssayType, AssayUnit
+
+HOLE_FILE_VERSION = 1
+MANIFEST_NAME = 'holes.json'
+
+
+def is_hole_file(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, MANIFEST_NAME))
+
+def _load_array(path: str, length: int):
+    # mmap cannot map an empty file, so there is nothing to gain from mapping an empty column
+    if length == 0:
+        return np.load(path)
+    return np.load(path, mmap_mode='r')
+
+def open_hole_file(path: str) -> HoleStore:
+    """ Opens a hole file as a HoleStore without reading any of its columns """
+    with open(os.path.join(path, MANIFEST_NAME), 'r', encoding='utf-8') as file:
+        manifest = json.load(file)
+
+    if manifest['version'] != HOLE_FILE_VERSION:
+        raise ValueError(f"Unsupported hole file version {manifest['version']} in {path}")
+
+    rows = manifest['row_count']
+    analytes = [AssayType(element, AssayUnit[unit]) for element, unit in manifest['analytes']]
+    values = [_load_array(os.path.join(path, 'values', f'{k}.npy'), rows) for k in range(len(analytes))]
+
+    return HoleStore(
+        manifest['hole_ids'],
+        np.load(os.path.join(path, 'offsets.npy')),
+        _load_array(os.path.join(path, 'from.npy'), rows),
+        _load_array(os.path.join(path, 'to.npy'), rows),
+        analytes,
+        values,
+    )
+
+def _write_manifest(path: str, hole_ids: List[str], analytes: List[AssayType], row_count: int):
+    manifest = {
+        'version': HOLE_FILE_VERSION,
+        'row_count': row_count,
+        'hole_ids': hole_ids,
+        'analytes': [[a.element, a.base_unit.name] for a in analytes],
+    }
+    with open(os.path.join(path, MANIFEST_NAME), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file)
+
+def _move_into_place(partial_path: str, path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(partial_path, path)
+
+def _partial_directory(path: str) -> str:
+    partial_path = f"{path}.{os.getpid()}.partial"
+    if os.path.isdir(partial_path):
+        shutil.rmtree(partial_path)
+    os.makedirs(os.path.join(partial_path, 'values'))
+    return partial_path
+
+def write_hole_file(store: HoleStore, path: str):
+    """ Writes an in-memory HoleStore out as a hole file """
+    partial_path = _partial_directory(path)
+
+    np.save(os.path.join(partial_path, 'offsets.npy'), np.asarray(store.offsets, dtype=np.int64))
+    np.save(os.path.join(partial_path, 'from.npy'), np.asarray(store.from_depth, dtype=np.float64))
+    np.save(os.path.join(partial_path, 'to.npy'), np.asarray(store.to_depth, dtype=np.float64))
+    for k in range(len(store.analytes)):
+        np.save(os.path.join(partial_path, 'values', f'{k}.npy'), np.asarray(store.values[k], dtype=np.float64))
+
+    # The manifest goes last so a half written directory is never mistaken for a hole file
+    _write_manifest(partial_path, store.hole_ids, store.analytes, store.row_count)
+    _move_into_place(partial_path, path)
+
+
+class HoleFileWriter:
+    """
+    Builds a hole file straight from parsed rows without holding the export in memory.
+    It has the same interface as HoleStoreBuilder, so it can be handed to build_data_table.
+
+    Rows are spilled in file order to raw column files, then sorted into place one column
+    at a time when build() is called.
+    """
+
+    def __init__(self, path: str, analytes: List[AssayType], spill_rows: int = 65536):
+        self.path = path
+        self.analytes = list(analytes)
+        self.spill_rows = spill_rows
+        self.hole_ids: List[str] = []
+        self.hole_codes: dict[str, int] = {}
+        self.row_count = 0
+
+        self.partial_path = _partial_directory(path)
+        self._raw_files = {
+            name: open(os.path.join(self.partial_path, f'{name}.raw'), 'wb')
+            for name in ['codes', 'from', 'to'] + [f'values/{k}' for k in range(len(self.analytes))]
+        }
+        self._reset_buffers()
+
+    def _reset_buffers(self):
+        self._codes = array('i')
+        self._from = array('d')
+        self._to = array('d')
+        self._values = array('d')
+
+    def _spill(self):
+        if not self._codes:
+            return
+
+        self._codes.tofile(self._raw_files['codes'])
+        self._from.tofile(self._raw_files['from'])
+        self._to.tofile(self._raw_files['to'])
+
+        matrix = np.frombuffer(self._values, dtype=np.float64).reshape(len(self._codes), len(self.analytes))
+        for k in range(len(self.analytes)):
+            np.ascontiguousarray(matrix[:, k]).tofile(self._raw_files[f'values/{k}'])
+
+        del matrix
+        self._reset_buffers()
+
+    def add_hole(self, hole_id: str) -> int:
+        code = self.hole_codes.get(hole_id)
+        if code is None:
+            code = len(self.hole_ids)
+            self.hole_codes[hole_id] = code
+            self.hole_ids.append(hole_id)
+
+        return code
+
+    def add(self, hole_id: str, span: Tuple[float, float], values: List[float]):
+        self._codes.append(self.add_hole(hole_id))
+        self._from.append(span[0])
+        self._to.append(span[1])
+        self._values.extend(values)
+        self.row_count += 1
+
+        if len(self._codes) >= self.spill_rows:
+            self._spill()
+
+    def _sort_column(self, name: str, order: np.ndarray, target: str):
+        raw_path = os.path.join(self.partial_path, f'{name}.raw')
+        column = np.fromfile(raw_path, dtype=np.float64)
+        np.save(os.path.join(self.partial_path, target), column[order])
+        del column
+        os.remove(raw_path)
+
+    def build(self) -> HoleStore:
+        self._spill()
+        for file in self._raw_files.values():
+            file.close()
+
+        codes_path = os.path.join(self.partial_path, 'codes.raw')
+        codes = np.fromfile(codes_path, dtype=np.intc)
+        starts = np.fromfile(os.path.join(self.partial_path, 'from.raw'), dtype=np.float64)
+        order = np.lexsort((starts, codes))
+        del starts
+
+        counts = np.bincount(codes, minlength=len(self.hole_ids))
+        offsets = np.zeros(len(self.hole_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        np.save(os.path.join(self.partial_path, 'offsets.npy'), offsets)
+        del codes
+        os.remove(codes_path)
+
+        self._sort_column('from', order, 'from.npy')
+        self._sort_column('to', order, 'to.npy')
+        for k in range(len(self.analytes)):
+            self._sort_column(f'values/{k}', order, os.path.join('values', f'{k}.npy'))
+
+        _write_manifest(self.partial_path, self.hole_ids, self.analytes, self.row_count)
+        _move_into_place(self.partial_path, self.path)
+        return open_hole_file(self.path)
+
+
+if __name__ == '__main__':
+    # Converts a CSV export into a hole file:
+    #     python holefile.py Drilling_Samples_R1.csv Drilling_Samples_R1.holes
+    from refactor import convert_export_to_hole_file
+
+    if len(sys.argv) != 3:
+        sys.exit("usage: python holefile.py <export.csv> <output.holes>")
+
+    store = convert_export_to_hole_file(sys.argv[1], sys.argv[2])
+    print(f"Wrote {store.row_count} samples from {len(store)} holes to {sys.argv[2]}")
@@ -11,14 +11,15 @@ import time
 
 from tqdm import tqdm
 
-from library import convert_unit, count_lines_and_hash, try_parse_to_assay_type
-from refactor import analyse_hole, build_data_table
+from library import export_size, load_assay_list
+from refactor import ingest_analytes, open_data_table, perform_analysis, try_streaming_analysis
+from units import UNIT_TEXT
 
 
 
 CONFIG_PATH = 'config.toml'
 ASSAY_CONFIG_PATH = 'assays.toml'
-VALID_UNITS = ['%', 'ppm', 'ppb']
+VALID_UNITS = list(UNIT_TEXT.values())
 VALID_ELEMENTS = {
     # Common chemical symbols
     "H", "He", "Li", "Be", "B", "C", "N", "O", "F", "Ne",
@@ -156,6 +157,9 @@ class ConfigEditor:
         add_list_editor('hole_selections', 'Hole Selections')
         add_list_editor('queries_to_run', 'Queries to Run')
         add_checkbox('seperate_assay_files', 'Separate Assay Files')
+        add_checkbox('streaming', 'Stream Hole-Sorted Exports')
+        add_checkbox('recalc', 'Recalculate Every Hole')
+        add_checkbox('result_cache', 'Cache Intercept Results')
         add_entry('exported_data_path', 'Exported CSV Path', is_path=True)
         add_entry('sample_id_column_name', 'Sample ID Column')
         add_entry('hole_id_column_name', 'Hole ID Column')
@@ -163,6 +167,10 @@ class ConfigEditor:
         add_entry('internal_dilution_intervals', "Internal Dilution Factor")
         add_entry("from_column_name", "'From' column name")
         add_entry("to_column_name", "'To' column name")
+        add_entry("worker_count", "Worker Processes (0 = all cores)")
+        add_entry("ingest_workers", "Ingest Processes (0 = all cores)")
+        add_entry("result_cache_size_mb", "Result Cache Size (MB)")
+        add_entry("output_format", "Output Format (csv, npz or arrow)")
 
         # Buttons
         btn_frame = ttk.Frame(self.root)
@@ -193,65 +201,43 @@ class ConfigEditor:
 
         file_name = config.settings.exported_data_path
 
-        loc, hash_value = count_lines_and_hash(file_name)
-        self.progress["maximum"] = loc -1
+        assay_list_ = load_assay_list(ASSAY_CONFIG_PATH)
 
-        i = 0
-        def update_progress():
-            nonlocal i
-            self.progress.after(0, lambda val=i: self.progress.configure(value=val))
-            i+=1
-
-        data_table_ = build_data_table(file_name, loc, update_progress)
+        # Ingest progress is reported in bytes read, so there is no need to count lines first
+        self.progress["maximum"] = export_size(file_name)
 
-        self.progress["value"] = 0
-
-        queries = None
-        with open('assays.toml', 'rb') as queries_file:
-            queries = tomllib.load(queries_file)
+        def update_progress(bytes_read):
+            self.progress.after(0, lambda val=bytes_read: self.progress.configure(value=val))
 
-        assay_list_ = []
-        for assay in list(queries.values()):
-            element = assay['element']
-            base_unit = assay['base_unit']
-            reported_unit = assay['reported_unit']
-            cutoffs = assay['cutoffs']
-            
-            primary = try_parse_to_assay_type(element, base_unit, reported_unit)
+        filename = self.output_path_var.get()
 
-            for i, cutoff in enumerate(cutoffs):
-                cutoffs[i] = convert_unit(cutoff, primary.reported_unit, primary.base_unit)
+        # A streamed export is analysed as it is read, so its progress stays in bytes
+        if try_streaming_analysis(file_name, assay_list_, filename, update_progress):
+            messagebox.showinfo("Success", "Intervals were successfully calculated and exported")
+            return
 
-            co_analytes = assay['co_analytes']
-            analytes = []
-            for co in co_analytes:
-                analytes.append(try_parse_to_assay_type(co['element'], co['base_unit'], co['reported_unit']))
+        data_table_ = open_data_table(file_name, update_progress, ingest_analytes(assay_list_))
 
-            assay_list_.append((primary, cutoffs, analytes))
+        self.progress["value"] = 0
 
         print(assay_list_)
 
-        filename = self.output_path_var.get()
-
         if config.settings.hole_selections == ['*']:
             holes_to_calc = list(data_table_.keys())
         else:
             holes_to_calc = config.settings.hole_selections
 
 
-        with open(filename, mode='w', newline='') as csvfile:
-            writer = csv.writer(csvfile, quoting=csv.QUOTE_NONNUMERIC, escapechar='\\')
+        # Each query goes over every hole again when it is written to a file of its own
+        self.progress["maximum"] = len(holes_to_calc) * (len(assay_list_) if config.settings.seperate_assay_files else 1)
 
-            header = ['Hole', 'Primary Analyte', 'Cutoff', 'Cutoff Unit', 'From', 'To', 'Interval', 'Primary Intercept', 'Intercept Label', 'Co Analytes']
-            writer.writerow(header)
-
-            self.progress["maximum"] = len(holes_to_calc)
+        i = 0
+        def update_analysis_progress():
+            nonlocal i
+            self.progress.after(0, lambda val=i: self.progress.configure(value=val))
+            i+=1
 
-            i = 0
-            for hole in holes_to_calc:
-                analyse_hole(hole, writer, data_table_, assay_list_)
-                self.progress.after(0, lambda val=i: self.progress.configure(value=val))
-                i+=1
+        perform_analysis(data_table_, assay_list_, filename, holes_to_calc, update_analysis_progress)
 
         messagebox.showinfo("Success", "Intervals were successfully calculated and exported")
             
@@ -616,6 +602,9 @@ class ConfigEditor:
         self.main_entries['hole_selections'].config(text=str(s.get('hole_selections', ['*'])))
         self.main_entries['queries_to_run'].config(text=str(s.get('queries_to_run', ['*'])))
         self.main_entries['seperate_assay_files'].set(s.get('seperate_assay_files', False))
+        self.main_entries['streaming'].set(s.get('streaming', False))
+        self.main_entries['recalc'].set(s.get('recalc', False))
+        self.main_entries['result_cache'].set(s.get('result_cache', False))
 
         self.main_entries['exported_data_path'].delete(0, tk.END)
         self.main_entries['exported_data_path'].insert(0, s.get('exported_data_path', ''))
@@ -638,9 +627,21 @@ class ConfigEditor:
         self.main_entries['cache_location'].delete(0, tk.END)
         self.main_entries['cache_location'].insert(0, s.get('cache_location', './cache'))
 
+        self.main_entries['worker_count'].delete(0, tk.END)
+        self.main_entries['worker_count'].insert(0, s.get('worker_count', 1))
+        self.main_entries['ingest_workers'].delete(0, tk.END)
+        self.main_entries['ingest_workers'].insert(0, s.get('ingest_workers', 1))
+        self.main_entries['result_cache_size_mb'].delete(0, tk.END)
+        self.main_entries['result_cache_size_mb'].insert(0, s.get('result_cache_size_mb', 256))
+        self.main_entries['output_format'].delete(0, tk.END)
+        self.main_entries['output_format'].insert(0, s.get('output_format', 'csv'))
+
     def save_config(self, silent=True):
         s = self.data['settings']
         s['seperate_assay_files'] = self.main_entries['seperate_assay_files'].get()
+        s['streaming'] = self.main_entries['streaming'].get()
+        s['recalc'] = self.main_entries['recalc'].get()
+        s['result_cache'] = self.main_entries['result_cache'].get()
         s['exported_data_path'] = self.main_entries['exported_data_path'].get()
         s['sample_id_column_name'] = self.main_entries['sample_id_column_name'].get()
         s['hole_id_column_name'] = self.main_entries['hole_id_column_name'].get()
@@ -648,6 +649,10 @@ class ConfigEditor:
         s['internal_dilution_intervals'] = int(self.main_entries['internal_dilution_intervals'].get())
         s['from_column_name'] = self.main_entries['from_column_name'].get()
         s['to_column_name'] = self.main_entries['to_column_name'].get()
+        s['worker_count'] = int(self.main_entries['worker_count'].get())
+        s['ingest_workers'] = int(self.main_entries['ingest_workers'].get())
+        s['result_cache_size_mb'] = float(self.main_entries['result_cache_size_mb'].get())
+        s['output_format'] = self.main_entries['output_format'].get().strip().lower()
 
         with open(CONFIG_PATH, 'w') as f:
             toml.dump(self.data, f)
@@ -0,0 +1,63 @@
+# Depth window queries over the intervals of a single hole.
+#
+# IntervalIndex finds the intervals overlapping a window with two binary searches, whether the
+# hole is held as HoleData or in a HoleStore, and length_weighted_grades averages the assays of
+# those intervals over the window, counting only the part of each interval that lies inside it.
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional
+
+
+class IntervalIndex:
+    """
+    An index over intervals sorted by their start. Alongside each interval it keeps the deepest
+    end of it and every interval before it, which only ever increases, so the first interval that
+    could reach a window is found by a binary search even when intervals overlap one another.
+
+    A window is usually only a handful of intervals long, so this works on plain lists rather
+    than numpy arrays, which cost more to set up per query than they save.
+    """
+
+    def __init__(self, starts: List[float], ends: List[float]):
+        self.starts = list(starts)
+        self.ends = list(ends)
+
+        self.deepest_end = []
+        deepest = float('-inf')
+        for end in self.ends:
+            deepest = max(deepest, end)
+            self.deepest_end.append(deepest)
+
+    def overlapping(self, depth_from: float, depth_to: float) -> List[int]:
+        """ The positions, in order, of the intervals with some length between `depth_from` and `depth_to` """
+        lo = bisect_right(self.deepest_end, depth_from)
+        hi = bisect_left(self.starts, depth_to)
+
+        # Between lo and hi, only an interval overlapping another can end above the window
+        return [p for p in range(lo, hi) if self.ends[p] > depth_from]
+
+    def overlap_lengths(self, positions: List[int], depth_from: float, depth_to: float) -> List[float]:
+        """ How much of each interval in `positions` lies between `depth_from` and `depth_to` """
+        return [min(self.ends[p], depth_to) - max(self.starts[p], depth_from) for p in positions]
+
+
+def length_weighted_grades(analytes: List["AssayType"], columns: List[List[Optional[float]]], lengths: List[float]) -> Dict["AssayType", Optional[float]]:
+    """
+    Averages each analyte over the intervals of a window, weighting each interval by `lengths`,
+    the length of it inside the window. `columns[k]` holds the values of `analytes[k]`, with None
+    where an interval did not record it; those intervals are left out of that analyte's average.
+
+    Returns: the grade of each analyte, or None for an analyte recorded nowhere in the window
+    """
+    grades = {}
+    for analyte, column in zip(analytes, columns):
+        metres, length = 0.0, 0.0
+        for value, interval_length in zip(column, lengths):
+            if value is not None:
+                metres += value * interval_length
+                length += interval_length
+        grades[analyte] = metres / length if length > 0 else None
+    return grades
+
+def check_depth_window(depth_from: float, depth_to: float):
+    if not depth_from < depth_to:
+        raise ValueError(f"A depth window must start above where it ends, not at {depth_from}m to {depth_to}m")
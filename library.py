@@ -3,34 +3,29 @@
 # in the csv rows efficiently
 import logging
 from typing import List
+import numpy as np
 from Hole import *
-import ElementParser
+from units import convert, unit_from_text
+from headers import recognise_assay_columns
 from config import config
+from engine import calculate_intercepts_for_cutoffs_from_range
 from exceptions import MissingHoleDataException
+from functools import partial
+from cache import hole_fingerprint
+from memo import pack_intercepts, result_keys, result_memo, unpack_intercepts
 
+NaN = float('nan')
 
 def create_header_cache(header_row: List[str], fields_to_cache: List[str]):
     cache = {}
+    assay_columns = recognise_assay_columns(header_row)
     for index, header in enumerate(header_row):
         
         if header in fields_to_cache:
             cache[header] = index
-        elif assay := ElementParser.TryParse(header):
-            element, unit = assay
-            unit = unit.lower()
-            unit_type = None
-            if unit == "ppm":
-                unit_type = AssayType(element, AssayUnit.PPM)
-            elif unit == "ppb":
-                unit_type = AssayType(element, AssayUnit.PPB)
-            elif unit == "ppt":
-                unit_type = AssayType(element, AssayUnit.PPT)
-            elif unit == "%":
-                unit_type = AssayType(element, AssayUnit.Percent)
-            else: raise ValueError("Unsupported Unit Present: " + unit)
-
-            cache[unit_type] = index
-            print(f"Cached Unit: {unit_type}")
+        elif index in assay_columns:
+            cache[assay_columns[index]] = index
+            logging.debug(f"Cached Unit: {assay_columns[index]}")
         
     return cache
 
@@ -58,6 +53,67 @@ def construct_interval_from_csv_row(csv_data: str, header_cache: dict):
         raise MissingHoleDataException(csv_data[get_index(config.settings.hole_id_column_name)], f"No assay data recorded for sample ID: {csv_data[get_index(config.settings.sample_id_column_name)]}")
     return IntervalData(span, assays)
 
+def read_columnar_row(csv_data: List[str], header_cache: dict, assay_columns: List[int], unread_columns: List[int] = ()):
+    '''
+    The columnar counterpart of construct_interval_from_csv_row. Rather than building an
+    IntervalData, it returns the span of the row and a list of assay values ordered like
+    `assay_columns`, with NaN standing in for any value that could not be read.
+
+    `unread_columns` are the assay columns that are not being decoded. They are only looked at
+    when none of `assay_columns` hold a value, to decide whether the row has any assay data at all.
+
+    Raises MissingHoleDataException in exactly the same situations as construct_interval_from_csv_row.
+    '''
+    try:
+        span = (float(csv_data[header_cache[config.settings.from_column_name]]), float(csv_data[header_cache[config.settings.to_column_name]]))
+    except ValueError as err:
+        raise MissingHoleDataException(csv_data[header_cache[config.settings.hole_id_column_name]], f"No useable value for hole From and To values for sample ID: {csv_data[header_cache[config.settings.sample_id_column_name]]}")
+
+    values = []
+    found = False
+    for index in assay_columns:
+        try:
+            values.append(float(csv_data[index]))
+            found = True
+        except ValueError:
+            values.append(NaN)
+
+    if not found:
+        # A row is kept as long as any of its assays were recorded, even ones we are not reading
+        for index in unread_columns:
+            try:
+                float(csv_data[index])
+                found = True
+                break
+            except ValueError:
+                continue
+
+    if not found:
+        raise MissingHoleDataException(csv_data[header_cache[config.settings.hole_id_column_name]], f"No assay data recorded for sample ID: {csv_data[header_cache[config.settings.sample_id_column_name]]}")
+    return span, values
+
+def select_assay_columns(header_cache: dict, analytes: List[AssayType] = None):
+    '''
+    Works out which assay columns of an export to decode. With `analytes` set to None every
+    assay column is decoded. An analyte the export records in another unit is decoded in the unit
+    it is recorded in, and converted later by HoleStore.normalise_units.
+
+    Returns: the AssayTypes to store, their column indexes, and the indexes of the assay columns
+    that will not be decoded (see read_columnar_row)
+    '''
+    header_analytes = [key for key in header_cache if type(key) == AssayType]
+    if analytes is None:
+        selected = header_analytes
+    else:
+        wanted = {(a.element, a.base_unit) for a in analytes}
+        recorded = {(a.element, a.base_unit) for a in header_analytes}
+        converted = {a.element for a in analytes if (a.element, a.base_unit) not in recorded}
+        selected = [a for a in header_analytes if (a.element, a.base_unit) in wanted or a.element in converted]
+
+    assay_columns = [header_cache[key] for key in selected]
+    unread_columns = [header_cache[key] for key in header_analytes if key not in selected]
+    return selected, assay_columns, unread_columns
+
 def remove_tail_below_threshold(array, assay, threshold):
     tail_length = 0
 
@@ -83,17 +139,16 @@ def calculate_intercept(intercept_intervals: list[IntervalData], assay_type: Ass
     '''
     concentration = 0
     distance = 0
-    coans = {}
-    for co in co_analytes:
-        coans[co.get_unique_id()] = 0
+    co_ids = [co.get_unique_id() for co in co_analytes]
+    coans = dict.fromkeys(co_ids, 0)
 
     for interval in intercept_intervals:
         concentration += interval.calculate_concentration_metres(assay_type)
         distance += interval.get_length()
 
-        for co in co_analytes:
+        for co, co_id in zip(co_analytes, co_ids):
             try:
-                coans[co.get_unique_id()] += interval.calculate_concentration_metres(co)
+                coans[co_id] += interval.calculate_concentration_metres(co)
             except: continue
 
     return Intercept(assay_type,  concentration/distance, distance, intercept_intervals[0].span, coans)
@@ -146,71 +201,351 @@ def calculate_intercepts_from_group(contiguous_intervals: List[IntervalData], as
 
     return groups
 
+def calculate_intercepts_for_cutoffs(contiguous_intervals: List[IntervalData], assay: AssayType, cutoffs: List[float], co_analytes = None) -> List[List[Intercept]]:
+    '''
+    Calculates the intercepts of a contiguous group for every cutoff of an assay in a single sweep.
+    Each interval's assays are only read once, and the grade x length of an interval is shared by
+    every cutoff whose intercept it falls in, rather than being worked out again for each cutoff.
+
+    Returns: a list of intercepts for each cutoff, exactly as calculate_intercepts_from_group
+    would return them for that cutoff
+    '''
+    co_analytes = co_analytes or []
+    dilution = config.settings.internal_dilution_intervals
+
+    values = []
+    lengths = []
+    for interval in contiguous_intervals:
+        value = interval.get_assay(assay)
+        if value is not None and value < 0:
+            logging.critical(f"WE HAVE NEGATIVE CONCENTRATIONS. {interval}")
+        values.append(value)
+        lengths.append(interval.get_length())
+
+    # The state calculate_intercepts_from_group keeps, once per cutoff
+    groups = [[] for _ in cutoffs]
+    current_groups = [[] for _ in cutoffs]
+    current_gaps = [0] * len(cutoffs)
+    collecting = [False] * len(cutoffs)
+
+    for index, value in enumerate(values):
+        if value is None:
+            value = -1
+            for k in range(len(cutoffs)):
+                collecting[k] = False
+
+        for k, cutoff in enumerate(cutoffs):
+            if value >= cutoff:
+                if current_gaps[k] > dilution:
+                    groups[k].append(current_groups[k])
+                    current_groups[k] = []
+                    current_gaps[k] = 0
+                current_groups[k].append(index)
+                collecting[k] = True
+            elif collecting[k]:
+                current_groups[k].append(index)
+                current_gaps[k] += lengths[index]
+
+    for k in range(len(cutoffs)):
+        if current_groups[k]:
+            groups[k].append(current_groups[k])
+
+    # Grade x length of each interval, only worked out for intervals that end up in an intercept
+    metres = {}
+    def interval_metres(index):
+        if index not in metres:
+            interval = contiguous_intervals[index]
+            co_metres = []
+            for co in co_analytes:
+                try:
+                    co_metres.append(interval.calculate_concentration_metres(co))
+                except: co_metres.append(None)
+            metres[index] = (interval.calculate_concentration_metres(assay), co_metres)
+        return metres[index]
+
+    co_ids = [co.get_unique_id() for co in co_analytes]
+    intercepts = []
+    for cutoff, cutoff_groups in zip(cutoffs, groups):
+        cutoff_intercepts = []
+        for members in cutoff_groups:
+            # Mirrors remove_tail_below_threshold
+            end = len(members)
+            while end and (not values[members[end - 1]] or values[members[end - 1]] < cutoff):
+                end -= 1
+            members = members[:end]
+
+            concentration = 0
+            distance = 0
+            coans = dict.fromkeys(co_ids, 0)
+
+            for index in members:
+                primary, co_metres = interval_metres(index)
+                concentration += primary
+                distance += lengths[index]
+                for co_id, co_value in zip(co_ids, co_metres):
+                    if co_value is not None:
+                        coans[co_id] += co_value
+
+            cutoff_intercepts.append(Intercept(assay, concentration/distance, distance, contiguous_intervals[members[0]].span, coans))
+        intercepts.append(cutoff_intercepts)
+
+    return intercepts
+
+# Each output row also ends with a dict of its co-analyte grades, which is not written to CSV
+OUTPUT_HEADER = ['Hole', 'Primary Analyte', 'Cutoff', 'Cutoff Unit', 'From', 'To', 'Interval', 'Primary Intercept', 'Intercept Label', 'Co Analytes']
+
+def hole_intercept_rows(hole, data_table, assay_list, hole_hash: str = None):
+    '''
+    Calculates every intercept in a hole for each query in `assay_list`. `hole_hash` is the
+    hole_fingerprint of the hole over required_analytes(assay_list), for a caller that already has it.
+
+    Returns: a list of output rows (see OUTPUT_HEADER), or None if the hole is not in the data table
+    '''
+    if hole not in data_table:
+        return None
+
+    focus_hole = data_table[hole]
+    contiguous_ranges = focus_hole.contiguous_ranges()
+
+    if config.settings.intercept_engine == "numpy":
+        # The numpy engine works directly on the row ranges of the HoleStore
+        group_intervals = lambda: contiguous_ranges
+        calculate_intercepts = partial(calculate_intercepts_for_cutoffs_from_range, data_table)
+    else:
+        # Get a list containing groups of intervals which are contiguous in this hole
+        # This simply is a list of sections from the hole which have contiguous data
+        group_intervals = focus_hole.group_contiguous_intervals
+        calculate_intercepts = calculate_intercepts_for_cutoffs
+
+    # The groups are only needed if some result is not in the memo
+    contiguous_interval_groups = None
+    memo = result_memo()
+    if memo and hole_hash is None:
+        # The hole is only hashed once, for every query
+        hole_hash = hole_fingerprint(data_table, hole, required_analytes(assay_list))
+
+    # Every query of the hole is looked up in one go. With `recalc` set every result is
+    # calculated again, and the memo only takes the new ones
+    query_keys = [result_keys(hole, hole_hash, assay, cutoffs, coans) if memo else None for assay, cutoffs, coans in assay_list]
+    remembered = memo.get_many([key for keys in query_keys for key in keys]) if memo and not config.settings.recalc else {}
+    calculated_entries = {}
+
+    # The intercepts of each cutoff of each query, split up by the contiguous group they came from
+    query_intercepts = []
+    for (assay, cutoffs, coans), keys in zip(assay_list, query_keys):
+        missing = [i for i in range(len(cutoffs)) if keys is None or keys[i] not in remembered]
+
+        cutoff_intercepts = [unpack_intercepts(remembered[keys[i]], len(contiguous_ranges), assay, coans) if i not in missing else [] for i in range(len(cutoffs))]
+        if missing:
+            if contiguous_interval_groups is None:
+                contiguous_interval_groups = group_intervals()
+
+            # Every missing cutoff of an assay is calculated in one sweep of each group
+            for grouped_interval in contiguous_interval_groups:
+                calculated = calculate_intercepts(grouped_interval, assay, [cutoffs[i] for i in missing], coans)
+                for i, intercepts in zip(missing, calculated):
+                    cutoff_intercepts[i].append(intercepts)
+
+            if memo:
+                calculated_entries.update({keys[i]: pack_intercepts(cutoff_intercepts[i], coans) for i in missing})
+
+        query_intercepts.append(cutoff_intercepts)
+
+    if calculated_entries:
+        memo.put_many(calculated_entries)
+
+    rows = []
+    for group in range(len(contiguous_ranges)):
+        for (assay, cutoffs, coans), cutoff_intercepts in zip(assay_list, query_intercepts):
+            for cutoff, group_intercepts in zip(cutoffs, cutoff_intercepts):
+                rows.extend(intercept_rows(hole, group_intercepts[group], assay, cutoff, coans))
+
+    return rows
+
+def intercept_rows(hole, intercepts: List[Intercept], assay: AssayType, cutoff: float, coans: List[AssayType]):
+    ''' Formats the intercepts found in a hole for one cutoff as output rows (see OUTPUT_HEADER) '''
+    if not intercepts:
+        return []
+
+    # The co-analyte grades of every intercept are converted to their reported units in one go
+    distances = np.array([intercept.distance for intercept in intercepts])
+    co_grades = [
+        (co.convert_to_reported_unit(np.array([intercept.co_analytes[co.get_unique_id()] for intercept in intercepts], dtype=np.float64)) / distances).tolist()
+        for co in coans
+    ]
+    co_labels = [f"{co.reported_unit_text()} {co.element},  " for co in coans]
+    co_names = [f"co_{co.element}_{co.reported_unit.name}" for co in coans]
+
+    reported_cutoff = assay.convert_to_reported_unit(cutoff)
+    rows = []
+    # Here the intercept variable represents a list of IntervalData which have been judged to be both
+    # contiguous and above the cutoff threshold
+    for intercept, grades in zip(intercepts, zip(*co_grades) if coans else [()] * len(intercepts)):
+        co_string = "".join(f"{grade:.2f}{label}" for grade, label in zip(grades, co_labels))
+
+        rows.append([
+            hole, assay.element, reported_cutoff, assay.reported_unit_text(),
+            intercept.span[0], intercept.span[0] + intercept.distance, intercept.distance,
+            round(intercept.get_concentration_as_reported(),3), intercept.to_string(),
+            co_string, dict(zip(co_names, grades))
+        ])
+
+    return rows
+
+def query_depth(data_table, hole, depth_from: float, depth_to: float, analytes: List[AssayType] = None):
+    '''
+    Calculates the length weighted grade of each analyte in a hole between two depths. Intervals
+    that straddle either depth only count for the length inside the window. Works on a HoleStore
+    as well as the original dict of HoleData.
+
+    Returns: a dict of AssayType -> grade, with None for an analyte not recorded in the window,
+    or None if the hole is not in the data table
+    '''
+    if hole not in data_table:
+        return None
+
+    return data_table[hole].query_depth(depth_from, depth_to, analytes)
+
+import gzip
 import hashlib
+import io
+import os
+import tomllib
+import zipfile
 
 from Hole import AssayType, AssayUnit, Intercept, IntervalData
 
-def count_lines_and_hash(file_name):
+def is_compressed_export(file_name: str) -> bool:
+    return file_name.lower().endswith(('.zip', '.gz'))
+
+def _archived_export_name(archive: zipfile.ZipFile) -> str:
+    names = [info.filename for info in archive.infolist()
+             if not info.is_dir() and info.filename.lower().endswith('.csv') and not info.filename.startswith('__MACOSX/')]
+    if not names:
+        raise ValueError(f"No CSV export found in {archive.filename}")
+    if len(names) > 1:
+        logging.warning(f"{archive.filename} holds {len(names)} CSV files, reading {names[0]}")
+    return names[0]
+
+def open_export(file_name: str):
     """
-    Count the number of lines in a file and calculate its hash.
-    
-    Args:
-        file_name (str): Path to the file.
-        
-    Returns:
-        tuple: Number of lines and hash value.
+    Opens an export as a binary file. The CSV inside a .zip archive, or a gzipped CSV, is
+    decompressed as it is read, so a delivery can be analysed without extracting it first.
+    Everything read from the returned file, including its hash, is the decompressed CSV.
     """
-    line_count = 0
-    hasher = hashlib.sha256()
-    chunk_size = 8192
-    
-    with open(file_name, 'rb') as file:
-        while chunk := file.read(chunk_size):
-            line_count += chunk.count(b'\n')
-            hasher.update(chunk)
-    
-    return line_count, hasher.hexdigest()
+    lower = file_name.lower()
+    if lower.endswith('.gz'):
+        return gzip.open(file_name, 'rb')
 
-def convert_unit(value, from_unit, to_unit):
-    # Define conversion factors
-    conversion_factors = {
-        AssayUnit.PPM: 1,
-        AssayUnit.PPB: 1000,
-        AssayUnit.Percent: 10000,
-        AssayUnit.GPT: 1
-    }
+    if lower.endswith('.zip'):
+        # The member keeps the archive's file open until it is closed itself
+        with zipfile.ZipFile(file_name) as archive:
+            return archive.open(_archived_export_name(archive))
 
-    # Check if units are valid
-    if from_unit not in conversion_factors or to_unit not in conversion_factors:
-        raise ValueError("Invalid units")
+    return open(file_name, 'rb')
 
-    # Convert to PPM
-    ppm_value = value * conversion_factors[from_unit]
+def export_size(file_name: str) -> int:
+    """
+    The number of bytes that open_export will read from an export, for progress reporting.
+    A gzip file only records its size modulo 4 GiB, so this is approximate for bigger exports.
+    """
+    lower = file_name.lower()
+    if lower.endswith('.gz'):
+        with open(file_name, 'rb') as file:
+            file.seek(-4, io.SEEK_END)
+            return int.from_bytes(file.read(4), 'little')
+
+    if lower.endswith('.zip'):
+        with zipfile.ZipFile(file_name) as archive:
+            return archive.getinfo(_archived_export_name(archive)).file_size
+
+    return os.path.getsize(file_name)
+
+class HashingReader(io.RawIOBase):
+    """
+    Wraps a binary file so that every byte read through it is also fed to a SHA-256 hasher.
+    This lets an export be hashed in the same pass that parses it, rather than reading it twice.
+
+    Args:
+        file: A binary file object to read from.
+        update_progress (callable): Optional, called with the total number of bytes read so far.
+    """
 
-    # Convert from PPM to the desired unit
-    result = ppm_value / conversion_factors[to_unit]
+    def __init__(self, file, update_progress=None):
+        self.file = file
+        self.hasher = hashlib.sha256()
+        self.bytes_read = 0
+        self.update_progress = update_progress
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.file.readinto(buffer)
+        if count:
+            self.hasher.update(memoryview(buffer)[:count])
+            self.bytes_read += count
+            if self.update_progress:
+                self.update_progress(self.bytes_read)
+        return count
+
+    def hexdigest(self):
+        """ Reads whatever has not been consumed yet and returns the hash of the whole file """
+        while self.read(1 << 20):
+            pass
+        return self.hasher.hexdigest()
 
-    return result
+def convert_unit(value, from_unit, to_unit):
+    return float(convert(value, from_unit, to_unit))
 
 def unit_text_to_type(unit: str):
-    Unit = AssayUnit.PPM
-    unit = unit.lower()
-    if unit == '%':
-        Unit = AssayUnit.Percent
-    elif unit == 'ppm':
-        Unit = AssayUnit.PPM
-    elif unit == 'ppb':
-        Unit = AssayUnit.PPB
-    elif unit == 'g/t':
-        Unit = AssayUnit.GPT
-    else:
+    try:
+        return unit_from_text(unit)
+    except ValueError:
         raise ValueError(f"Error when loading co-analytes. Unsupported unit of type: {unit}")
-    
-    return Unit
 
 def try_parse_to_assay_type(element: str, base_unit: str, reported_unit: str):
 
     base = unit_text_to_type(base_unit)
     reported = unit_text_to_type(reported_unit)
 
-    return AssayType(element, base, reported)
\ No newline at end of file
+    return AssayType(element, base, reported)
+
+def load_assay_list(path: str):
+    '''
+    Loads the queries in a queries/assays toml file.
+
+    Returns: a list of (primary AssayType, cutoffs in the primary's base unit, co-analyte AssayTypes)
+    '''
+    with open(path, 'rb') as queries_file:
+        queries = tomllib.load(queries_file)
+
+    assay_list = []
+    for assay in list(queries.values()):
+        element = assay['element']
+        base_unit = assay['base_unit']
+        reported_unit = assay['reported_unit']
+        cutoffs = assay['cutoffs']
+
+        primary = try_parse_to_assay_type(element, base_unit, reported_unit)
+
+        for i, cutoff in enumerate(cutoffs):
+            cutoffs[i] = convert_unit(cutoff, primary.reported_unit, primary.base_unit)
+
+        co_analytes = assay['co_analytes']
+        analytes = []
+        for co in co_analytes:
+            analytes.append(try_parse_to_assay_type(co['element'], co['base_unit'], co['reported_unit']))
+
+        assay_list.append((primary, cutoffs, analytes))
+
+    return assay_list
+
+def required_analytes(assay_list) -> List[AssayType]:
+    ''' Returns every analyte the queries in `assay_list` read, as primary or as co-analyte '''
+    required = {}
+    for primary, cutoffs, co_analytes in assay_list:
+        for assay in [primary] + co_analytes:
+            required.setdefault((assay.element, assay.base_unit), assay)
+
+    return list(required.values())
@@ -0,0 +1,225 @@
+
+# An on-disk memo of intercept results under `cache_location`, so that re-running a query over
+# a hole that has not changed does not calculate its intercepts again.
+#
+# Each entry holds the intercepts of one hole for one cutoff of one query, split up by the
+# contiguous group of the hole they came from, so that entries can be put back together in the
+# order hole_intercept_rows writes rows. They are packed as float64s (see pack_intercepts) and
+# formatted as rows when they are read back. Entries are kept in SQLite, which lets several processes
+# share the memo, and the least recently used entries are evicted once it outgrows `result_cache_size_mb`.
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+from cache import CACHE_VERSION, code_fingerprint
+from config import config
+from Hole import AssayType, Intercept
+
+# Hits and misses of every memo lookup made by this process
+counters = Counter()
+
+_memo = None
+_unavailable = None
+
+# How many keys are read before their last_used is written back, and how old last_used has to
+# be before it is written back at all, in seconds
+USED_BATCH = 5000
+USED_RESOLUTION = 3600
+
+
+def result_keys(hole: str, hole_hash: str, assay: AssayType, cutoffs: List[float], co_analytes: List[AssayType]) -> List[str]:
+    """ The key of each cutoff of a query over a hole whose hole_fingerprint is `hole_hash` """
+    hasher = hashlib.sha256()
+    parts = [str(CACHE_VERSION), code_fingerprint(), hole, hole_hash,
+             f"{assay.element}|{assay.base_unit.name}|{assay.reported_unit.name}",
+             *(f"{co.element}|{co.base_unit.name}|{co.reported_unit.name}" for co in co_analytes),
+             repr(config.settings.internal_dilution_intervals), config.settings.intercept_engine]
+    for part in parts:
+        hasher.update(part.encode('utf-8'))
+        hasher.update(b'\0')
+
+    # Only the cutoff differs between the keys of a query, so the rest is hashed once
+    keys = []
+    for cutoff in cutoffs:
+        cutoff_hasher = hasher.copy()
+        cutoff_hasher.update(repr(float(cutoff)).encode('utf-8'))
+        keys.append(cutoff_hasher.hexdigest())
+    return keys
+
+
+class ResultMemo:
+    """
+    A size bounded, least recently used store of packed intercepts keyed by result_key.
+    Each process must open its own ResultMemo; SQLite takes care of processes sharing the file.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._written = 0
+        # Keys read since last_used was last brought up to date, which is done in batches
+        self._used = set()
+
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        # Memos written before the intercepts were packed held JSON rows in a table of their own
+        self.connection.execute("DROP TABLE IF EXISTS results")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS intercepts (key TEXT PRIMARY KEY, intercepts BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS intercepts_last_used ON intercepts (last_used)")
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """ Returns the packed intercepts stored for whichever of `keys` are in the memo, and marks them as used (see USED_RESOLUTION) """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        now = time.time()
+        try:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, packed, last_used in self.connection.execute(
+                        f"SELECT key, intercepts, last_used FROM intercepts WHERE key IN ({placeholders})", batch):
+                    found[key] = packed
+                    # Eviction only needs a rough order, so an entry used recently is left as it is
+                    if last_used < now - USED_RESOLUTION:
+                        self._used.add(key)
+
+            if len(self._used) >= USED_BATCH:
+                self.mark_used()
+        except sqlite3.Error as err:
+            logging.warning(f"Could not read the intercept result cache: {err}")
+
+        counters['hits'] += len(found)
+        counters['misses'] += len(keys) - len(found)
+        return found
+
+    def put_many(self, entries: Dict[str, bytes]):
+        now = time.time()
+        records = []
+        for key, packed in entries.items():
+            records.append((key, packed, len(packed), now))
+            self._written += len(packed)
+
+        try:
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO intercepts (key, intercepts, size, last_used) VALUES (?, ?, ?, ?)", records)
+
+            # Totalling the size of the memo means reading every row, so it is only done now and then
+            if self._written > self.max_bytes // 20:
+                self.evict()
+        except sqlite3.Error as err:
+            logging.warning(f"Could not write to the intercept result cache: {err}")
+
+    def mark_used(self):
+        """ Brings last_used up to date for the keys read since it last was """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany("UPDATE intercepts SET last_used = ? WHERE key = ?", [(now, key) for key in self._used])
+        self._used.clear()
+
+    def evict(self):
+        """ Drops the least recently used entries until the memo is back under 90% of its size limit """
+        self._written = 0
+        with self.connection:
+            total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM intercepts").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            target = total - int(self.max_bytes * 0.9)
+            freed = 0
+            doomed = []
+            for key, size in self.connection.execute("SELECT key, size FROM intercepts ORDER BY last_used"):
+                doomed.append((key,))
+                freed += size
+                if freed >= target:
+                    break
+            self.connection.executemany("DELETE FROM intercepts WHERE key = ?", doomed)
+            logging.info(f"Evicted {len(doomed)} intercept results from {self.path}")
+
+    def close(self):
+        try:
+            self.mark_used()
+            self.evict()
+        except sqlite3.Error as err:
+            logging.warning(f"Could not trim the intercept result cache: {err}")
+        self.connection.close()
+
+
+def result_memo():
+    """ Returns this process's ResultMemo, or None if `result_cache` is turned off or it cannot be opened """
+    global _memo
+    if not config.settings.result_cache:
+        return None
+
+    global _unavailable
+    path = os.path.join(config.settings.cache_location, "results.sqlite")
+    if path == _unavailable:
+        return None
+
+    if _memo is None or _memo.path != path:
+        if _memo is not None:
+            _memo.close()
+            _memo = None
+        try:
+            os.makedirs(config.settings.cache_location, exist_ok=True)
+            _memo = ResultMemo(path, int(config.settings.result_cache_size_mb * 2**20))
+        except (OSError, sqlite3.Error) as err:
+            # Only warn once, rather than for every hole
+            logging.warning(f"Could not open the intercept result cache {path}: {err}")
+            _unavailable = path
+            return None
+
+    return _memo
+
+def pack_intercepts(groups: List[List[Intercept]], co_analytes: List[AssayType]) -> bytes:
+    """
+    Packs the intercepts of each contiguous group of a hole as float64s: the number of intercepts
+    in each group, then the span, grade, length and co-analyte totals of every intercept.
+    """
+    co_ids = [co.get_unique_id() for co in co_analytes]
+    values = [len(intercepts) for intercepts in groups]
+    for intercepts in groups:
+        for intercept in intercepts:
+            values.extend([intercept.span[0], intercept.span[1], intercept.concentration, intercept.distance])
+            values.extend(intercept.co_analytes[co_id] for co_id in co_ids)
+    return np.array(values, dtype=np.float64).tobytes()
+
+def unpack_intercepts(packed: bytes, group_count: int, assay: AssayType, co_analytes: List[AssayType]) -> List[List[Intercept]]:
+    """ Turns what pack_intercepts wrote for a hole of `group_count` contiguous groups back into intercepts """
+    co_ids = [co.get_unique_id() for co in co_analytes]
+    values = np.frombuffer(packed, dtype=np.float64).tolist()
+    width = 4 + len(co_ids)
+
+    groups = []
+    position = group_count
+    for count in values[:group_count]:
+        intercepts = []
+        for _ in range(int(count)):
+            start, end, concentration, distance, *co_totals = values[position:position + width]
+            intercepts.append(Intercept(assay, concentration, distance, (start, end), dict(zip(co_ids, co_totals))))
+            position += width
+        groups.append(intercepts)
+    return groups
+
+def finish_result_memo():
+    """
+    Called at the end of a run. Logs and prints how the memo fared since the last run, then
+    closes it, which trims it back under its size limit.
+    """
+    global _memo
+    if config.settings.result_cache:
+        message = f"Intercept result cache: {counters['hits']} hits, {counters['misses']} misses"
+        logging.info(message)
+        print(message)
+
+    counters.clear()
+    if _memo is not None:
+        _memo.close()
+        _memo = None
@@ -0,0 +1,97 @@
+
+# Runs the intercept analysis for many holes across a pool of worker processes. Each hole is
+# independent, so holes are split into shards of consecutive holes and every shard is sent to
+# a worker as a small HoleStore holding just its rows and the analytes the queries read.
+import logging
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from config import config
+import memo
+from library import hole_intercept_rows, required_analytes
+
+
+def resolve_worker_count(worker_count) -> int:
+    """ A worker_count of 0 means one worker per CPU """
+    if not worker_count:
+        return os.cpu_count() or 1
+    return max(1, int(worker_count))
+
+def _initialise_worker(settings: dict):
+    # Worker processes may have been spawned rather than forked, so they are given the
+    # settings of the parent rather than whatever config.toml currently holds
+    for name, value in settings.items():
+        setattr(config.settings, name, value)
+
+    # A spawned worker has not run the logging setup in refactor.py, so it appends to the same log
+    if not logging.getLogger().handlers:
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format="%(asctime)s [%(levelname)s] %(message)s",
+            handlers=[logging.FileHandler("app.log", mode='a')]
+        )
+
+def _analyse_shard(shard):
+    store, assay_list = shard
+    before = Counter(memo.counters)
+    rows = [hole_intercept_rows(hole, store, assay_list) for hole in store.hole_ids]
+
+    # The result memo counts hits and misses per process, so the parent is sent this shard's share
+    return rows, memo.counters - before
+
+def shard_holes(data_table, holes: List[str], shard_count: int) -> List[List[str]]:
+    """ Splits `holes` into runs of consecutive holes holding roughly the same number of samples each """
+    sizes = [len(data_table[hole]) for hole in holes]
+    target = max(1, sum(sizes) // max(1, shard_count))
+
+    shards, current, current_size = [], [], 0
+    for hole, size in zip(holes, sizes):
+        current.append(hole)
+        current_size += size
+        if current_size >= target:
+            shards.append(current)
+            current, current_size = [], 0
+
+    if current:
+        shards.append(current)
+
+    return shards
+
+def analyse_holes_in_parallel(data_table, assay_list, holes: List[str], workers: int):
+    """
+    Calculates the intercept rows of `holes` using `workers` processes.
+
+    Yields (hole, rows) in the same order as `holes`, with rows set to None for a hole that is
+    not in the data table, so the output is identical to analysing the holes one at a time.
+    """
+    present = [hole for hole in holes if hole in data_table]
+    analytes = required_analytes(assay_list)
+    shards = shard_holes(data_table, present, workers * 4)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initialise_worker, initargs=(dict(vars(config.settings)),)) as pool:
+        pending = deque()
+        next_shard = 0
+
+        def fill():
+            # Keep a couple of shards queued per worker, rather than copying every shard up front
+            nonlocal next_shard
+            while next_shard < len(shards) and len(pending) < workers * 2:
+                pending.append(pool.submit(_analyse_shard, (data_table.subset(shards[next_shard], analytes), assay_list)))
+                next_shard += 1
+
+        def results():
+            fill()
+            while pending:
+                shard_rows, memo_counts = pending.popleft().result()
+                memo.counters.update(memo_counts)
+                fill()
+                yield from shard_rows
+
+        shard_results = results()
+        for hole in holes:
+            if hole in data_table:
+                yield hole, next(shard_results)
+            else:
+                yield hole, None
@@ -0,0 +1,142 @@
+
+# Parses a CSV export across a pool of worker processes.
+#
+# The export is split into byte ranges which each start and end on a record boundary. Every
+# range is parsed by a worker into a columnar chunk, and the chunks are appended to one
+# HoleStoreBuilder in file order, so the resulting HoleStore is identical to the serial loader's.
+#
+# Record boundaries are found by tracking quote parity: a newline only ends a record when an
+# even number of quote characters precede it. This holds for anything csv.writer produces,
+# including quoted fields holding newlines and escaped ("") quotes.
+import csv
+import hashlib
+import io
+import locale
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from columnar import HoleStoreBuilder
+from config import config
+from exceptions import MissingHoleDataException
+from Hole import AssayType
+from library import create_header_cache, read_columnar_row, select_assay_columns
+from parallel import _initialise_worker
+
+SCAN_BLOCK_SIZE = 1 << 22
+
+
+def _find_record_end(block: bytes, position: int, quoted: bool):
+    """
+    Looks for the first newline at or after `position` that is not inside a quoted field.
+    `quoted` says whether `position` itself falls inside a quoted field.
+
+    Returns: the offset just past that newline, or None if the block ends first, along with
+    whether the end of the block is inside a quoted field
+    """
+    while True:
+        newline = block.find(b'\n', position)
+        if newline < 0:
+            return None, quoted ^ (block.count(b'"', position) % 2 == 1)
+
+        quoted ^= block.count(b'"', position, newline) % 2 == 1
+        if not quoted:
+            return newline + 1, quoted
+        position = newline + 1
+
+def _record_end_after(file, position: int, quoted: bool) -> int:
+    """ Returns the offset just past the first record end at or after `position`, or the end of the file """
+    file.seek(position)
+    while block := file.read(1 << 16):
+        end, quoted = _find_record_end(block, 0, quoted)
+        if end is not None:
+            return position + end
+        position += len(block)
+    return position
+
+def split_export(file_name: str, range_count: int, update_progress=None):
+    """
+    Finds where the header of an export ends and splits the records after it into roughly
+    `range_count` byte ranges which start and end on record boundaries. The export is hashed
+    while it is scanned for quotes.
+
+    Returns: the header bytes, a list of (start, end) byte ranges covering every record, and the
+    SHA-256 of the export
+    """
+    hasher = hashlib.sha256()
+    # Whether the start of each SCAN_BLOCK_SIZE block of the file falls inside a quoted field
+    block_quoted = []
+    with open(file_name, 'rb') as file:
+        quoted = False
+        size = 0
+        while block := file.read(SCAN_BLOCK_SIZE):
+            hasher.update(block)
+            block_quoted.append(quoted)
+            quoted ^= block.count(b'"') % 2 == 1
+            size += len(block)
+            if update_progress:
+                update_progress(size)
+
+        header_end = _record_end_after(file, 0, False)
+        file.seek(0)
+        header = file.read(header_end)
+
+        step = max(1, (size - header_end) // max(1, range_count))
+        bounds = [header_end]
+        for target in range(header_end + step, size, step):
+            if target < bounds[-1]:
+                continue
+
+            block_start = target - target % SCAN_BLOCK_SIZE
+            file.seek(block_start)
+            quoted = block_quoted[block_start // SCAN_BLOCK_SIZE] ^ (file.read(target - block_start).count(b'"') % 2 == 1)
+            bounds.append(_record_end_after(file, target, quoted))
+
+    bounds.append(size)
+    ranges = [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+    return header, ranges, hasher.hexdigest()
+
+def _parse_range(task):
+    file_name, start, end, encoding, header_cache, selected, assay_columns, unread_columns = task
+    with open(file_name, 'rb') as file:
+        file.seek(start)
+        text = file.read(end - start).decode(encoding)
+
+    hole_column = header_cache[config.settings.hole_id_column_name]
+    builder = HoleStoreBuilder(selected)
+    for row in csv.reader(io.StringIO(text, newline=''), delimiter=',', quotechar='"'):
+        holeID = row[hole_column]
+        builder.add_hole(holeID)
+
+        try:
+            span, values = read_columnar_row(row, header_cache, assay_columns, unread_columns)
+        except MissingHoleDataException as err:
+            continue
+        builder.add(holeID, span, values)
+
+    return builder.chunk()
+
+def ingest_export_in_parallel(file_name: str, workers: int, update_progress=None, analytes: List[AssayType] = None):
+    """
+    The parallel counterpart of refactor.ingest_export. `update_progress` is called with the
+    number of bytes parsed so far as each range of the export comes back from the workers.
+
+    Returns: the parsed HoleStore and the hash of the export
+    """
+    header, ranges, file_hash = split_export(file_name, workers * 4)
+
+    # Decode the same way open() does in the serial loader
+    encoding = locale.getpreferredencoding(False)
+    header_row = next(csv.reader(io.StringIO(header.decode(encoding), newline=''), delimiter=',', quotechar='"'))
+    header_cache = create_header_cache(header_row, [config.settings.from_column_name, config.settings.to_column_name, config.settings.hole_id_column_name, config.settings.sample_id_column_name])
+    selected, assay_columns, unread_columns = select_assay_columns(header_cache, analytes)
+
+    builder = HoleStoreBuilder(selected)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initialise_worker, initargs=(dict(vars(config.settings)),)) as pool:
+        tasks = [(file_name, start, end, encoding, header_cache, selected, assay_columns, unread_columns) for start, end in ranges]
+        # Chunks come back in file order, which is what keeps hole order identical to the serial loader
+        for (start, end), chunk in zip(ranges, pool.map(_parse_range, tasks)):
+            builder.add_chunk(*chunk)
+            if update_progress:
+                update_progress(end)
+
+    return builder.build(), file_hash
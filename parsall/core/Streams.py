@@ -1,3 +1,4 @@
+from bisect import bisect_right
 from typing import List, Tuple
 
 
@@ -53,6 +54,28 @@ class Stream:
         """
         return self.items[self.position : self.position + n]
 
+    def startswith(self, prefix, n=0) -> bool:
+        """
+        Returns whether the items from `n` places ahead begin with `prefix`, without slicing the stream.
+        """
+        start = self.position + n
+        if start + len(prefix) > self.length:
+            return False
+
+        for i, item in enumerate(prefix):
+            if self.items[start + i] != item:
+                return False
+        return True
+
+    def find(self, item, n=0) -> int:
+        """
+        Returns how many places ahead of the next item the first `item` at least `n` places ahead is, or -1 if there is none.
+        """
+        for i in range(self.position + n, self.length):
+            if self.items[i] == item:
+                return i - self.position
+        return -1
+
     def __iter__(self):
         """
         Return an iterator over the stream.
@@ -87,11 +110,39 @@ class TokenStream(Stream):
 class CharacterStream(Stream):
     """A character stream that can be iterated over and provides methods to pop the next character or peek at it without popping it."""
 
-    def __init__(self, stream: str):
+    def __init__(self, stream: str, first_line=1, first_column=1):
         """
         Initialize a new character stream.
 
         Args:
             stream (str): The string to use as the character stream.
+            first_line, first_column: Where the string starts, if it is part of a larger input.
+        """
+        super().__init__(stream, len(stream))
+        self.first_line = first_line
+        self.first_column = first_column
+        self.line_starts = None
+
+    def startswith(self, prefix: str, n=0) -> bool:
+        return self.items.startswith(prefix, self.position + n)
+
+    def find(self, item: str, n=0) -> int:
+        index = self.items.find(item, self.position + n)
+        return -1 if index == -1 else index - self.position
+
+    def line_column(self, position: int) -> Tuple[int, int]:
+        """
+        Returns the line and column of the character at `position`, both counting from 1.
         """
-        super().__init__(stream, len(stream))
\ No newline at end of file
+        if self.line_starts is None:
+            self.line_starts = [0]
+            index = self.items.find("\n")
+            while index != -1:
+                self.line_starts.append(index + 1)
+                index = self.items.find("\n", index + 1)
+
+        line = bisect_right(self.line_starts, position)
+        column = position - self.line_starts[line - 1] + 1
+        if line == 1:
+            column += self.first_column - 1
+        return line + self.first_line - 1, column
\ No newline at end of file
@@ -1,5 +1,7 @@
-from typing import List, Tuple
+import re
+from typing import List, Optional, Tuple
 from parsall.core.Streams import CharacterStream
+from parsall.core.tokens import Token
 
 class SyntaxRule:
     """ 
@@ -22,6 +24,27 @@ class SyntaxRule:
         # the beginning of the token sequence, or None otherwise.
         raise NotImplementedError("SyntaxRule is intended to abstract and as such it cannot be instantiated")#TODO: ignore case is currently not implemented
 
+    def regex(self) -> Optional[str]:
+        """
+            Optional. Returns a regular expression matching exactly the text `match` would
+            consume, which lets a CompiledLexer scan for the rule without calling `match`.
+
+            Rules that cannot be written as a regular expression return None and are matched
+            with `match` instead. The expression must not contain capturing groups.
+        """
+        return None
+
+    def token(self, char_stream: CharacterStream, start: int, end: int):
+        """ Builds the token for the text between `start` and `end` matched by `regex()` """
+        return Token(self.token_name, char_stream, start, end)
+
+    def first_characters(self):
+        """
+            Optional. Returns the characters a match can start with, or None if they are not
+            known. Rulesets use this to skip rules that cannot match the next character.
+        """
+        return None
+
 class IgnoreRule(SyntaxRule):
     def __init__(self, ignore_list: List[str]):
         self.ignore = ignore_list
@@ -42,32 +65,43 @@ class WordRule(SyntaxRule):
     def match(self, char_stream: CharacterStream) -> str:
 
         # Check if the next characters in the stream match the target word
-        if char_stream.lookahead(self.length) != self.word:
+        if not char_stream.startswith(self.word):
             return None
         
         # if (c := char_stream.peek(self.length)) and c.isalpha():
         #     return None
 
         # If the target word is present, consume the same number of characters as the length of the word
-        match_text = ""
-        for _ in range(len(self.word)):
-            match_text += char_stream.pop()
+        start = char_stream.position
+        char_stream.advance(self.length)
 
         # Return the word as a match object
-        return (self.token_name, match_text)
+        return Token(self.token_name, char_stream, start, char_stream.position)
+
+    def regex(self):
+        return re.escape(self.word)
+
+    def first_characters(self):
+        return {self.word[0]} if self.word else None
 
 class NumberRule(SyntaxRule):
     def match(self, char_stream: CharacterStream) -> str:
         # Attempt to consume characters until a non-digit character is encountered
-        match_text = ""
+        start = char_stream.position
         while char_stream.peek() is not None and char_stream.peek().isdigit():
-            match_text += char_stream.pop()
+            char_stream.advance()
 
         # If we successfully consume at least one digit, return the number as a match object
-        if match_text:
-            return ("Number", int(match_text))
+        if char_stream.position > start:
+            return Token("Number", char_stream, start, char_stream.position, int)
         else:
             return None
+
+    def regex(self):
+        return r"\d+"
+
+    def token(self, char_stream, start, end):
+        return Token("Number", char_stream, start, end, int)
         
 class IdentifierRule(SyntaxRule):
     def match(self, char_stream: CharacterStream) -> str:
@@ -81,17 +115,29 @@ class IdentifierRule(SyntaxRule):
             return None
         
         # Start building the identifier
-        identifier = char_stream.pop()
+        start = char_stream.position
+        char_stream.advance()
         
         # Add any additional letters, underscores, or digits
         while True:
             next_char = char_stream.peek()
             if next_char is None or not (next_char.isalnum() or next_char == '_'):
                 break
-            identifier += char_stream.pop()
+            char_stream.advance()
         
-        return ("symbol", identifier)
+        return Token("symbol", char_stream, start, char_stream.position)
+
+    def regex(self):
+        # A letter or underscore, then letters, digits and underscores
+        return r"[^\W\d]\w*"
+
+    def token(self, char_stream, start, end):
+        return Token("symbol", char_stream, start, end)
     
+def _string_value(text):
+    # An escaped character stands for itself
+    return re.sub(r"\\(.)", r"\1", text[1:-1], flags=re.DOTALL)
+
 class StringRule(SyntaxRule):
     def match(self, char_stream: CharacterStream) -> str:
         quote = char_stream.peek()
@@ -99,27 +145,37 @@ class StringRule(SyntaxRule):
             return None
 
         # Consume the opening quote
+        start = char_stream.position
         char_stream.pop()
 
-        match_text = ""
         while True:
             next_char = char_stream.pop()
             if next_char == quote:
-                return ("string", match_text)
+                return Token("string", char_stream, start, char_stream.position, _string_value)
             elif next_char == "\\":
                 # Consume the escaped character
                 next_char = char_stream.pop()
                 if next_char is None:
                     raise ValueError("Syntax error in input text")
-                elif next_char == quote or next_char in "\\trxn":
-                    match_text += next_char
-                else:
+                elif next_char != quote and next_char not in "\\trxn":
                     raise ValueError("Syntax error in input text: " + next_char)
-            else:
-                match_text += next_char
 
             if char_stream.peek() is None:
                 raise ValueError("Syntax error in input text")
+
+    def regex(self):
+        # Strings with a bad escape or no closing quote only match their opening quote
+        return r""""(?:[^"\\]|\\["\\trxn])*"|'(?:[^'\\]|\\['\\trxn])*'|["']"""
+
+    def token(self, char_stream, start, end):
+        if end - start == 1:
+            # Leave `match` to raise the error for the string
+            char_stream.position = start
+            return self.match(char_stream)
+        return Token("string", char_stream, start, end, _string_value)
+
+    def first_characters(self):
+        return {'"', "'"}
             
 class CharacterRule(SyntaxRule):
     def __init__(self, token_name, character):
@@ -128,10 +184,17 @@ class CharacterRule(SyntaxRule):
 
     def match(self, char_stream: CharacterStream) -> str:
         if char_stream.peek() == self.character:
-            return (self.token_name, char_stream.pop())
+            char_stream.advance()
+            return Token(self.token_name, char_stream, char_stream.position - 1, char_stream.position)
         else:
             return None
 
+    def regex(self):
+        return re.escape(self.character)
+
+    def first_characters(self):
+        return {self.character}
+
 class CompoundRule(SyntaxRule):
     def __init__(self, token_name, rules_config: List[Tuple[SyntaxRule, bool]]):
         self.rules = rules_config
@@ -152,24 +215,82 @@ class Ruleset(SyntaxRule):
     def __init__(self, rules):
         self.rules = rules
 
+        # The rules that could match each character, with their position in `rules`, in their
+        # original order, so that the first rule in the list still wins. Rules that could start
+        # with anything are in every list.
+        self.candidates = {}
+        self.unindexed = []
+        for order, rule in enumerate(rules):
+            first_characters = rule.first_characters()
+            if first_characters is None:
+                self.unindexed.append((order, rule))
+                for candidates in self.candidates.values():
+                    candidates.append((order, rule))
+                continue
+
+            for c in first_characters:
+                self.candidates.setdefault(c, list(self.unindexed)).append((order, rule))
+
     def match(self, text):
-        for rule in self.rules:
+        position = text.position
+        candidates = self.candidates.get(text.peek(), self.unindexed)
+        k = 0
+        while k < len(candidates):
+            order, rule = candidates[k]
             match = rule.match(text)
             if match:
                 return match
+
+            if text.position != position:
+                # The rule consumed input without matching (e.g. IgnoreRule), so the rules after it
+                # are looked up again for the character it stopped at
+                position = text.position
+                candidates = [c for c in self.candidates.get(text.peek(), self.unindexed) if c[0] > order]
+                k = 0
+            else:
+                k += 1
         return None
+
+    def first_characters(self):
+        return None if self.unindexed else set(self.candidates)
     
 class CharacterSet(Ruleset):
     def __init__(self, token_name, characters):
-        self.rules = []
-        for c in characters:
-            self.rules.append(CharacterRule(token_name, c))
+        super().__init__([CharacterRule(token_name, c) for c in characters])
 
 class WordSet(Ruleset):
     def __init__(self, token_name, words: list[str]):
-        self.rules = []
-        for word in words:
-            self.rules.append(WordRule(token_name, word))
+        super().__init__([WordRule(token_name, word) for word in words])
+        self.token_name = token_name
+        self.words = list(words)
+
+        # A trie of the words, where the "" key of a node holds the position in `words` of the
+        # first word ending there
+        self.trie = {}
+        for index, word in enumerate(self.words):
+            node = self.trie
+            for c in word:
+                node = node.setdefault(c, {})
+            node.setdefault("", index)
+
+    def match(self, char_stream: CharacterStream) -> str:
+        # Follow the text down the trie. Every word passed on the way matches, and the one
+        # listed first wins, whether or not it is the longest
+        node = self.trie
+        first = node.get("")
+        depth = 0
+        while (node := node.get(char_stream.peek(depth))) is not None:
+            depth += 1
+            index = node.get("")
+            if index is not None and (first is None or index < first):
+                first = index
+
+        if first is None:
+            return None
+
+        start = char_stream.position
+        char_stream.advance(len(self.words[first]))
+        return Token(self.token_name, char_stream, start, char_stream.position)
 
 class CommentRule(SyntaxRule):
     def __init__(self, comment_pattern, terminator) -> None:
@@ -178,14 +299,18 @@ class CommentRule(SyntaxRule):
         self.pattern_length = len(comment_pattern)
     def match(self, char_stream: CharacterStream) -> str:
         
-        if char_stream.lookahead(self.pattern_length) != self.begin:
+        if not char_stream.startswith(self.begin):
             return None
         
+        start = char_stream.position
         char_stream.advance(self.pattern_length)
 
-        comment_string = ""
-        while char_stream.peek() != self.terminator:
-            comment_string += char_stream.pop()
+        # The terminator is compared one character at a time, so a longer one is never found
+        length = char_stream.find(self.terminator) if len(self.terminator) == 1 else -1
+        if length == -1:
+            char_stream.position = char_stream.length
+            raise IndexError()
+        char_stream.advance(length)
 
         # TODO: Provide a global method to eat a terminating chacter and raise
         #       required errors
@@ -194,7 +319,28 @@ class CommentRule(SyntaxRule):
         if not result:
             raise SyntaxError(char_stream.peek())
         
-        return ("Comment", comment_string)
+        return Token("Comment", char_stream, start, char_stream.position, self.comment_text)
+
+    def regex(self):
+        if len(self.terminator) != 1:
+            return None
+        # A comment with no terminator only matches its opening pattern
+        begin, terminator = re.escape(self.begin), re.escape(self.terminator)
+        return f"{begin}[^{terminator}]*{terminator}|{begin}"
+
+    def token(self, char_stream, start, end):
+        if end - start == self.pattern_length:
+            # Leave `match` to raise the error for the comment
+            char_stream.position = start
+            return self.match(char_stream)
+        return Token("Comment", char_stream, start, end, self.comment_text)
+
+    def comment_text(self, text):
+        """ The text of a comment, without its opening pattern and terminator """
+        return text[self.pattern_length:-1]
+
+    def first_characters(self):
+        return {self.begin[0]} if self.begin else None
 
 
 class AlphaCharacterRule(SyntaxRule):
@@ -202,9 +348,19 @@ class AlphaCharacterRule(SyntaxRule):
 
         code = ord(char_stream.peek())
         if ord('A') <= code <= ord('Z'):
-            return ("Symbol", char_stream.pop())
+            char_stream.advance()
+            return Token("Symbol", char_stream, char_stream.position - 1, char_stream.position)
         
         return None
+
+    def regex(self):
+        return "[A-Z]"
+
+    def first_characters(self):
+        return set("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+    def token(self, char_stream, start, end):
+        return Token("Symbol", char_stream, start, end)
     
 class GreedyConsumerRule(SyntaxRule):
     def __init__(self, consume_rule: SyntaxRule, end_rule: SyntaxRule):
@@ -0,0 +1,134 @@
+from array import array
+
+
+class Token:
+    """
+        A token that refers to its text by offsets into the stream it was lexed from, rather
+        than holding a copy. The text, value, line and column are only worked out when asked for.
+
+        A token behaves like the `(type, value)` tuple lexer rules have always returned: it can
+        be indexed and unpacked, and it compares equal to a tuple with the same type and value.
+    """
+    __slots__ = ('type', 'stream', 'start', 'end', '_convert', '_value')
+
+    def __init__(self, type_, stream, start: int, end: int, convert=None):
+        """
+        Args:
+            type_: The token type.
+            stream: The CharacterStream the token was lexed from.
+            start, end: The offsets of the token's text in the stream.
+            convert: Optional. Turns the token's text into its value, e.g. `int`.
+        """
+        self.type = type_
+        self.stream = stream
+        self.start = start
+        self.end = end
+        self._convert = convert
+        self._value = None
+
+    @property
+    def text(self) -> str:
+        """ The text the token was lexed from """
+        return self.stream.items[self.start:self.end]
+
+    @property
+    def value(self):
+        """ The token's value: its text, or what `convert` makes of it """
+        if self._value is None:
+            self._value = self.text if self._convert is None else self._convert(self.text)
+        return self._value
+
+    @property
+    def line(self) -> int:
+        """ The line the token starts on, counting from 1 """
+        return self.stream.line_column(self.start)[0]
+
+    @property
+    def column(self) -> int:
+        """ The column the token starts at, counting from 1 """
+        return self.stream.line_column(self.start)[1]
+
+    def __getitem__(self, index):
+        return (self.type, self.value)[index]
+
+    def __len__(self):
+        return 2
+
+    def __iter__(self):
+        yield self.type
+        yield self.value
+
+    def __eq__(self, other):
+        if isinstance(other, (Token, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return f"Token({self.type!r}, {self.value!r}, {self.start}:{self.end})"
+
+
+class TokenList:
+    """
+        The tokens a lexer produces, stored as arrays of offsets into the stream they were lexed
+        from. Indexing it makes a Token for the span asked for, so a large input costs a few
+        bytes per token rather than a tuple and a string each.
+
+        Tokens that are not Tokens, such as the tuples of a custom rule, are kept as they are.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.kinds = array('I')
+        self.starts = array('q')
+        self.ends = array('q')
+
+        # The (type, convert) pair of each kind of token. Kind 0 marks a token kept in `others`
+        self.kind_table = [None]
+        self.kind_lookup = {}
+        self.others = {}
+
+    def append(self, token):
+        if token.__class__ is not Token or token.stream is not self.stream:
+            self.others[len(self.kinds)] = token
+            kind = start = end = 0
+        else:
+            start, end = token.start, token.end
+            kind = self.kind_lookup.get((token.type, token._convert))
+            if kind is None:
+                kind = self.kind_lookup[token.type, token._convert] = len(self.kind_table)
+                self.kind_table.append((token.type, token._convert))
+
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        kind = self.kinds[index]
+        if kind == 0:
+            return self.others[index]
+
+        type_, convert = self.kind_table[kind]
+        return Token(type_, self.stream, self.starts[index], self.ends[index], convert)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (TokenList, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
@@ -1,4 +1,8 @@
+import re
+
 from parsall.core.Streams import CharacterStream
+from parsall.core.rule import CommentRule, Ruleset, WordRule
+from parsall.core.tokens import TokenList
 
 class DefaultLexer:
     def __init__(self, syntax_rules, ignore=" \t\n"):
@@ -10,7 +14,7 @@ class DefaultLexer:
         char_stream = CharacterStream(input_text)
 
         # Start parsing the tokens using the syntax rules
-        parsed_text = []
+        parsed_text = TokenList(char_stream)
         while char_stream.peek() is not None:
             while char_stream.peek() in self.ignore:
                 char_stream.pop()
@@ -24,4 +28,198 @@ class DefaultLexer:
                 # If no rule matches, raise an error
                 raise ValueError("Syntax error in input text: " + char_stream.peek())
 
-        return parsed_text
\ No newline at end of file
+        return parsed_text
+
+    def tokenise_stream(self, file, chunk_size=2**16):
+        """
+        Reads text from the file-like `file` a chunk at a time and yields its tokens as they are
+        found, so that input of any size is lexed in about the memory of one chunk.
+
+        A token near the end of a chunk is only yielded once enough of the next chunk has been
+        read to be sure it would not have been longer, or matched by another rule. Tokens refer
+        to the chunk they were lexed from, so keep `tuple(token)` rather than the token itself
+        to let the chunk go. Unlike `tokenise`, input may end with ignored characters.
+        """
+        margin = _lookahead(self.syntax_rules)
+        text, position, at_end = "", 0, False
+        char_stream = CharacterStream(text)
+        while True:
+            position = self._skip(text, position)
+
+            token = None
+            if position < len(text):
+                try:
+                    token, end = self._match_at(char_stream, position)
+                except Exception:
+                    # A token cut off by the end of the chunk may not match, so only give up once more text could not help
+                    if at_end or char_stream.position + margin <= len(text):
+                        raise
+
+            if token is not None and (at_end or (end < len(text) and position + margin <= len(text))):
+                yield token
+                position = end
+                continue
+
+            if at_end and position >= len(text):
+                return
+
+            # Drop what has been lexed and read on
+            chunk = file.read(chunk_size)
+            at_end = not chunk
+            line, column = char_stream.line_column(position) if position < len(text) else _end_of(char_stream)
+            text = text[position:] + chunk
+            position = 0
+            char_stream = CharacterStream(text, line, column)
+
+    def _skip(self, text, position):
+        """ Returns the position of the first character at or after `position` that is not ignored """
+        while position < len(text) and text[position] in self.ignore:
+            position += 1
+        return position
+
+    def _match_at(self, char_stream, position):
+        """
+        Matches the token at `position`. Returns the token and the position after it, or None
+        and the end of the input if rules consumed the rest of it without matching.
+        """
+        char_stream.position = position
+        for rule in self.syntax_rules:
+            match = rule.match(char_stream)
+            if match is not None:
+                return match, char_stream.position
+
+        if char_stream.peek() is None:
+            return None, char_stream.position
+        raise ValueError("Syntax error in input text: " + char_stream.peek())
+
+class CompiledLexer(DefaultLexer):
+    """
+        A lexer that produces the same tokens as DefaultLexer, but scans for every rule that
+        provides a `regex()` with one combined regular expression rather than calling each
+        rule's `match` in turn.
+
+        Rulesets are flattened into their rules. Each run of consecutive rules with a regex is
+        joined into alternations, which Python tries left to right, so the first rule in the
+        list still wins. Like Ruleset, a run has an alternation for each character its rules
+        can start with, holding only the rules that could match there. Rules without a regex
+        are matched with `match` on a CharacterStream moved to the current position, in their
+        place in the list.
+
+        Unlike DefaultLexer, input may end with ignored characters.
+    """
+
+    def __init__(self, syntax_rules, ignore=" \t\n"):
+        super().__init__(syntax_rules, ignore)
+        self.skip = re.compile(f"[{re.escape(ignore)}]*") if ignore else None
+        self.segments = []
+
+        run = []
+        for rule in _flatten(syntax_rules):
+            pattern = rule.regex()
+            if pattern is not None:
+                run.append((rule, pattern))
+                continue
+            if run:
+                self.segments.append(_Run(run))
+                run = []
+            self.segments.append(rule)
+        if run:
+            self.segments.append(_Run(run))
+
+    def tokenise(self, input_text):
+        char_stream = CharacterStream(input_text)
+        length = len(input_text)
+
+        parsed_text = TokenList(char_stream)
+        position = 0
+        while position < length:
+            position = self._skip(input_text, position)
+            if position >= length:
+                break
+
+            token, position = self._match_at(char_stream, position)
+            if token is None:
+                break
+            parsed_text.append(token)
+
+        return parsed_text
+
+    def _skip(self, text, position):
+        if self.skip is None:
+            return position
+        return self.skip.match(text, position).end()
+
+    def _match_at(self, char_stream, position):
+        text = char_stream.items
+        start = position
+        for segment in self.segments:
+            if isinstance(segment, _Run):
+                # Slicing rather than indexing, as a rule before may have consumed the rest of the text
+                scanner, rules = segment.candidates.get(text[position:position + 1], segment.unindexed)
+                match = scanner.match(text, position) if rules else None
+                if match is not None:
+                    return rules[match.lastindex - 1].token(char_stream, position, match.end()), match.end()
+            else:
+                # Rules may consume input without matching (e.g. IgnoreRule), so carry on from wherever they stop
+                char_stream.position = position
+                match = segment.match(char_stream)
+                position = char_stream.position
+                if match is not None:
+                    return match, position
+
+        # Nothing matched. Going through the rules' own `match` raises the error DefaultLexer
+        # would, e.g. for a string with no closing quote
+        return DefaultLexer._match_at(self, char_stream, start)
+
+def _lookahead(rules):
+    """ How far past the start of a token the rules may look before they match or give up """
+    longest = 1
+    for rule in _flatten(rules):
+        if isinstance(rule, WordRule):
+            longest = max(longest, rule.length)
+        elif isinstance(rule, CommentRule):
+            longest = max(longest, rule.pattern_length)
+
+    # Following a WordSet's trie looks one character past its longest word
+    return longest + 1
+
+def _end_of(char_stream):
+    """ The line and column just past the end of a CharacterStream """
+    if char_stream.length == 0:
+        return char_stream.first_line, char_stream.first_column
+    line, column = char_stream.line_column(char_stream.length - 1)
+    if char_stream.items[-1] == "\n":
+        return line + 1, 1
+    return line, column + 1
+
+def _flatten(rules):
+    for rule in rules:
+        if isinstance(rule, Ruleset):
+            yield from _flatten(rule.rules)
+        else:
+            yield rule
+
+class _Run:
+    """ A run of rules with a regex, as a scanner for each character they can start with """
+
+    def __init__(self, run):
+        candidates = {}
+        unindexed = []
+        for rule, pattern in run:
+            first_characters = rule.first_characters()
+            if first_characters is None:
+                unindexed.append((rule, pattern))
+                for rules in candidates.values():
+                    rules.append((rule, pattern))
+                continue
+
+            for c in first_characters:
+                candidates.setdefault(c, list(unindexed)).append((rule, pattern))
+
+        self.candidates = {c: _compile_rules(rules) for c, rules in candidates.items()}
+        self.unindexed = _compile_rules(unindexed)
+
+def _compile_rules(rules):
+    """ Joins the patterns of some rules into one scanner, where group `i` matches rule `i - 1` """
+    scanner = re.compile("|".join(f"({pattern})" for _, pattern in rules))
+    return (scanner, [rule for rule, _ in rules])
@@ -1,4 +1,5 @@
 import csv
+import io
 from typing import List
 from Hole import *
 from config import config
@@ -7,62 +8,364 @@ import tomllib
 import logging
 from tqdm import tqdm
 import time
+from functools import partial
+from collections import Counter
 
-from exceptions import MissingHoleDataException, custom_exception_handler
-from library import calculate_intercepts_from_group, construct_interval_from_csv_row, convert_unit, count_lines_and_hash, create_header_cache, try_parse_to_assay_type
+from exceptions import MissingHoleDataException, UnsortedExportException, custom_exception_handler
+from cache import hole_fingerprint, load_cached_store, load_intercept_state, lookup_file_hash, query_fingerprint, record_file_hash, save_cached_store, save_intercept_state
+from columnar import HoleStore, HoleStoreBuilder
+from holefile import HoleFileWriter, is_hole_file, open_hole_file
+from library import OUTPUT_HEADER, construct_interval_from_csv_row, create_header_cache, HashingReader, hole_intercept_rows, is_compressed_export, load_assay_list, open_export, read_columnar_row, required_analytes, select_assay_columns
+from parallel import analyse_holes_in_parallel, resolve_worker_count
+from parallel_ingest import ingest_export_in_parallel
+from memo import finish_result_memo
+from results import ResultSink, ResultTable, output_path, query_output_paths, write_results
 
 
 def analyse_hole(hole, writer, data_table, assay_list):
-    if hole not in data_table:
+    rows = hole_intercept_rows(hole, data_table, assay_list)
+    if rows is None:
         print(f"Could not find hole: {hole} in provided data set")
         return
 
-    focus_hole = data_table[hole]
+    writer.writerows(row[:len(OUTPUT_HEADER)] for row in rows)
 
-    # Get a list containing groups of intervals which are contiguous in this hole
-    # This simply is a list of sections from the hole which have contiguous data
-    contiguous_interval_groups = focus_hole.group_contiguous_intervals()
-
-    for grouped_interval in contiguous_interval_groups:
-        # Get all intervals from the hole which are contiguous and are above a specified cutoff
-        # This takes a list of intervals which are contigious and returns all subgroups of this interval
-        # that match the filtering criteria. This means that we end up with a list of lists
-        for assay, cutoffs, coans in assay_list:
-            for cutoff in cutoffs:
-                intercepts = calculate_intercepts_from_group(grouped_interval, assay, cutoff, coans)
-
-                # Here the intercept variable represents a list of IntervalData which have been judged to be both
-                # contiguous and above the cutoff threshold
-                for intercept in intercepts:
-                    #inter = calculate_intercept(intercept, ASSAY_UNIT_SELECT)
-                    co_string = ""
-                    for co in coans:
-                        co_string += f"{co.convert_to_reported_unit(intercept.co_analytes[co.get_unique_id()])/intercept.distance:.2f}{co.reported_unit_text()} {co.element},  "
-
-                    # header = ['Hole', 'Primary Analyte', 'Cutoff', 'Cutoff Unit', 'From', 'To', 'Interval', 'Primary Intercept', 'Intercept Label', 'Co Analytes']
-                    writer.writerow([
-                        hole, assay.element, intercept.assay.convert_to_reported_unit(cutoff), assay.reported_unit_text(),
-                        intercept.span[0], intercept.span[0] + intercept.distance, intercept.distance,
-                        round(intercept.get_concentration_as_reported(),3), intercept.to_string(),
-                        co_string
-                    ])
 
+def analyse_holes(data_table, assay_list, holes, hashes=None):
+    """
+    Yields (hole, rows) for each of `holes` in order, with rows set to None for a hole that is not
+    in the data table. When `worker_count` is more than one the holes are analysed by a pool of processes.
+    `hashes` holds the hole_fingerprint of holes that have already been hashed.
+    """
+    workers = resolve_worker_count(config.settings.worker_count)
+    if workers > 1:
+        yield from analyse_holes_in_parallel(data_table, assay_list, holes, workers)
+    else:
+        for hole in holes:
+            yield hole, hole_intercept_rows(hole, data_table, assay_list, hashes.get(hole) if hashes else None)
+
+
+def analysed_rows(data_table, assay_list, holes_to_calc, update_progress=None, report_missing=True):
+    """
+    Yields the output rows of every hole in `holes_to_calc` that is in the data table, in the
+    order of `holes_to_calc`. `update_progress` is called after each hole.
+
+    The rows of each hole are kept under `cache_location`. On the next run only holes whose
+    rows have changed are analysed again, unless the queries or settings changed or `recalc` is
+    set, in which case every hole is. The rows are saved once the last hole has been yielded.
+    """
+    query_hash = query_fingerprint(assay_list)
+    previous = {} if config.settings.recalc else load_intercept_state(query_hash)
+
+    analytes = required_analytes(assay_list)
+    data_table.normalise_units(analytes)
+    hashes = {hole: hole_fingerprint(data_table, hole, analytes) for hole in holes_to_calc if hole in data_table}
+    stale = [hole for hole, hole_hash in hashes.items() if previous.get(hole, {}).get('hash') != hole_hash]
+    logging.info(f"Analysing {len(stale)} of {len(hashes)} holes, the rest are unchanged since the last run")
+
+    analysed = analyse_holes(data_table, assay_list, stale, hashes)
+    current = {}
+
+    for hole in holes_to_calc:
+        if hole not in hashes:
+            if report_missing:
+                print(f"Could not find hole: {hole} in provided data set")
+        else:
+            if hole not in current:
+                if previous.get(hole, {}).get('hash') == hashes[hole]:
+                    current[hole] = previous[hole]
+                else:
+                    _, rows = next(analysed)
+                    current[hole] = {'hash': hashes[hole], 'rows': rows}
+            yield current[hole]['rows']
+
+        if update_progress:
+            update_progress()
+
+    # Holes left out of this run keep their rows for the next one, as long as they are still in
+    # the export. The state is only written again if it changed
+    kept = {hole: state for hole, state in previous.items() if hole in data_table}
+    if stale or len(kept) != len(previous):
+        save_intercept_state(query_hash, {**kept, **current})
+
+
+def perform_analysis(data_table, assay_list, filename, holes_to_calc, update_progress=None):
+    """
+    Writes the intercepts of every hole in `holes_to_calc` to `filename`, in the order of
+    `holes_to_calc` and in the configured output format. `update_progress` is called after
+    each hole, or after each hole of each query with `seperate_assay_files` set.
+
+    With `seperate_assay_files` set, each query is written to a file of its own instead (see
+    query_output_paths). The queries are analysed one after another, and each file is written
+    by a thread of its own, which finishes it off while the next query is analysed.
+    """
+    if config.settings.seperate_assay_files:
+        sinks = []
+        try:
+            for query, path in zip(assay_list, query_output_paths(filename, assay_list)):
+                sinks.append(ResultSink(path))
+                for rows in analysed_rows(data_table, [query], holes_to_calc, update_progress, report_missing=len(sinks) == 1):
+                    sinks[-1].put(rows)
+                sinks[-1].close()
+        finally:
+            for sink in sinks:
+                sink.join()
+    else:
+        output_path(filename)
+        table = ResultTable()
+        for rows in analysed_rows(data_table, assay_list, holes_to_calc, update_progress):
+            table.extend(rows)
+
+        # The whole table is written at once
+        write_results(table, filename)
+
+    finish_result_memo()
+
+
+def read_data_table(csvfile, update_progress=None, builder_factory=HoleStoreBuilder, analytes=None) -> HoleStore:
+    """
+    Parses an open CSV export into a HoleStore (or whatever `builder_factory` builds).
+
+    If `analytes` is given only those assay columns are decoded and stored, and every other
+    assay column is skipped. Pass None to keep every assay in the export.
+    """
+    spamreader = csv.reader(csvfile, delimiter=',', quotechar='"')
+
+    header_row = next(spamreader) # Read the first line of the header file
+    header_cache = create_header_cache(header_row, [config.settings.from_column_name, config.settings.to_column_name, config.settings.hole_id_column_name, config.settings.sample_id_column_name])
+
+    selected, assay_columns, unread_columns = select_assay_columns(header_cache, analytes)
+    hole_column = header_cache[config.settings.hole_id_column_name]
+
+    builder = builder_factory(selected)
+    for row in spamreader:
+        holeID = row[hole_column]
+        builder.add_hole(holeID)
+
+        try:
+            span, values = read_columnar_row(row, header_cache, assay_columns, unread_columns)
+        except MissingHoleDataException as err:
+            continue
+        builder.add(holeID, span, values)
+
+        if update_progress:
+            update_progress()
+
+    return builder.build()
+
+
+def stream_holes(csvfile, analytes=None):
+    """
+    Parses an open CSV export whose rows are grouped by hole, one hole at a time. Each hole is
+    yielded as a HoleStore of its own as soon as the next hole starts, so only one hole is ever
+    held in memory.
+
+    Raises UnsortedExportException if a hole turns up again after another hole has started.
+    """
+    spamreader = csv.reader(csvfile, delimiter=',', quotechar='"')
+
+    header_row = next(spamreader)
+    header_cache = create_header_cache(header_row, [config.settings.from_column_name, config.settings.to_column_name, config.settings.hole_id_column_name, config.settings.sample_id_column_name])
+
+    selected, assay_columns, unread_columns = select_assay_columns(header_cache, analytes)
+    hole_column = header_cache[config.settings.hole_id_column_name]
+
+    finished = set()
+    current_hole, builder = None, None
+    for row in spamreader:
+        holeID = row[hole_column]
+        if holeID != current_hole:
+            if builder is not None:
+                yield builder.build()
+                finished.add(current_hole)
+            if holeID in finished:
+                raise UnsortedExportException(holeID)
+
+            current_hole, builder = holeID, HoleStoreBuilder(selected)
+            builder.add_hole(holeID)
+
+        try:
+            span, values = read_columnar_row(row, header_cache, assay_columns, unread_columns)
+        except MissingHoleDataException as err:
+            continue
+        builder.add(holeID, span, values)
+
+    if builder is not None:
+        yield builder.build()
+
+
+def perform_streaming_analysis(file_name, assay_list, filename, holes_to_calc=None, update_progress=None):
+    """
+    Writes the same file as perform_analysis, but analyses each hole straight out of the export
+    as it is read rather than loading the export first. Peak memory is then set by the largest
+    hole instead of the size of the export, besides the intercepts themselves when writing one
+    of the binary output formats. Pass None for `holes_to_calc` to analyse every hole. With
+    `seperate_assay_files` set, the files of every query are written side by side.
+
+    `update_progress` is called with the number of bytes of the export read so far.
+
+    Raises UnsortedExportException if the export is not grouped by hole. Anything written to
+    `filename` by then is incomplete, so the caller should fall back to perform_analysis.
+    """
+    wanted = None if holes_to_calc is None else Counter(holes_to_calc)
+    finished = {}  # rows of selected holes that are waiting for an earlier selection to be written
+    next_selection = 0
+
+    # Every file is written by a ResultSink of its own. With `seperate_assay_files` set, the
+    # rows of each hole are calculated query by query and sent to that query's file
+    if config.settings.seperate_assay_files:
+        query_sets, paths = [[query] for query in assay_list], query_output_paths(filename, assay_list)
+    else:
+        query_sets, paths = [assay_list], [filename]
+
+    sinks = []
+    try:
+        for path in paths:
+            sinks.append(ResultSink(path))
+
+        def analyse(hole, hole_table):
+            return [hole_intercept_rows(hole, hole_table, queries) for queries in query_sets]
+
+        def write(rows_by_sink):
+            for sink, rows in zip(sinks, rows_by_sink):
+                sink.put(rows)
+
+        def write_ready_selections():
+            # Selections are written in the order they were asked for, just like perform_analysis
+            nonlocal next_selection
+            while next_selection < len(holes_to_calc) and holes_to_calc[next_selection] in finished:
+                hole = holes_to_calc[next_selection]
+                write(finished[hole])
+                wanted[hole] -= 1
+                if not wanted[hole]:
+                    del finished[hole]
+                next_selection += 1
+
+        with open_export(file_name) as file:
+            reader = HashingReader(file, update_progress)
+            with io.TextIOWrapper(io.BufferedReader(reader, buffer_size=1 << 20), newline='') as csvfile:
+                analytes = required_analytes(assay_list)
+                for hole_table in stream_holes(csvfile, analytes):
+                    hole_table.normalise_units(analytes)
+                    hole = hole_table.hole_ids[0]
+                    if wanted is None:
+                        write(analyse(hole, hole_table))
+                    elif hole in wanted:
+                        finished[hole] = analyse(hole, hole_table)
+                        write_ready_selections()
+
+        if wanted is not None:
+            for hole in holes_to_calc[next_selection:]:
+                if hole in finished:
+                    write(finished[hole])
+                else:
+                    print(f"Could not find hole: {hole} in provided data set")
+    finally:
+        for sink in sinks:
+            sink.join()
+
+    finish_result_memo()
+
+
+def try_streaming_analysis(file_name, assay_list, filename, update_progress=None) -> bool:
+    """
+    Runs perform_streaming_analysis over the configured hole selections when `streaming` is
+    enabled. Hole files are already read a hole at a time, so they are never streamed.
+
+    Returns: False if the analysis still needs to be run by loading the export, either because
+    streaming is disabled or because the export turned out not to be grouped by hole
+    """
+    if not config.settings.streaming or is_hole_file(file_name):
+        return False
+
+    holes_to_calc = None if config.settings.hole_selections == ['*'] else config.settings.hole_selections
+    try:
+        perform_streaming_analysis(file_name, assay_list, filename, holes_to_calc, update_progress)
+    except UnsortedExportException as err:
+        logging.warning(f"{err}. Loading the whole export instead")
+        return False
+
+    return True
+
+
+def build_data_table(file_name, loc, update_progress=None, builder_factory=HoleStoreBuilder) -> HoleStore:
+    # A hole file has already been parsed, so it is opened in place rather than read
+    if is_hole_file(file_name):
+        return open_hole_file(file_name)
+
+    with io.TextIOWrapper(open_export(file_name), newline='') as csvfile:
+        return read_data_table(csvfile, update_progress, builder_factory)
+
+
+def ingest_export(file_name, update_progress=None, builder_factory=HoleStoreBuilder, analytes=None):
+    """
+    Parses an export and calculates its SHA-256 in a single read of the file.
+    `update_progress` is called with the number of bytes read so far, so progress can be
+    reported against the size of the file without counting its lines first.
+
+    With `ingest_workers` above 1 the export is split up and parsed by a pool of processes
+    instead (see parallel_ingest.py). That needs the whole HoleStore in memory, so it is only
+    used when building a HoleStore rather than writing a hole file. A compressed export cannot
+    be split into byte ranges, so it is always read serially.
+
+    Returns: the parsed HoleStore and the hash of the export
+    """
+    workers = resolve_worker_count(config.settings.ingest_workers)
+    if workers > 1 and builder_factory is HoleStoreBuilder and not is_compressed_export(file_name):
+        return ingest_export_in_parallel(file_name, workers, update_progress, analytes)
+
+    with open_export(file_name) as file:
+        reader = HashingReader(file, update_progress)
+        with io.TextIOWrapper(io.BufferedReader(reader, buffer_size=1 << 20), newline='') as csvfile:
+            data_table = read_data_table(csvfile, builder_factory=builder_factory, analytes=analytes)
+            return data_table, reader.hexdigest()
+
+
+def open_data_table(file_name, update_progress=None, analytes=None) -> HoleStore:
+    """
+    Returns the HoleStore for an export. If the export has been parsed before it is loaded
+    from the dataset cache without reading the export again, otherwise it is ingested in a
+    single pass and then cached.
+
+    `analytes` restricts parsing to the assays the queries need (see required_analytes). A
+    cached copy of the full export is used in preference to parsing if one exists.
+    """
+    if is_hole_file(file_name):
+        return open_hole_file(file_name)
+
+    hash_value = lookup_file_hash(file_name)
+    if hash_value is not None:
+        for cached_analytes in ([None, analytes] if analytes is not None else [None]):
+            data_table = load_cached_store(hash_value, cached_analytes)
+            if data_table is not None:
+                logging.info(f"Loaded {file_name} from the dataset cache")
+                return data_table
+
+    data_table, hash_value = ingest_export(file_name, update_progress, analytes=analytes)
+    save_cached_store(data_table, hash_value, analytes, file_name)
+    record_file_hash(file_name, hash_value)
+    return data_table
 
-def perform_analysis(data_table, assay_list, filename, holes_to_calc):
-    with open(filename, mode='w', newline='') as csvfile:
-        writer = csv.writer(csvfile, quoting=csv.QUOTE_NONNUMERIC, escapechar='\\')
 
-        header = ['Hole', 'Primary Analyte', 'Cutoff', 'Cutoff Unit', 'From', 'To', 'Interval', 'Primary Intercept', 'Intercept Label', 'Co Analytes']
-        writer.writerow(header)
+def ingest_analytes(assay_list):
+    """ The analytes to parse for a set of queries, or None when the whole export should be kept """
+    if config.settings.full_dataset_cache:
+        return None
+    return required_analytes(assay_list)
 
-        for hole in holes_to_calc:
-            analyse_hole(hole, writer, data_table, assay_list)
 
+def convert_export_to_hole_file(file_name, path, update_progress=None) -> HoleStore:
+    """ Converts a CSV export into a memory mapped hole file at `path` and returns it opened """
+    return build_data_table(file_name, 0, update_progress, builder_factory=partial(HoleFileWriter, path))
 
 
-def build_data_table(file_name, loc, update_progress=None):
+def build_interval_data_table(file_name, loc, update_progress=None):
+    """
+    Builds the original `dict[str, HoleData]` data table, with an IntervalData object per row.
+    This is kept as the reference implementation for build_data_table.
+    """
     data_table: dict[int, HoleData] = {}
-    with open(file_name, newline='') as csvfile:
+    with io.TextIOWrapper(open_export(file_name), newline='') as csvfile:
         spamreader = csv.reader(csvfile, delimiter=',', quotechar='"')
 
         header_row = next(spamreader) # Read the first line of the header file
@@ -108,52 +411,29 @@ sys.excepthook = custom_exception_handler
 
 
 if __name__ == "__main__":
+    # -recalc analyses every hole again rather than only the ones that changed since the last run
     if '-recalc' in sys.argv:
         config.settings.recalc = True
-    else:
-        config.settings.recalc = False
 
 
     file_name = config.settings.exported_data_path
 
-    loc, hash_value = count_lines_and_hash(file_name)
-
-    data_table_ = build_data_table(file_name, loc)
-
-    queries = None
-    with open('queries.toml', 'rb') as queries_file:
-        queries = tomllib.load(queries_file)
-
-    assay_list_ = []
-    for assay in list(queries.values()):
-        element = assay['element']
-        base_unit = assay['base_unit']
-        reported_unit = assay['reported_unit']
-        cutoffs = assay['cutoffs']
-        
-        primary = try_parse_to_assay_type(element, base_unit, reported_unit)
-
-        for i, cutoff in enumerate(cutoffs):
-            cutoffs[i] = convert_unit(cutoff, primary.reported_unit, primary.base_unit)
-
-        co_analytes = assay['co_analytes']
-        analytes = []
-        for co in co_analytes:
-            analytes.append(try_parse_to_assay_type(co['element'], co['base_unit'], co['reported_unit']))
-
-        assay_list_.append((primary, cutoffs, analytes))
-
-    print(assay_list_)
+    assay_list_ = load_assay_list('queries.toml')
 
     current_time = time.strftime('%H-%M-%S')  # Current timestamp as YYYYMMDDHHMMSS
     filename = f'intercepts_{current_time}.csv'
 
-    if config.settings.hole_selections == ['*']:
-        holes_to_calc = list(data_table_.keys())
-    else:
-        holes_to_calc = config.settings.hole_selections
+    if not try_streaming_analysis(file_name, assay_list_, filename):
+        data_table_ = open_data_table(file_name, analytes=ingest_analytes(assay_list_))
+
+        print(assay_list_)
+
+        if config.settings.hole_selections == ['*']:
+            holes_to_calc = list(data_table_.keys())
+        else:
+            holes_to_calc = config.settings.hole_selections
 
-    print(list(data_table_.keys()))
+        print(list(data_table_.keys()))
 
 
-    perform_analysis(data_table_, assay_list_, filename, holes_to_calc)
\ No newline at end of file
+        perform_analysis(data_table_, assay_list_, filename, holes_to_calc)
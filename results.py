@@ -0,0 +1,265 @@
+# The intercepts of an analysis as an in-memory table, and the writers for it.
+#
+# Rows come out of intercept_rows with the co-analyte grades as numbers as well as text, so the
+# table can hold each co-analyte as a column of its own. The table is written in one go as CSV,
+# as an NPZ archive of NumPy arrays or as an Arrow IPC file, picked by the `output_format` setting.
+# The binary formats keep every number as it is, so nothing needs to parse them back out of text.
+import os
+import queue
+import threading
+from collections import Counter
+from itertools import chain, groupby
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from config import config
+from library import OUTPUT_HEADER
+
+# Column names for the binary formats, in the order of OUTPUT_HEADER
+RESULT_COLUMNS = ['hole', 'analyte', 'cutoff', 'cutoff_unit', 'from', 'to', 'length', 'grade', 'label', 'co_analytes']
+TEXT_COLUMNS = {'hole', 'analyte', 'cutoff_unit', 'label', 'co_analytes'}
+CSV_ONLY_COLUMNS = {'label', 'co_analytes'}
+
+OUTPUT_EXTENSIONS = {'csv': '.csv', 'npz': '.npz', 'arrow': '.arrow'}
+
+# Rows are formatted this many at a time when writing CSV, which bounds the size of each string
+CSV_BLOCK_ROWS = 65536
+
+
+class ResultTable:
+    """
+    The output rows of an analysis held column by column. Rows are added a hole at a time, as
+    intercept_rows makes them, and each co-analyte becomes a numeric column named after its
+    element and reported unit, with NaN for intercepts whose query did not ask for it.
+    """
+
+    def __init__(self):
+        self._columns = [[] for _ in RESULT_COLUMNS]
+        self._co_grades = []
+
+    def extend(self, rows: List[list]):
+        if not rows:
+            return
+
+        transposed = list(zip(*rows))
+        for column, values in zip(self._columns, transposed):
+            column.extend(values)
+        self._co_grades.extend(transposed[len(RESULT_COLUMNS)])
+
+    def __len__(self):
+        return len(self._co_grades)
+
+    def co_analyte_names(self) -> List[str]:
+        """ The co-analyte columns, in the order they were first seen """
+        return list(dict.fromkeys(name for names in self._co_groups() for name in names))
+
+    def _co_groups(self) -> Dict[tuple, Tuple[List[int], List[float]]]:
+        # The rows of each set of co-analytes, and their grades flattened row by row. Rows from
+        # the same query come together, so they are gathered a run of rows at a time
+        groups = {}
+        row = 0
+        for names, run in groupby(self._co_grades, key=tuple):
+            run = list(run)
+            rows, grades = groups.setdefault(names, ([], []))
+            grades.extend(chain.from_iterable(map(dict.values, run)))
+            run_length = len(run)
+            rows.extend(range(row, row + run_length))
+            row += run_length
+        return groups
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """
+        Every column for the binary formats as an array, keyed by its name in RESULT_COLUMNS and
+        followed by the co-analyte columns. The intercept label and co-analyte text are left out,
+        as they only repeat the numbers for the CSV.
+        """
+        columns = {
+            name: np.array(values, dtype=str if name in TEXT_COLUMNS else np.float64)
+            for name, values in zip(RESULT_COLUMNS, self._columns) if name not in CSV_ONLY_COLUMNS
+        }
+        for names, (rows, grades) in self._co_groups().items():
+            if not names:
+                continue
+            grades = np.array(grades, dtype=np.float64).reshape(len(rows), len(names))
+            for k, name in enumerate(names):
+                if name not in columns:
+                    columns[name] = np.full(len(self), np.nan)
+                columns[name][rows] = grades[:, k]
+        return columns
+
+    def write_csv(self, file):
+        """ Writes the table to an open text file as the CSV perform_analysis has always written """
+        file.write(format_csv_rows([OUTPUT_HEADER]))
+        for lo in range(0, len(self), CSV_BLOCK_ROWS):
+            file.write(_format_csv_columns([column[lo:lo + CSV_BLOCK_ROWS] for column in self._columns]))
+
+
+def _quote(text: str) -> str:
+    return '"' + text.replace('\\', '\\\\').replace('"', '""') + '"'
+
+def _quote_column(values: List[str]) -> List[str]:
+    # The column is escaped as one string and split up again on NUL, unless a value holds a NUL itself
+    joined = "\0".join(values)
+    if joined.count("\0") != len(values) - 1:
+        return list(map(_quote, values))
+    return ('"' + joined.replace('\\', '\\\\').replace('"', '""').replace("\0", '"\0"') + '"').split("\0")
+
+def _format_csv_columns(columns: List[list]) -> str:
+    # Text is quoted and numbers are written with str, exactly as a csv.writer using
+    # QUOTE_NONNUMERIC and a backslash escapechar would, but a whole column at a time
+    formatted = []
+    for values in columns:
+        if values and isinstance(values[0], str):
+            formatted.append(_quote_column(values))
+        else:
+            # Cutoffs and depths repeat a great deal, so each distinct number is only formatted once
+            text = {value: str(value) for value in set(values)}
+            formatted.append(map(text.__getitem__, values))
+
+    lines = "\r\n".join(map(",".join, zip(*formatted)))
+    return lines + "\r\n" if lines else ""
+
+def format_csv_rows(rows: List[list]) -> str:
+    """ Formats output rows (see OUTPUT_HEADER) as CSV text, leaving out the co-analyte grades """
+    if not rows:
+        return ""
+    return _format_csv_columns([list(column) for column in zip(*(row[:len(OUTPUT_HEADER)] for row in rows))])
+
+def write_npz(table: ResultTable, path: str):
+    # Uncompressed, so writing is bound by the disk rather than by zlib
+    np.savez(path, **table.columns())
+
+def _import_pyarrow():
+    # pyarrow is only needed for Arrow output, so it is not imported unless that is asked for
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise RuntimeError("Writing Arrow output needs pyarrow, which is not installed. Install it or set output_format to csv or npz")
+    return pyarrow
+
+def write_arrow(table: ResultTable, path: str):
+    pa = _import_pyarrow()
+    arrow_table = pa.table({name: pa.array(column) for name, column in table.columns().items()})
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, arrow_table.schema) as writer:
+        writer.write_table(arrow_table)
+
+def output_path(filename: str, output_format: str = None) -> str:
+    """
+    Where output asked for at `filename` is written: the binary formats replace its extension with
+    their own. Raises if the output format is unknown or cannot be written here, so this can be
+    called to check before starting an analysis.
+    """
+    output_format = output_format or config.settings.output_format
+    if output_format not in OUTPUT_EXTENSIONS:
+        raise ValueError(f"Unsupported output format: {output_format}. Use one of {', '.join(OUTPUT_EXTENSIONS)}")
+
+    if output_format == 'arrow':
+        _import_pyarrow()
+
+    if output_format == 'csv':
+        return filename
+    return os.path.splitext(filename)[0] + OUTPUT_EXTENSIONS[output_format]
+
+def write_results(table: ResultTable, filename: str, output_format: str = None) -> str:
+    """
+    Writes a ResultTable in the output format, to `filename` or, for the binary formats, next to
+    it (see output_path).
+
+    Returns: the path written
+    """
+    output_format = output_format or config.settings.output_format
+    path = output_path(filename, output_format)
+
+    if output_format == 'csv':
+        with open(path, mode='w', newline='') as file:
+            table.write_csv(file)
+    elif output_format == 'npz':
+        write_npz(table, path)
+    else:
+        write_arrow(table, path)
+
+    return path
+
+def query_output_paths(filename: str, assay_list, output_format: str = None) -> List[str]:
+    """
+    The file each query in `assay_list` is written to when `seperate_assay_files` is set: `filename`
+    with the primary element of the query added, numbered when more than one query shares it.
+    """
+    root, extension = os.path.splitext(output_path(filename, output_format))
+    seen = Counter()
+    paths = []
+    for primary, cutoffs, co_analytes in assay_list:
+        seen[primary.element] += 1
+        name = primary.element if seen[primary.element] == 1 else f"{primary.element}_{seen[primary.element]}"
+        paths.append(f"{root}_{name}{extension}")
+    return paths
+
+
+class ResultSink:
+    """
+    Writes output rows to one file from a thread of its own, which takes them off a queue. CSV is
+    written a block of rows at a time as they arrive, while the binary formats gather a
+    ResultTable and write it once the sink is closed. Errors in the writer are raised from `put` or `join`.
+    """
+
+    def __init__(self, filename: str, output_format: str = None):
+        self.output_format = output_format or config.settings.output_format
+        self.path = output_path(filename, self.output_format)
+        self.error = None
+
+        self._queue = queue.Queue()
+        self._block = []
+        self._closed = False
+        self._received_all = False
+        self._thread = threading.Thread(target=self._write, name=f"writer for {self.path}", daemon=True)
+        self._thread.start()
+
+    def put(self, rows: List[list]):
+        if self.error is not None:
+            raise self.error
+        # Rows are handed over a block at a time, as waking the writer for every hole costs more
+        # than formatting its rows does
+        self._block.extend(rows)
+        if len(self._block) >= CSV_BLOCK_ROWS:
+            self._queue.put(self._block)
+            self._block = []
+
+    def close(self):
+        """ Lets the writer finish the file once it has written every row put so far """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(self._block)
+            self._queue.put(None)
+
+    def join(self):
+        """ Closes the sink and waits until its file is written """
+        self.close()
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _rows(self):
+        while (rows := self._queue.get()) is not None:
+            yield rows
+        self._received_all = True
+
+    def _write(self):
+        try:
+            if self.output_format == 'csv':
+                with open(self.path, mode='w', newline='') as file:
+                    file.write(format_csv_rows([OUTPUT_HEADER]))
+                    for rows in self._rows():
+                        file.write(format_csv_rows(rows))
+            else:
+                table = ResultTable()
+                for rows in self._rows():
+                    table.extend(rows)
+                write_results(table, self.path, self.output_format)
+        except BaseException as err:
+            self.error = err
+            # Keep taking rows off the queue until the sink is closed, so nothing waits on it
+            if not self._received_all:
+                for _ in self._rows():
+                    pass
@@ -0,0 +1,97 @@
+# Checks that every intercept_engine writes exactly the rows of the python engine, which
+# reproduces the original calculate_intercepts_from_group
+import numpy as np
+import pytest
+
+from columnar import HoleStoreBuilder
+from config import config
+from engine import calculate_intercepts_for_cutoffs_from_range
+from Hole import AssayType
+from library import calculate_intercepts_from_group, hole_intercept_rows, load_assay_list
+from refactor import build_data_table
+from units import AssayUnit
+
+ENGINES = ["numpy"]
+PRIMARY = AssayType("Cu", AssayUnit.PPM)
+CO_ANALYTE = AssayType("Au", AssayUnit.PPM)
+NAN = float("nan")
+
+
+@pytest.fixture(scope="module")
+def bundled_export():
+    return build_data_table("Drilling_Samples_R1.zip", 0), load_assay_list("queries.toml")
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    # Every row has to be calculated, rather than read back from the result memo
+    monkeypatch.setattr(config.settings, "result_cache", False)
+    monkeypatch.setattr(config.settings, "intercept_engine", "python")
+
+def engine_rows(engine, data_table, assay_list):
+    config.settings.intercept_engine = engine
+    return [row for hole in data_table.keys() for row in hole_intercept_rows(hole, data_table, assay_list)]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_bundled_export_matches_python_engine(engine, bundled_export):
+    data_table, assay_list = bundled_export
+    expected = engine_rows("python", data_table, assay_list)
+    found = engine_rows(engine, data_table, assay_list)
+
+    assert len(expected) > 3000
+    assert found == expected
+
+
+def one_hole(lengths, primary, co_analyte=None):
+    """ A store holding one hole of consecutive intervals with these lengths and grades """
+    builder = HoleStoreBuilder([PRIMARY, CO_ANALYTE])
+    depth = 0.0
+    for length, grade, co_grade in zip(lengths, primary, co_analyte or [NAN] * len(lengths)):
+        builder.add("H1", (depth, depth + length), [grade, co_grade])
+        depth += length
+    return builder.build()
+
+def assert_matches_original(store, cutoffs):
+    """ The numpy engine against calculate_intercepts_from_group, one cutoff at a time """
+    hole = store["H1"]
+    for group, rows in zip(hole.group_contiguous_intervals(), hole.contiguous_ranges()):
+        expected = [calculate_intercepts_from_group(group, PRIMARY, cutoff, [CO_ANALYTE]) for cutoff in cutoffs]
+        assert calculate_intercepts_for_cutoffs_from_range(store, rows, PRIMARY, cutoffs, [CO_ANALYTE]) == expected
+
+
+def test_missing_assays(monkeypatch):
+    monkeypatch.setattr(config.settings, "internal_dilution_intervals", 2)
+    # A missing assay stops an intercept collecting dilution, but the next interval above the
+    # cutoff still joins it if the allowance was not used up
+    primary = [2.0, NAN, 0.5, 3.0, 0.5, NAN, NAN, 4.0, 0.2, 0.2, 0.2, 5.0, NAN]
+    co_analyte = [1.0, 2.0, NAN, 3.0, NAN, 1.0, NAN, NAN, 2.0, 2.0, 2.0, 1.0, 1.0]
+    assert_matches_original(one_hole([1.0] * len(primary), primary, co_analyte), [1.0, 2.5, 4.5])
+
+def test_zero_and_below_cutoff_tails(monkeypatch):
+    monkeypatch.setattr(config.settings, "internal_dilution_intervals", 2)
+    # Trailing zeros, grades below the cutoff and missing assays are trimmed off an intercept
+    primary = [3.0, 0.0, 1.5, 0.0, 0.0, 9.0, 0.5, 0.0, NAN, 0.0]
+    assert_matches_original(one_hole([1.0, 0.5, 0.5, 1.0, 1.0, 2.0, 0.5, 0.5, 1.0, 1.0], primary), [0.0, 1.0, 2.0])
+
+@pytest.mark.parametrize("dilution", [0, 1, 2])
+def test_dilution_boundary(monkeypatch, dilution):
+    monkeypatch.setattr(config.settings, "internal_dilution_intervals", dilution)
+    # The second intercept collects dilution that adds up to exactly 2.0 from its start. Counted
+    # from the start of the run it comes to a hair over the allowance instead
+    lengths = [1.0, 0.3, 1.3, 1.0, 1.0, 0.7, 1.0, 0.3, 1.0, 1.0, 1.0, 1.0]
+    primary = [2.0, 0.5, 0.5, 0.5, 2.0, 0.5, 0.5, 0.5, 2.0, 0.5, 0.5, 2.0]
+    assert_matches_original(one_hole(lengths, primary), [1.0])
+
+def test_random_runs(monkeypatch):
+    rng = np.random.default_rng(0)
+    for dilution in [0, 0.3, 1, 2]:
+        monkeypatch.setattr(config.settings, "internal_dilution_intervals", dilution)
+        for _ in range(20):
+            count = 200
+            primary = np.round(rng.lognormal(0, 1, count), 2)
+            primary[rng.random(count) < 0.1] = 0.0
+            primary[rng.random(count) < 0.1] = NAN
+            co_analyte = np.round(rng.lognormal(0, 1, count), 2)
+            co_analyte[rng.random(count) < 0.2] = NAN
+            lengths = rng.choice([0.1, 0.2, 0.3, 0.6, 0.7, 1.0, 1.3, 2.5], count)
+            assert_matches_original(one_hole(lengths.tolist(), primary.tolist(), co_analyte.tolist()), [0.5, 1.0, 2.0, 4.0])
@@ -0,0 +1,73 @@
+# Assay units and conversions between them.
+#
+# Every unit is defined by how many ppm one of it is worth, and the factors between any two units
+# are worked out once, when the module is loaded, into matrices indexed by unit. Converting is
+# then plain arithmetic, so it works the same on a float as on a whole NumPy column.
+from enum import Enum
+
+import numpy as np
+
+
+class AssayUnit(Enum):
+    PPM = 1
+    PPB = 2
+    PPT = 3
+    Percent = 4
+    GPT = 5
+    OZT = 6
+
+# How many ppm (or g/t, which is the same thing) one of each unit is worth, as a fraction so that
+# conversions between the decimal units divide by a whole power of ten rather than multiplying by
+# an inexact fraction. ppt is parts per trillion, following on from ppm and ppb, and oz/t is troy
+# ounces per short ton
+PPM_PER_UNIT = {
+    AssayUnit.PPM: (1.0, 1.0),
+    AssayUnit.PPB: (1.0, 1e3),
+    AssayUnit.PPT: (1.0, 1e6),
+    AssayUnit.Percent: (1e4, 1.0),
+    AssayUnit.GPT: (1.0, 1.0),
+    AssayUnit.OZT: (31.1034768, 0.90718474),
+}
+
+UNIT_TEXT = {
+    AssayUnit.PPM: 'ppm',
+    AssayUnit.PPB: 'ppb',
+    AssayUnit.PPT: 'ppt',
+    AssayUnit.Percent: '%',
+    AssayUnit.GPT: 'g/t',
+    AssayUnit.OZT: 'oz/t',
+}
+
+TEXT_UNITS = {text: unit for unit, text in UNIT_TEXT.items()}
+
+_UNIT_INDEX = {unit: i for i, unit in enumerate(AssayUnit)}
+
+# A value in the i-th unit of AssayUnit is converted into the j-th by multiplying it by
+# MULTIPLIERS[i, j] and dividing it by DIVISORS[i, j]
+MULTIPLIERS = np.array([[PPM_PER_UNIT[source][0] * PPM_PER_UNIT[target][1] for target in AssayUnit] for source in AssayUnit])
+DIVISORS = np.array([[PPM_PER_UNIT[source][1] * PPM_PER_UNIT[target][0] for target in AssayUnit] for source in AssayUnit])
+
+
+def _factors(from_unit: AssayUnit, to_unit: AssayUnit):
+    try:
+        i, j = _UNIT_INDEX[from_unit], _UNIT_INDEX[to_unit]
+    except KeyError:
+        raise ValueError(f"Invalid units: cannot convert {from_unit} to {to_unit}")
+    return float(MULTIPLIERS[i, j]), float(DIVISORS[i, j])
+
+def convert(values, from_unit: AssayUnit, to_unit: AssayUnit):
+    """ Converts a value, or a NumPy array of them in one go, from `from_unit` to `to_unit` """
+    if from_unit == to_unit:
+        return values
+    multiplier, divisor = _factors(from_unit, to_unit)
+    return values * multiplier / divisor
+
+def unit_text(unit: AssayUnit) -> str:
+    return UNIT_TEXT[unit]
+
+def unit_from_text(text: str) -> AssayUnit:
+    """ The AssayUnit for how a unit is written in a header or a query, regardless of case """
+    unit = TEXT_UNITS.get(text.lower())
+    if unit is None:
+        raise ValueError(f"Unsupported unit of type: {text}")
+    return unit